@@ -13,7 +13,11 @@ setup(
     entry_points={
         'console_scripts': [
             'speedy_iqa=speedy_iqa.main:main',
-            'speedy_config=speedy_iqa.wizard:main'
+            'speedy_config=speedy_iqa.wizard:main',
+            'speedy_session=speedy_iqa.session:main',
+            'speedy_benchmark=speedy_iqa.benchmark:main',
+            'speedy_telemetry=speedy_iqa.telemetry:main',
+            'speedy_preflight=speedy_iqa.preflight:main',
         ]
     },
     classifiers=[
@@ -38,6 +42,7 @@ setup(
         "py2app>=0.28.5",
         "matplotlib>=3.4.3",
         "imageio>=2.31.0",
-        "pandas"
+        "pandas",
+        "pyarrow>=12.0.0",
     ],
 )
@@ -0,0 +1,529 @@
+"""
+benchmark.py
+
+Performance benchmarks for the image decode and display pipeline, used to check that a change to the loaders is an
+improvement (and not a regression) before it is rolled out.
+
+Synthetic PNG, TIFF and DICOM images are generated at several sizes and bit depths, then the latency of each stage of
+the pipeline (`read_pixels`, `read_file`, `remap_to_8bit`, `array_to_qimage`, `MainApp.load_image` and
+`MainApp.change_image`) is measured, along with the peak memory allocated by Python and numpy (memory allocated
+inside Qt is not traced). The thread and process backends used to decode images in the background are compared by
+their decode latency and by how long each holds up the GUI thread. The results are saved as a JSON file which can be
+compared against a previous run. The benchmarks run headless, e.g.
+
+    `QT_QPA_PLATFORM=offscreen speedy_benchmark --output results.json --compare baseline.json`
+
+Classes:
+    - Fixture: A synthetic image file used by the benchmarks.
+
+Functions:
+    - make_fixtures(out_dir: str, sizes: Sequence[int]) -> List[Fixture]
+    - time_stage(func: Callable, repeats: int, warmup: int = 1, setup: Optional[Callable]) -> Dict[str, float]
+    - peak_memory(func: Callable) -> int
+    - main_thread_stall(func: Callable, interval: float) -> float
+    - run_pipeline_benchmarks(fixtures: List[Fixture], repeats: int) -> List[Dict]
+    - run_backend_benchmarks(fixtures: List[Fixture], repeats: int, backends: Sequence[str]) -> List[Dict]
+    - run_app_benchmarks(out_dir: str, sizes: Sequence[int], repeats: int) -> List[Dict]
+    - compare_results(results: Dict, baseline: Dict, threshold: float) -> List[Dict]
+    - main(): Command line entry point for running the benchmarks.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import datetime
+import tempfile
+import tracemalloc
+from statistics import median
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+DEFAULT_SIZES = (512, 2048)
+DEFAULT_REPEATS = 10
+DEFAULT_THRESHOLD = 0.1
+RESULTS_VERSION = 1
+
+
+class Fixture:
+    """
+    A synthetic image file used by the benchmarks.
+
+    :param name: A short name describing the format, bit depth and size, e.g. "png-16bit-512"
+    :type name: str
+    :param path: The path to the image file
+    :type path: str
+    """
+
+    def __init__(self, name: str, path: str):
+        self.name = name
+        self.path = path
+        self.extension = os.path.splitext(path)[1]
+
+
+def _synthetic_image(size: int, dtype: np.dtype, max_value: Optional[float] = None) -> np.ndarray:
+    """
+    Generate a smooth, noisy test image, which compresses roughly like a real radiograph (unlike pure noise).
+    """
+    rng = np.random.default_rng(size)
+    y, x = np.mgrid[0:size, 0:size].astype(np.float32) / size
+    image = 0.5 + 0.3 * np.sin(6 * x) * np.cos(4 * y) + 0.05 * rng.standard_normal((size, size), dtype=np.float32)
+    image = np.clip(image, 0, 1)
+    if np.issubdtype(dtype, np.floating):
+        return image.astype(dtype)
+    max_value = max_value if max_value is not None else np.iinfo(dtype).max
+    return (image * max_value).astype(dtype)
+
+
+def _write_dicom(path: str, image: np.ndarray, bits_stored: int, photometric: str = "MONOCHROME2"):
+    """
+    Write a minimal, uncompressed DICOM file with a rescale and window so that all the look-up tables are applied.
+    """
+    import pydicom
+    from pydicom.dataset import Dataset, FileMetaDataset
+    from pydicom.uid import ExplicitVRLittleEndian, generate_uid, SecondaryCaptureImageStorage
+
+    file_meta = FileMetaDataset()
+    file_meta.MediaStorageSOPClassUID = SecondaryCaptureImageStorage
+    file_meta.MediaStorageSOPInstanceUID = generate_uid()
+    file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+
+    ds = Dataset()
+    ds.file_meta = file_meta
+    ds.is_little_endian = True
+    ds.is_implicit_VR = False
+    ds.SOPClassUID = file_meta.MediaStorageSOPClassUID
+    ds.SOPInstanceUID = file_meta.MediaStorageSOPInstanceUID
+    ds.Modality = "OT"
+    ds.Rows, ds.Columns = image.shape
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = photometric
+    ds.BitsAllocated = 16
+    ds.BitsStored = bits_stored
+    ds.HighBit = bits_stored - 1
+    ds.PixelRepresentation = 1 if np.issubdtype(image.dtype, np.signedinteger) else 0
+    ds.RescaleSlope = 1
+    ds.RescaleIntercept = 0
+    ds.WindowCenter = int(image.mean())
+    ds.WindowWidth = int(image.max() - image.min()) or 1
+    ds.PixelData = image.tobytes()
+    pydicom.dcmwrite(path, ds, write_like_original=False)
+
+
+def make_fixtures(out_dir: str, sizes: Sequence[int] = DEFAULT_SIZES) -> List[Fixture]:
+    """
+    Generate the synthetic PNG, TIFF and DICOM images used by the benchmarks.
+
+    :param out_dir: The directory to write the images to
+    :type out_dir: str
+    :param sizes: The side lengths of the (square) images
+    :type sizes: Sequence[int]
+    :return: The generated fixtures
+    :rtype: List[Fixture]
+    """
+    import imageio as iio
+
+    os.makedirs(out_dir, exist_ok=True)
+    fixtures = []
+    for size in sizes:
+        specs = [
+            ("png-8bit", ".png", lambda p: iio.v3.imwrite(p, _synthetic_image(size, np.uint8))),
+            ("png-16bit", ".png", lambda p: iio.v3.imwrite(p, _synthetic_image(size, np.uint16))),
+            ("tiff-16bit", ".tiff", lambda p: iio.v3.imwrite(p, _synthetic_image(size, np.uint16))),
+            ("tiff-float32", ".tiff", lambda p: iio.v3.imwrite(p, _synthetic_image(size, np.float32))),
+            ("dicom-12bit", ".dcm", lambda p: _write_dicom(p, _synthetic_image(size, np.uint16, 4095), 12)),
+            ("dicom-16bit-mono1", ".dcm",
+             lambda p: _write_dicom(p, _synthetic_image(size, np.uint16), 16, "MONOCHROME1")),
+        ]
+        for name, extension, write in specs:
+            name = f"{name}-{size}"
+            path = os.path.join(out_dir, name + extension)
+            write(path)
+            fixtures.append(Fixture(name, path))
+    return fixtures
+
+
+def time_stage(func: Callable, repeats: int = DEFAULT_REPEATS, warmup: int = 1,
+               setup: Optional[Callable] = None) -> Dict[str, float]:
+    """
+    Time a function over several repeats.
+
+    :param func: The function to time, called without arguments
+    :type func: Callable
+    :param repeats: The number of timed calls
+    :type repeats: int
+    :param warmup: The number of untimed calls made first
+    :type warmup: int
+    :param setup: A function called (untimed) before each call, if any
+    :type setup: Optional[Callable]
+    :return: The minimum, median and mean duration in milliseconds
+    :rtype: Dict[str, float]
+    """
+    for _ in range(warmup):
+        func()
+    durations = []
+    for _ in range(repeats):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        durations.append((time.perf_counter() - start) * 1000)
+    return _summarise(durations)
+
+
+def _summarise(durations: List[float]) -> Dict[str, float]:
+    return {
+        'min_ms': min(durations),
+        'median_ms': median(durations),
+        'mean_ms': sum(durations) / len(durations),
+    }
+
+
+def peak_memory(func: Callable) -> int:
+    """
+    Measure the peak memory allocated by Python and numpy during a single call of a function. Timing is measured
+    separately, as tracing slows down allocations.
+
+    :param func: The function to measure, called without arguments
+    :type func: Callable
+    :return: The peak traced memory in bytes
+    :rtype: int
+    """
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def _measure(name: str, stage: str, func: Callable, repeats: int, setup: Optional[Callable] = None) -> Dict:
+    result = {'fixture': name, 'stage': stage}
+    result.update(time_stage(func, repeats, setup=setup))
+    result['peak_mb'] = peak_memory(func) / (1024 * 1024)
+    return result
+
+
+def run_pipeline_benchmarks(fixtures: List[Fixture], repeats: int = DEFAULT_REPEATS) -> List[Dict]:
+    """
+    Benchmark the decode stages of the pipeline for each fixture: `read_pixels` (decoding without any look-up tables
+    or remapping), `read_file`, `remap_to_8bit`, `array_to_qimage` and the conversion to a QPixmap.
+
+    :param fixtures: The fixtures to benchmark
+    :type fixtures: List[Fixture]
+    :param repeats: The number of timed calls of each stage
+    :type repeats: int
+    :return: The results of each stage for each fixture
+    :rtype: List[Dict]
+    """
+    from PyQt6.QtGui import QPixmap
+    from speedy_iqa.main_app import MainApp
+    from speedy_iqa.decoders import read_pixels
+    from speedy_iqa.utils import remap_to_8bit, array_to_qimage
+
+    results = []
+    for fixture in fixtures:
+        decoded = np.array(read_pixels(fixture.path, fixture.extension))
+        image = MainApp.read_file(fixture.path, fixture.extension)
+        qimage = array_to_qimage(image)
+        stages = [
+            ("read_pixels", lambda: np.array(read_pixels(fixture.path, fixture.extension))),
+            ("read_file", lambda: MainApp.read_file(fixture.path, fixture.extension)),
+            ("remap_to_8bit", lambda: remap_to_8bit(decoded)),
+            ("array_to_qimage", lambda: array_to_qimage(image)),
+            ("QPixmap.fromImage", lambda: QPixmap.fromImage(qimage)),
+        ]
+        for stage, func in stages:
+            results.append(_measure(fixture.name, stage, func, repeats))
+    return results
+
+
+def main_thread_stall(func: Callable, interval: float = 0.001) -> float:
+    """
+    Measure how long the calling (GUI) thread is held up while a function runs in a background thread. The calling
+    thread repeatedly sleeps for a short interval, as the Qt event loop would wait for events, and the longest
+    overshoot of the interval is returned; this is the longest a key press would have waited to be handled.
+
+    :param func: The function to run in the background, called without arguments
+    :type func: Callable
+    :param interval: The interval slept for by the calling thread, in seconds
+    :type interval: float
+    :return: The longest overshoot of the interval in milliseconds
+    :rtype: float
+    """
+    import threading
+
+    worker = threading.Thread(target=func)
+    worker.start()
+    longest = 0.0
+    while worker.is_alive():
+        start = time.perf_counter()
+        time.sleep(interval)
+        longest = max(longest, time.perf_counter() - start - interval)
+    worker.join()
+    return longest * 1000
+
+
+def run_backend_benchmarks(fixtures: List[Fixture], repeats: int = DEFAULT_REPEATS,
+                           backends: Sequence[str] = ('thread', 'process')) -> List[Dict]:
+    """
+    Benchmark the background decode backends (see `speedy_iqa.decoding`) for each fixture: `decode[<backend>]` is the
+    time from submitting a file until its decoded image can be used by the GUI thread, and `stall[<backend>]` is the
+    longest the GUI thread is held up while the file is decoded (see `main_thread_stall`). The peak memory is that
+    allocated in the GUI process.
+
+    :param fixtures: The fixtures to benchmark
+    :type fixtures: List[Fixture]
+    :param repeats: The number of timed decodes of each fixture
+    :type repeats: int
+    :param backends: The names of the backends to benchmark
+    :type backends: Sequence[str]
+    :return: The results of each stage for each fixture
+    :rtype: List[Dict]
+    """
+    from speedy_iqa.decoding import create_decode_backend
+
+    results = []
+    for backend_name in backends:
+        backend = create_decode_backend(backend_name)
+        try:
+            # Start the workers before timing
+            for future in [backend.submit(fixture.path, fixture.extension) for fixture in fixtures]:
+                future.result()
+            for fixture in fixtures:
+                def decode():
+                    return backend.submit(fixture.path, fixture.extension).result()
+
+                results.append(_measure(fixture.name, f"decode[{backend.name}]", decode, repeats))
+                stalls = [main_thread_stall(decode) for _ in range(repeats)]
+                result = {'fixture': fixture.name, 'stage': f"stall[{backend.name}]"}
+                result.update(_summarise(stalls))
+                result['peak_mb'] = results[-1]['peak_mb']
+                results.append(result)
+        finally:
+            backend.shutdown()
+    return results
+
+
+def _write_config(path: str, out_dir: str):
+    """
+    Write a config file for the benchmarked app, with the image cache disabled so that decoding is measured.
+    """
+    import yaml
+
+    config = {
+        'radiobuttons_page1': [{'title': "Overall Quality", 'labels': [1, 2, 3, 4]}],
+        'radiobuttons_page2': [{'title': "Contrast", 'labels': [1, 2, 3, 4]}],
+        'max_backups': 1,
+        'backup_dir': os.path.join(out_dir, 'backups'),
+        'log_dir': os.path.join(out_dir, 'logs'),
+        'backup_interval': 30,
+        'session_format': 'json',
+        'cache_max_size': 0,
+        'task': 'Benchmark',
+    }
+    with open(path, 'w') as f:
+        yaml.dump(config, f)
+
+
+def run_app_benchmarks(out_dir: str, sizes: Sequence[int] = DEFAULT_SIZES,
+                       repeats: int = DEFAULT_REPEATS) -> List[Dict]:
+    """
+    Benchmark `MainApp.load_image` and `MainApp.change_image` on sessions of DICOM images and references of each size.
+
+    :param out_dir: The directory to write the images, config and settings to
+    :type out_dir: str
+    :param sizes: The side lengths of the (square) images
+    :type sizes: Sequence[int]
+    :param repeats: The number of timed calls of each stage
+    :type repeats: int
+    :return: The results of each stage for each size
+    :rtype: List[Dict]
+    """
+    from PyQt6.QtCore import QSettings
+    from PyQt6.QtWidgets import QApplication
+    from speedy_iqa.main_app import MainApp
+
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    config_path = os.path.join(out_dir, 'benchmark_config.yml')
+    _write_config(config_path, out_dir)
+
+    results = []
+    for size in sizes:
+        image_dir = os.path.join(out_dir, f'app-{size}', 'images')
+        reference_dir = os.path.join(out_dir, f'app-{size}', 'references')
+        os.makedirs(image_dir, exist_ok=True)
+        os.makedirs(reference_dir, exist_ok=True)
+        image = _synthetic_image(size, np.uint16, 4095)
+        n_images = 4
+        for i in range(n_images):
+            _write_dicom(os.path.join(reference_dir, f'image{i}.dcm'), image, 12)
+            _write_dicom(os.path.join(image_dir, f'image{i}__1.dcm'), image, 12)
+
+        settings = QSettings(os.path.join(out_dir, f'app-{size}', 'settings.ini'), QSettings.Format.IniFormat)
+        settings.setValue('image_path', image_dir)
+        settings.setValue('reference_path', reference_dir)
+        settings.setValue('reference_delimiter', '__')
+        settings.setValue('json_path', '')
+        settings.setValue('new_json', True)
+        settings.setValue('last_config_file', config_path)
+
+        window = MainApp(app, settings)
+        window.show()
+        app.processEvents()
+
+        counter = {'index': 0}
+
+        def change_image():
+            counter['index'] = (counter['index'] + 1) % n_images
+            window.change_image("go_to", counter['index'])
+            app.processEvents()
+
+        def view_image():
+            # Give the background decoding the time a reader would spend looking at the image
+            for future in list(window.prefetched.values()):
+                try:
+                    future.result()
+                except Exception:
+                    pass
+
+        name = f"app-dicom-12bit-{size}"
+        results.append(_measure(name, "load_image", window.load_image, repeats))
+        results.append(_measure(name, "change_image", change_image, repeats, setup=view_image))
+
+        window.timer.stop()
+        window.shutdown_decoder()
+        window.hide()
+        window.deleteLater()
+        app.processEvents()
+    return results
+
+
+def compare_results(results: Dict, baseline: Dict, threshold: float = DEFAULT_THRESHOLD) -> List[Dict]:
+    """
+    Compare the median latency of each stage against a previous run.
+
+    :param results: The results of this run
+    :type results: Dict
+    :param baseline: The results of the previous run
+    :type baseline: Dict
+    :param threshold: The relative slow down above which a stage is flagged as a regression, e.g. 0.1 for 10%
+    :type threshold: float
+    :return: The comparison of each stage found in both runs
+    :rtype: List[Dict]
+    """
+    baseline_medians = {(r['fixture'], r['stage']): r['median_ms'] for r in baseline.get('results', [])}
+    comparisons = []
+    for result in results['results']:
+        key = (result['fixture'], result['stage'])
+        if key not in baseline_medians or baseline_medians[key] <= 0:
+            continue
+        ratio = result['median_ms'] / baseline_medians[key]
+        comparisons.append({
+            'fixture': result['fixture'],
+            'stage': result['stage'],
+            'baseline_ms': baseline_medians[key],
+            'median_ms': result['median_ms'],
+            'ratio': ratio,
+            'regression': ratio > 1 + threshold,
+        })
+    return comparisons
+
+
+def _environment() -> Dict:
+    import pydicom
+    from PyQt6.QtCore import PYQT_VERSION_STR
+
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'numpy': np.__version__,
+        'pydicom': pydicom.__version__,
+        'pyqt': PYQT_VERSION_STR,
+    }
+
+
+def _print_results(results: List[Dict]):
+    print(f"{'fixture':<28}{'stage':<20}{'min ms':>10}{'median ms':>12}{'peak MB':>10}")
+    for r in results:
+        print(f"{r['fixture']:<28}{r['stage']:<20}{r['min_ms']:>10.2f}{r['median_ms']:>12.2f}{r['peak_mb']:>10.1f}")
+
+
+def _print_comparisons(comparisons: List[Dict]):
+    print(f"\n{'fixture':<28}{'stage':<20}{'baseline ms':>12}{'median ms':>12}{'change':>9}")
+    for c in comparisons:
+        flag = "  REGRESSION" if c['regression'] else ""
+        print(f"{c['fixture']:<28}{c['stage']:<20}{c['baseline_ms']:>12.2f}{c['median_ms']:>12.2f}"
+              f"{(c['ratio'] - 1) * 100:>8.1f}%{flag}")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Command line entry point to run the benchmarks, e.g.
+        `speedy_benchmark --sizes 512 2048 --output results.json --compare baseline.json`
+
+    Returns 1 if any stage is slower than the baseline by more than the threshold, otherwise 0.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the Speedy IQA image decode and display pipeline.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES),
+                        help="Side lengths of the synthetic images (default: %(default)s).")
+    parser.add_argument('--repeats', type=int, default=DEFAULT_REPEATS,
+                        help="Number of timed repeats of each stage (default: %(default)s).")
+    parser.add_argument('--output', help="Path to save the results to as JSON.")
+    parser.add_argument('--compare', help="Path to the JSON results of a previous run to compare against.")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help="Relative slow down flagged as a regression (default: %(default)s).")
+    parser.add_argument('--skip-app', action='store_true',
+                        help="Only benchmark the decode stages, not the main window.")
+    parser.add_argument('--skip-backends', action='store_true',
+                        help="Do not benchmark the thread and process decode backends.")
+    parser.add_argument('--keep-fixtures', help="Directory to write the fixtures to and keep them in.")
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from PyQt6.QtWidgets import QApplication
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+
+    out_dir = args.keep_fixtures or tempfile.mkdtemp(prefix='speedy_benchmark_')
+    try:
+        fixtures = make_fixtures(os.path.join(out_dir, 'fixtures'), args.sizes)
+        results = run_pipeline_benchmarks(fixtures, args.repeats)
+        if not args.skip_backends:
+            results += run_backend_benchmarks(fixtures, args.repeats)
+        if not args.skip_app:
+            results += run_app_benchmarks(out_dir, args.sizes, args.repeats)
+    finally:
+        if not args.keep_fixtures:
+            shutil.rmtree(out_dir, ignore_errors=True)
+
+    output = {
+        'version': RESULTS_VERSION,
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'environment': _environment(),
+        'repeats': args.repeats,
+        'results': results,
+    }
+    _print_results(results)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2)
+        print(f"\nSaved results to {args.output}")
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        comparisons = compare_results(output, baseline, args.threshold)
+        _print_comparisons(comparisons)
+        if any(c['regression'] for c in comparisons):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,135 @@
+"""
+buffers.py
+
+A pool of preallocated numpy arrays, reused across image reads so that the intermediate arrays of the look-up table
+and remapping chain are not allocated (and freed) afresh for every image.
+
+Buffers are keyed by shape and dtype. A buffer is borrowed for the duration of a computation and returned to the pool
+afterwards, so the pool can be shared by several threads (e.g. the thumbnail workers); each thread borrows its own
+buffer. The total size of the idle buffers is capped, with the least recently returned buffers dropped first, so the
+memory held by the pool stays flat over a long session with images of many sizes.
+
+Classes:
+    - BufferPool: Thread-safe pool of reusable numpy arrays, keyed by shape and dtype.
+
+Functions:
+    - get_buffer_pool() -> BufferPool
+"""
+
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Iterator, Tuple
+
+import numpy as np
+
+DEFAULT_MAX_POOL_SIZE_MB = 256
+
+
+class BufferPool:
+    """
+    Thread-safe pool of reusable numpy arrays, keyed by shape and dtype.
+
+    :param max_size_mb: The maximum total size of the idle buffers kept in the pool, in megabytes
+    :type max_size_mb: float
+    """
+
+    def __init__(self, max_size_mb: float = DEFAULT_MAX_POOL_SIZE_MB):
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self._lock = threading.Lock()
+        self._free = OrderedDict()
+        self._free_size = 0
+        self.allocations = 0
+
+    @property
+    def free_size(self) -> int:
+        """
+        The total size of the idle buffers in the pool, in bytes.
+        """
+        return self._free_size
+
+    def acquire(self, shape: Tuple[int, ...], dtype: np.dtype) -> np.ndarray:
+        """
+        Take a buffer out of the pool, allocating a new one if there is no idle buffer of the shape and dtype. The
+        contents of the buffer are undefined.
+
+        :param shape: The shape of the buffer
+        :type shape: Tuple[int, ...]
+        :param dtype: The dtype of the buffer
+        :type dtype: np.dtype
+        :return: The buffer
+        :rtype: np.ndarray
+        """
+        key = (tuple(shape), np.dtype(dtype).str)
+        with self._lock:
+            buffers = self._free.get(key)
+            if buffers:
+                buffer = buffers.pop()
+                if not buffers:
+                    del self._free[key]
+                self._free_size -= buffer.nbytes
+                return buffer
+            self.allocations += 1
+        return np.empty(shape, dtype=dtype)
+
+    def release(self, buffer: np.ndarray):
+        """
+        Return a buffer to the pool. The buffer must not be used by the caller afterwards.
+
+        :param buffer: The buffer, as returned by `acquire`
+        :type buffer: np.ndarray
+        """
+        if buffer.nbytes > self.max_size:
+            return
+        key = (buffer.shape, buffer.dtype.str)
+        with self._lock:
+            self._free.setdefault(key, []).append(buffer)
+            self._free.move_to_end(key)
+            self._free_size += buffer.nbytes
+            while self._free_size > self.max_size:
+                oldest_key, buffers = next(iter(self._free.items()))
+                self._free_size -= buffers.pop(0).nbytes
+                if not buffers:
+                    del self._free[oldest_key]
+
+    @contextmanager
+    def borrow(self, shape: Tuple[int, ...], dtype: np.dtype) -> Iterator[np.ndarray]:
+        """
+        Borrow a buffer for the duration of a `with` block, e.g.
+
+            with pool.borrow(image.shape, np.float64) as work:
+                ...
+
+        :param shape: The shape of the buffer
+        :type shape: Tuple[int, ...]
+        :param dtype: The dtype of the buffer
+        :type dtype: np.dtype
+        :return: The buffer, whose contents are undefined
+        :rtype: Iterator[np.ndarray]
+        """
+        buffer = self.acquire(shape, dtype)
+        try:
+            yield buffer
+        finally:
+            self.release(buffer)
+
+    def clear(self):
+        """
+        Drop every idle buffer.
+        """
+        with self._lock:
+            self._free.clear()
+            self._free_size = 0
+
+
+_buffer_pool = BufferPool()
+
+
+def get_buffer_pool() -> BufferPool:
+    """
+    Get the buffer pool shared by the image readers.
+
+    :return: The shared buffer pool
+    :rtype: BufferPool
+    """
+    return _buffer_pool
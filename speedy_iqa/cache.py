@@ -0,0 +1,332 @@
+"""
+cache.py
+
+Persistent on-disk cache of decoded images, so that revisiting an image (e.g. when a session is reopened on another
+day) does not require it to be decoded again.
+
+Each entry is keyed by the absolute path, size and modification time of the source file, so a file which is changed
+on disk is simply decoded again, and the whole cache is cleared if the decoding of images has changed since it was
+written (see `speedy_iqa.decoders.DECODE_VERSION`). For each entry, the cache stores the decoded 8-bit image exactly as
+it is displayed (the full resolution is kept because a downsampled image cannot be used for quality assessment), a
+small downsampled preview for use as a thumbnail and the decode metadata (shape and dtype). The total size of the
+cache is capped and the least recently used entries are evicted first.
+
+Classes:
+    - PreviewCache: Size-capped, least recently used on-disk cache of decoded images and previews.
+
+Functions:
+    - make_preview(image: np.ndarray, max_size: int) -> np.ndarray
+"""
+
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from speedy_iqa.utils import split_image_key, join_image_key
+from speedy_iqa.storage import stat_file
+from speedy_iqa.decoders import DECODE_VERSION
+
+logger = logging.getLogger('fileLogger')
+
+_INDEX_FILENAME = 'index.json'
+_INDEX_VERSION = 1
+# The names of the cached files, see `PreviewCache._entry_path`
+_ENTRY_NAME = re.compile(r'^([0-9a-f]{40})\.(?:image|preview)\.npy$')
+
+
+def make_preview(image: np.ndarray, max_size: int) -> np.ndarray:
+    """
+    Downsample an image so that its longest side is at most max_size pixels. Uses strided sampling, which is fast and
+    good enough for a thumbnail.
+
+    :param image: The image to downsample
+    :type image: np.ndarray
+    :param max_size: The maximum length of the longest side of the preview
+    :type max_size: int
+    :return: The downsampled image
+    :rtype: np.ndarray
+    """
+    step = max(1, int(np.ceil(max(image.shape[:2]) / max_size)))
+    return np.ascontiguousarray(image[::step, ::step])
+
+
+class PreviewCache:
+    """
+    Size-capped, least recently used on-disk cache of decoded images and previews.
+
+    The cache is safe to use from several threads (e.g. thumbnail workers). The index of entries is held in memory and
+    only written to disk on `flush`; cached files missing from the index (e.g. after a crash) are removed on start-up.
+
+    :param cache_dir: The directory in which to store the cache
+    :type cache_dir: str
+    :param max_size_mb: The maximum size of the cache in megabytes
+    :type max_size_mb: float
+    :param preview_size: The maximum length of the longest side of the previews
+    :type preview_size: int
+    """
+
+    def __init__(self, cache_dir: str, max_size_mb: float = 2048, preview_size: int = 256):
+        self.cache_dir = os.path.normpath(os.path.abspath(os.path.expanduser(cache_dir)))
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self.preview_size = preview_size
+        self._lock = threading.RLock()
+        self._entries = OrderedDict()
+        self._path_keys = {}
+        self._total_size = 0
+        self._dirty = False
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._load_index()
+
+    @property
+    def total_size(self) -> int:
+        """
+        The total size of the cached files in bytes.
+        """
+        return self._total_size
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def file_key(path: str) -> Optional[str]:
+        """
+        Get the cache key of a file from its absolute path, size and modification time. Images within a file holding
+        many images (see `speedy_iqa.utils.split_image_key`) are keyed by the file and the image within it, and files
+        within an archive by their size and the modification time of the archive.
+
+        :param path: The path to the source file, or an image key
+        :type path: str
+        :return: The cache key, or None if the file does not exist
+        :rtype: Optional[str]
+        """
+        file_path, member = split_image_key(path)
+        stat = stat_file(file_path)
+        if stat is None:
+            return None
+        file_path = join_image_key(os.path.normpath(os.path.abspath(file_path)), member)
+        identity = f"{file_path}|{stat[0]}|{stat[1]}"
+        return hashlib.sha1(identity.encode('utf-8')).hexdigest()
+
+    def get(self, path: str) -> Optional[np.ndarray]:
+        """
+        Get the decoded image for a file, if it is in the cache.
+
+        :param path: The path to the source file
+        :type path: str
+        :return: The decoded 8-bit image, or None if it is not cached
+        :rtype: Optional[np.ndarray]
+        """
+        return self._read(path, 'image')
+
+    def get_preview(self, path: str) -> Optional[np.ndarray]:
+        """
+        Get the downsampled preview for a file, if it is in the cache.
+
+        :param path: The path to the source file
+        :type path: str
+        :return: The preview, or None if it is not cached
+        :rtype: Optional[np.ndarray]
+        """
+        return self._read(path, 'preview')
+
+    def get_metadata(self, path: str) -> Optional[Dict]:
+        """
+        Get the decode metadata (shape and dtype of the decoded image) for a file, if it is in the cache.
+
+        :param path: The path to the source file
+        :type path: str
+        :return: The metadata, or None if it is not cached
+        :rtype: Optional[Dict]
+        """
+        key = self.file_key(path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            return {'shape': tuple(entry['shape']), 'dtype': entry['dtype']}
+
+    def has_image(self, path: str) -> bool:
+        """
+        Check whether the decoded image for a file is in the cache, without reading it.
+
+        :param path: The path to the source file
+        :type path: str
+        :return: True if the decoded image is cached
+        :rtype: bool
+        """
+        key = self.file_key(path)
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and entry.get('has_image', True)
+
+    def put(self, path: str, image: np.ndarray):
+        """
+        Add the decoded image for a file to the cache, along with its preview. Any entry for a previous version of the
+        file is replaced and the least recently used entries are evicted if the cache is over its size limit.
+
+        :param path: The path to the source file
+        :type path: str
+        :param image: The decoded 8-bit image
+        :type image: np.ndarray
+        """
+        image = np.ascontiguousarray(image)
+        if image.nbytes > self.max_size:
+            return
+        arrays = {'image': image, 'preview': make_preview(image, self.preview_size)}
+        self._add(path, arrays, image.shape, image.dtype)
+
+    def put_preview(self, path: str, preview: np.ndarray, shape: Tuple[int, ...], dtype: np.dtype):
+        """
+        Add only the preview of a file to the cache (e.g. when generating thumbnails), so that it does not take up the
+        space of the full image. Does nothing if the full image is already cached.
+
+        :param path: The path to the source file
+        :type path: str
+        :param preview: The downsampled 8-bit preview
+        :type preview: np.ndarray
+        :param shape: The shape of the full decoded image
+        :type shape: Tuple[int, ...]
+        :param dtype: The dtype of the full decoded image
+        :type dtype: np.dtype
+        """
+        key = self.file_key(path)
+        with self._lock:
+            if key in self._entries and self._entries[key].get('has_image', True):
+                return
+        self._add(path, {'preview': np.ascontiguousarray(preview)}, shape, dtype)
+
+    def clear(self):
+        """
+        Remove every entry from the cache.
+        """
+        with self._lock:
+            for key in list(self._entries):
+                self._remove(key)
+            self._dirty = True
+        self.flush()
+
+    def flush(self):
+        """
+        Write the index of entries to disk, if it has changed.
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            index = {'version': _INDEX_VERSION, 'decode_version': DECODE_VERSION, 'entries': self._entries}
+            tmp_path = os.path.join(self.cache_dir, _INDEX_FILENAME + '.tmp')
+            try:
+                with open(tmp_path, 'w') as f:
+                    json.dump(index, f)
+                os.replace(tmp_path, os.path.join(self.cache_dir, _INDEX_FILENAME))
+                self._dirty = False
+            except OSError as e:
+                logger.warning(f"Failed to write the preview cache index: {e}")
+
+    def _add(self, path: str, arrays: Dict[str, np.ndarray], shape: Tuple[int, ...], dtype: np.dtype):
+        key = self.file_key(path)
+        if key is None or self.max_size <= 0:
+            return
+        try:
+            for kind, array in arrays.items():
+                np.save(self._entry_path(key, kind), array, allow_pickle=False)
+        except OSError as e:
+            logger.warning(f"Failed to write {path} to the preview cache: {e}")
+            return
+        size = sum(os.path.getsize(self._entry_path(key, kind)) for kind in arrays)
+
+        norm_path = os.path.normpath(os.path.abspath(path))
+        with self._lock:
+            old_key = self._path_keys.get(norm_path)
+            if old_key is not None and old_key != key:
+                self._remove(old_key)
+            if key in self._entries:
+                self._total_size -= self._entries[key]['size']
+            self._entries[key] = {
+                'path': norm_path,
+                'size': size,
+                'shape': list(shape),
+                'dtype': str(dtype),
+                'has_image': 'image' in arrays,
+                'last_access': time.time(),
+            }
+            self._entries.move_to_end(key)
+            self._path_keys[norm_path] = key
+            self._total_size += size
+            self._evict()
+            self._dirty = True
+
+    def _entry_path(self, key: str, kind: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.{kind}.npy")
+
+    def _read(self, path: str, kind: str) -> Optional[np.ndarray]:
+        key = self.file_key(path)
+        with self._lock:
+            if key not in self._entries:
+                return None
+            if kind == 'image' and not self._entries[key].get('has_image', True):
+                return None
+            self._entries.move_to_end(key)
+            self._entries[key]['last_access'] = time.time()
+            self._dirty = True
+        try:
+            return np.load(self._entry_path(key, kind), allow_pickle=False)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Failed to read {path} from the preview cache: {e}")
+            with self._lock:
+                self._remove(key)
+            return None
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._total_size -= entry['size']
+        if self._path_keys.get(entry['path']) == key:
+            del self._path_keys[entry['path']]
+        for kind in ('image', 'preview'):
+            try:
+                os.remove(self._entry_path(key, kind))
+            except OSError:
+                pass
+
+    def _evict(self):
+        while self._total_size > self.max_size and self._entries:
+            self._remove(next(iter(self._entries)))
+
+    def _load_index(self):
+        index_path = os.path.join(self.cache_dir, _INDEX_FILENAME)
+        index = {}
+        if os.path.isfile(index_path):
+            try:
+                with open(index_path, 'r') as f:
+                    index = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Failed to read the preview cache index, the cache will be rebuilt: {e}")
+        # Images decoded by an older version are dropped, and their files removed below
+        if index.get('version') != _INDEX_VERSION or index.get('decode_version') != DECODE_VERSION:
+            index = {}
+        entries = sorted(index.get('entries', {}).items(), key=lambda item: item[1].get('last_access', 0))
+        for key, entry in entries:
+            if not os.path.isfile(self._entry_path(key, 'preview')):
+                continue
+            self._entries[key] = entry
+            self._path_keys[entry['path']] = key
+            self._total_size += entry['size']
+        self._evict()
+
+        # Remove any cached files which are not in the index, leaving any other files in the cache directory alone
+        for filename in os.listdir(self.cache_dir):
+            match = _ENTRY_NAME.match(filename)
+            if match is not None and match.group(1) not in self._entries:
+                try:
+                    os.remove(os.path.join(self.cache_dir, filename))
+                except OSError:
+                    pass
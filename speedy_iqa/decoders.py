@@ -0,0 +1,744 @@
+"""
+decoders.py
+
+Registry of the decoders used to read image files, so that new formats (or faster libraries for existing ones) can be
+added by registering a decoder, without changing the rest of the app.
+
+Each decoder declares the file extensions and magic bytes of the formats it reads, and what it can do:
+
+    - reduced_resolution: it can decode an image at a lower resolution (e.g. JPEG DCT scaling or TIFF pyramid levels),
+      which is used for the thumbnails.
+    - memmap: it can memory-map uncompressed pixel data rather than read it into memory.
+    - frames: it reads only the first frame of multi-frame files, rather than decoding them all.
+    - stacks: it reads files holding many images (e.g. the outputs of a model saved as one .npy stack or HDF5
+      dataset), each addressed by an image key such as 'stack.npy::12' (see `speedy_iqa.utils.split_image_key`). Only
+      the image being shown is read from the file, and the directory index lists one key per image.
+
+Float images are remapped to 8-bit from the range of their own values (see `remap_float_to_8bit`), and integer images
+from the full range of their dtype.
+
+Files are matched to decoders by their extension (case-insensitively), or by their magic bytes if no decoder is
+registered for the extension. Where several decoders can read an extension, each is timed on the first file of that
+extension read in the session and the fastest is used from then on. Decoders whose output differs in shape from that
+of the first registered decoder are not considered, and if the chosen decoder fails on a file the others are tried.
+
+Files within a zip or tar archive (see `speedy_iqa.storage`) are given to decoders as open files rather than paths, so
+they are read from the archive without being extracted, but are not memory-mapped.
+
+Classes:
+    - Decoder: Base class of the decoders.
+    - PydicomDecoder: Reads DICOM files with pydicom, memory-mapping uncompressed pixel data.
+    - TifffileDecoder: Reads TIFF files with tifffile, memory-mapping uncompressed pixel data.
+    - PillowDecoder: Reads common 8 and 16-bit image formats with Pillow.
+    - ImageioDecoder: Reads any format imageio supports.
+    - NumpyDecoder: Reads images and stacks of images saved as NumPy .npy files, memory-mapped.
+    - HDF5Decoder: Reads the images in HDF5 datasets with h5py.
+    - NiftiDecoder: Reads the slices of NIfTI volumes with nibabel.
+    - DecoderRegistry: Matches image files to decoders and chooses the fastest decoder for each extension.
+
+Functions:
+    - get_decoder_registry() -> DecoderRegistry
+    - register_decoder(decoder: Decoder, first: bool)
+    - remap_float_to_8bit(image: np.ndarray, out: Optional[np.ndarray]) -> np.ndarray
+    - image_extensions() -> Tuple[str, ...]
+    - image_members(file_path: str) -> Optional[List[str]]
+    - read_pixels(file_path: str, file_extension: str) -> np.ndarray
+    - read_file(file_path: str, file_extension: str, allocate: Optional[Callable], max_size: Optional[int])
+        -> np.ndarray
+"""
+
+import os
+import re
+import gzip
+import time
+import logging
+import threading
+from typing import BinaryIO, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import imageio as iio
+
+from speedy_iqa.image_io import read_dicom_pixels, memmap_tiff, apply_luts, tifffile
+from speedy_iqa.utils import remap_to_8bit, remap_range_to_8bit, split_image_key, image_extension
+from speedy_iqa.buffers import get_buffer_pool
+from speedy_iqa.storage import open_source, is_file, read_header
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+try:
+    import nibabel
+except ImportError:
+    nibabel = None
+
+logger = logging.getLogger('fileLogger')
+
+# The number of bytes read from the start of a file to match its magic bytes
+_MAGIC_LENGTH = 132
+CAPABILITIES = ('reduced_resolution', 'memmap', 'frames', 'stacks')
+# The version of the images given by `read_file`, stored with the images in the preview cache (see `speedy_iqa.cache`).
+# Increase it whenever a change alters the decoded images (e.g. the remapping of the pixel values, or which frame is
+# read), so that images cached by an older version are decoded again.
+DECODE_VERSION = 2
+
+
+class Decoder:
+    """
+    Base class of the decoders. Subclasses set the extensions (lower case, with the leading dot), magic bytes (as
+    (offset, bytes) pairs) and capability flags of the formats they read, and implement `read_pixels`.
+    """
+    name = ""
+    extensions: Tuple[str, ...] = ()
+    magic: Tuple[Tuple[int, bytes], ...] = ()
+    reduced_resolution = False
+    memmap = False
+    frames = False
+    stacks = False
+
+    def available(self) -> bool:
+        """
+        Check whether the decoder can be used, i.e. whether the libraries it needs are installed.
+
+        :return: True if the decoder can be used
+        :rtype: bool
+        """
+        return True
+
+    def matches_magic(self, header: bytes) -> bool:
+        """
+        Check whether the start of a file matches the magic bytes of the decoder's formats.
+
+        :param header: The first bytes of the file
+        :type header: bytes
+        :return: True if the file matches
+        :rtype: bool
+        """
+        return any(header[offset:offset + len(magic)] == magic for offset, magic in self.magic)
+
+    def members(self, file_path: str) -> Optional[List[str]]:
+        """
+        List the images within a file holding many images, for decoders which read stacks.
+
+        :param file_path: The path to the file
+        :type file_path: str
+        :return: The images within the file, to be joined to its path with `speedy_iqa.utils.join_image_key`, or None
+            if the file holds a single image
+        :rtype: Optional[List[str]]
+        """
+        return None
+
+    def read_pixels(self, file_path: str, max_size: Optional[int] = None) -> np.ndarray:
+        """
+        Read the stored pixel values of an image file, without applying any look-up tables or remapping.
+
+        :param file_path: The path to the image file, or an image key for decoders which read stacks
+        :type file_path: str
+        :param max_size: If set, decoders which support reduced resolution decoding may return a smaller image,
+            whose longest side is at least this long
+        :type max_size: Optional[int]
+        :return: The pixel array
+        :rtype: np.ndarray
+        """
+        raise NotImplementedError
+
+    def read_file(self, file_path: str, allocate: Optional[Callable[[Tuple[int, ...]], np.ndarray]] = None,
+                  max_size: Optional[int] = None) -> np.ndarray:
+        """
+        Read an image file and remap it to 8-bit for display.
+
+        :param file_path: The path to the image file
+        :type file_path: str
+        :param allocate: Optional function returning the uint8 array to write the image to, given its shape
+        :type allocate: Optional[Callable[[Tuple[int, ...]], np.ndarray]]
+        :param max_size: See `read_pixels`
+        :type max_size: Optional[int]
+        :return: The 8-bit image
+        :rtype: np.ndarray
+        """
+        image = self.read_pixels(file_path, max_size)
+        out = allocate(image.shape) if allocate is not None else None
+        if np.issubdtype(image.dtype, np.floating):
+            return remap_float_to_8bit(image, out)
+        return remap_to_8bit(image, out=out)
+
+
+def remap_float_to_8bit(image: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Remap a float image to 8-bit from the range of its own values. Float images (e.g. the outputs of a model) have no
+    fixed range of values, and the full range of the dtype is too wide to show any contrast. NaN and infinite pixels
+    are shown as the lowest value, and an image with a single value is shown as black.
+
+    :param image: The float image
+    :type image: np.ndarray
+    :param out: Optional uint8 array, of the same shape as the image, to write the output to
+    :type out: Optional[np.ndarray]
+    :return: The 8-bit image
+    :rtype: np.ndarray
+    """
+    if out is None:
+        out = np.empty(image.shape, dtype=np.uint8)
+    with get_buffer_pool().borrow(image.shape, np.float64) as work:
+        np.copyto(work, image)
+        finite = np.isfinite(work)
+        if finite.all():
+            low, high = work.min(), work.max()
+        elif finite.any():
+            low, high = work[finite].min(), work[finite].max()
+            work[~finite] = low
+        else:
+            low = high = 0.0
+            work.fill(0.0)
+        remap_range_to_8bit(work, low, high, out)
+    return out
+
+
+class PydicomDecoder(Decoder):
+    """
+    Reads DICOM files with pydicom, memory-mapping uncompressed pixel data, and applies their look-up tables.
+    """
+    name = "pydicom"
+    extensions = ('.dcm', '.dicom')
+    magic = ((128, b'DICM'),)
+    memmap = True
+
+    def read_pixels(self, file_path: str, max_size: Optional[int] = None) -> np.ndarray:
+        with open_source(file_path) as source:
+            return read_dicom_pixels(source)[0]
+
+    def read_file(self, file_path: str, allocate: Optional[Callable[[Tuple[int, ...]], np.ndarray]] = None,
+                  max_size: Optional[int] = None) -> np.ndarray:
+        with open_source(file_path) as source:
+            image, ds = read_dicom_pixels(source)
+        return apply_luts(image, ds, out=allocate(image.shape) if allocate is not None else None)
+
+
+class TifffileDecoder(Decoder):
+    """
+    Reads TIFF files with tifffile, memory-mapping uncompressed single page files. Pyramidal files are read at the
+    smallest level large enough for reduced resolution decoding.
+    """
+    name = "tifffile"
+    extensions = ('.tif', '.tiff')
+    magic = ((0, b'II*\x00'), (0, b'MM\x00*'), (0, b'II+\x00'), (0, b'MM\x00+'))
+    reduced_resolution = True
+    memmap = True
+    frames = True
+
+    def available(self) -> bool:
+        return tifffile is not None
+
+    def read_pixels(self, file_path: str, max_size: Optional[int] = None) -> np.ndarray:
+        with open_source(file_path) as source:
+            if max_size is None and isinstance(source, str):
+                image = memmap_tiff(source)
+                if image is not None:
+                    return image
+            with tifffile.TiffFile(source) as tif:
+                series = tif.series[0]
+                level = series
+                if max_size is not None:
+                    # The levels are ordered from the largest to the smallest
+                    for candidate in series.levels[1:]:
+                        if max(candidate.keyframe.imagelength, candidate.keyframe.imagewidth) < max_size:
+                            break
+                        level = candidate
+                return level.keyframe.asarray()
+
+
+class PillowDecoder(Decoder):
+    """
+    Reads PNG, JPEG, GIF and BMP files with Pillow. JPEG files are decoded at a reduced scale for reduced resolution
+    decoding. Palette and other colour modes are converted to RGB(A), as imageio does.
+    """
+    name = "pillow"
+    extensions = ('.png', '.jpg', '.jpeg', '.gif', '.bmp')
+    magic = ((0, b'\x89PNG\r\n\x1a\n'), (0, b'\xff\xd8\xff'), (0, b'GIF87a'), (0, b'GIF89a'), (0, b'BM'))
+    reduced_resolution = True
+    frames = True
+
+    def available(self) -> bool:
+        return Image is not None
+
+    def read_pixels(self, file_path: str, max_size: Optional[int] = None) -> np.ndarray:
+        with open_source(file_path) as source, Image.open(source) as image:
+            if max_size is not None and image.format == 'JPEG':
+                image.draft(image.mode, (max_size, max_size))
+            if image.mode == 'P':
+                image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+            elif image.mode == 'PA':
+                image = image.convert('RGBA')
+            elif image.mode == '1':
+                image = image.convert('L')
+            elif image.mode in ('CMYK', 'YCbCr', 'LAB', 'HSV'):
+                image = image.convert('RGB')
+            return np.asarray(image)
+
+
+class ImageioDecoder(Decoder):
+    """
+    Reads any format imageio supports, and is tried for files no other decoder matches.
+    """
+    name = "imageio"
+    extensions = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tif', '.tiff')
+    frames = True
+
+    def read_pixels(self, file_path: str, max_size: Optional[int] = None) -> np.ndarray:
+        with open_source(file_path) as source:
+            if isinstance(source, str):
+                return iio.v3.imread(source, index=0)
+            # Files read from an archive have no extension for imageio to choose a plugin by
+            return iio.v3.imread(source, index=0, extension=image_extension(file_path))
+
+
+def _is_stack(shape: Tuple[int, ...]) -> bool:
+    # A 3D array with 3 or 4 channels last is a single RGB(A) image, otherwise the images are along the first axis
+    return len(shape) > 3 or (len(shape) == 3 and shape[-1] not in (3, 4))
+
+
+class NumpyDecoder(Decoder):
+    """
+    Reads images saved with `np.save`, memory-mapped. Arrays of more than one image are stacks of images along their
+    first axis, addressed by index, e.g. 'stack.npy::12'.
+    """
+    name = "numpy"
+    extensions = ('.npy',)
+    magic = ((0, b'\x93NUMPY'),)
+    memmap = True
+    stacks = True
+
+    def members(self, file_path: str) -> Optional[List[str]]:
+        with open_source(file_path) as source:
+            if isinstance(source, str):
+                shape = np.load(source, mmap_mode='r', allow_pickle=False).shape
+            else:
+                shape = _read_npy_header(source)[0]
+        return [str(index) for index in range(shape[0])] if _is_stack(shape) else None
+
+    def read_pixels(self, file_path: str, max_size: Optional[int] = None) -> np.ndarray:
+        path, member = split_image_key(file_path)
+        with open_source(path) as source:
+            if isinstance(source, str):
+                array = np.load(source, mmap_mode='r', allow_pickle=False)
+                return array if member is None else array[int(member)]
+            if member is None:
+                return np.load(source, allow_pickle=False)
+            return _read_npy_image(source, int(member))
+
+
+def _read_npy_header(f: BinaryIO) -> Tuple[Tuple[int, ...], bool, np.dtype]:
+    # Read the shape, order and dtype of a .npy file, leaving the file at the start of the array data
+    version = np.lib.format.read_magic(f)
+    if version == (1, 0):
+        return np.lib.format.read_array_header_1_0(f)
+    return np.lib.format.read_array_header_2_0(f)
+
+
+def _read_npy_image(f: BinaryIO, index: int) -> np.ndarray:
+    # Read one image from a .npy stack in an open file, seeking past the images before it
+    shape, fortran_order, dtype = _read_npy_header(f)
+    if fortran_order or dtype.hasobject:
+        f.seek(0)
+        return np.load(f, allow_pickle=False)[index]
+    if not 0 <= index < shape[0]:
+        raise IndexError(f"Image {index} is out of range for a stack of {shape[0]} images")
+    image_shape = shape[1:]
+    image_bytes = int(np.prod(image_shape)) * dtype.itemsize
+    f.seek(index * image_bytes, os.SEEK_CUR)
+    return np.frombuffer(f.read(image_bytes), dtype=dtype).reshape(image_shape)
+
+
+# An image within an HDF5 stack, e.g. 'images/degraded[12]'
+_HDF5_MEMBER = re.compile(r'^(.*)\[(\d+)\]$')
+
+
+class HDF5Decoder(Decoder):
+    """
+    Reads the images in HDF5 files with h5py. Each dataset of two or more dimensions is an image or, like a .npy
+    array, a stack of images along its first axis, addressed by dataset and index, e.g. 'outputs.h5::degraded[12]'.
+    Only the image being shown is read. Requires the optional h5py package.
+    """
+    name = "h5py"
+    extensions = ('.h5', '.hdf5', '.hdf')
+    magic = ((0, b'\x89HDF\r\n\x1a\n'),)
+    stacks = True
+
+    def available(self) -> bool:
+        return h5py is not None
+
+    @staticmethod
+    def _datasets(f) -> List[str]:
+        members = []
+
+        def add_dataset(name, item):
+            if isinstance(item, h5py.Dataset) and item.ndim >= 2:
+                if _is_stack(item.shape):
+                    members.extend(f"{name}[{index}]" for index in range(item.shape[0]))
+                else:
+                    members.append(name)
+
+        f.visititems(add_dataset)
+        return members
+
+    def members(self, file_path: str) -> Optional[List[str]]:
+        with open_source(file_path) as source, h5py.File(source, 'r') as f:
+            return self._datasets(f)
+
+    def read_pixels(self, file_path: str, max_size: Optional[int] = None) -> np.ndarray:
+        path, member = split_image_key(file_path)
+        with open_source(path) as source, h5py.File(source, 'r') as f:
+            if member is None:
+                members = self._datasets(f)
+                if not members:
+                    raise ValueError(f"{path} does not contain any images")
+                member = members[0]
+            match = _HDF5_MEMBER.match(member)
+            if match is None:
+                return f[member][()]
+            return f[match.group(1)][int(match.group(2))]
+
+
+class NiftiDecoder(Decoder):
+    """
+    Reads NIfTI volumes with nibabel, as a stack of axial slices addressed by index, e.g. 'volume.nii.gz::40'. Only
+    the slice being shown is read from uncompressed files. Requires the optional nibabel package.
+    """
+    name = "nibabel"
+    extensions = ('.nii', '.nii.gz')
+    magic = ((344, b'n+1\x00'),)
+    memmap = True
+    stacks = True
+
+    def available(self) -> bool:
+        return nibabel is not None
+
+    @staticmethod
+    def _load(path: str, source: Union[str, BinaryIO]):
+        if isinstance(source, str):
+            return nibabel.load(source)
+        # Volumes read from an archive are loaded from memory
+        data = source.read()
+        if path.lower().endswith('.gz'):
+            data = gzip.decompress(data)
+        return nibabel.Nifti1Image.from_bytes(data)
+
+    def members(self, file_path: str) -> Optional[List[str]]:
+        with open_source(file_path) as source:
+            shape = self._load(file_path, source).shape
+        return [str(index) for index in range(shape[2])] if len(shape) > 2 else None
+
+    def read_pixels(self, file_path: str, max_size: Optional[int] = None) -> np.ndarray:
+        path, member = split_image_key(file_path)
+        with open_source(path) as source:
+            volume = self._load(path, source)
+            if len(volume.shape) == 2:
+                image = volume.dataobj[:, :]
+            else:
+                # Take the first volume of a time series
+                index = (slice(None), slice(None), int(member or 0)) + (0,) * (len(volume.shape) - 3)
+                image = volume.dataobj[index]
+            image = np.asarray(image)
+        # NIfTI stores the first axis left to right, so rotate the slice to display it with the anterior at the top
+        return np.rot90(image)
+
+
+class DecoderRegistry:
+    """
+    Matches image files to decoders, by extension or magic bytes, and chooses the fastest decoder for each extension.
+    Safe to use from several threads.
+    """
+
+    def __init__(self):
+        self._decoders: List[Decoder] = []
+        self._lock = threading.RLock()
+        self._chosen: Dict[Tuple[str, Tuple[str, ...]], Decoder] = {}
+
+    def register(self, decoder: Decoder, first: bool = False):
+        """
+        Register a decoder. Decoders registered first are preferred if several decoders are as fast as each other,
+        and their output is the one other decoders must match.
+
+        :param decoder: The decoder
+        :type decoder: Decoder
+        :param first: Whether to register the decoder before the existing decoders
+        :type first: bool
+        """
+        with self._lock:
+            if first:
+                self._decoders.insert(0, decoder)
+            else:
+                self._decoders.append(decoder)
+            self._chosen.clear()
+
+    @property
+    def decoders(self) -> List[Decoder]:
+        """
+        The registered decoders, in order of preference.
+        """
+        return list(self._decoders)
+
+    def extensions(self) -> Tuple[str, ...]:
+        """
+        Get the extensions of the files which can be read by the available decoders.
+
+        :return: The extensions, without the leading dot, e.g. ('dcm', 'png')
+        :rtype: Tuple[str, ...]
+        """
+        extensions = []
+        for decoder in self._decoders:
+            if decoder.available():
+                extensions += [extension.lstrip('.') for extension in decoder.extensions]
+        return tuple(dict.fromkeys(extensions))
+
+    def candidates(self, file_path: str, file_extension: str) -> List[Decoder]:
+        """
+        Get the available decoders which can read a file, matched by extension or, if no decoder is registered for its
+        extension, by magic bytes. If neither matches, every decoder without magic bytes (e.g. imageio) is returned.
+
+        :param file_path: The path to the image file, or an image key
+        :type file_path: str
+        :param file_extension: The extension of the image file
+        :type file_extension: str
+        :return: The decoders, in order of preference
+        :rtype: List[Decoder]
+        """
+        file_path = split_image_key(file_path)[0]
+        file_extension = file_extension.lower()
+        decoders = [decoder for decoder in self._decoders if decoder.available()]
+        # Extensions such as '.nii.gz' are longer than the extension given by os.path.splitext
+        matches = [decoder for decoder in decoders
+                   if file_extension in decoder.extensions or file_path.lower().endswith(decoder.extensions)]
+        if matches:
+            return matches
+        header = read_header(file_path, _MAGIC_LENGTH)
+        matches = [decoder for decoder in decoders if decoder.matches_magic(header)]
+        return matches or [decoder for decoder in decoders if not decoder.magic]
+
+    def decoders_for(self, file_path: str, file_extension: str, require: Sequence[str] = ()) -> List[Decoder]:
+        """
+        Get the decoders to read a file with, fastest first. The first file of each extension is decoded by every
+        candidate decoder to time them.
+
+        :param file_path: The path to the image file, or an image key
+        :type file_path: str
+        :param file_extension: The extension of the image file
+        :type file_extension: str
+        :param require: Capabilities the decoder should have (see `CAPABILITIES`), if any candidate has them
+        :type require: Sequence[str]
+        :return: The chosen decoder followed by the other candidates, to fall back to
+        :rtype: List[Decoder]
+        """
+        in_stack = split_image_key(file_path)[1] is not None
+        if in_stack:
+            file_extension = image_extension(file_path)
+            require = tuple(require) + ('stacks',)
+        candidates = self.candidates(file_path, file_extension)
+        if in_stack:
+            # Only decoders which read stacks can read an image within a file
+            candidates = [decoder for decoder in candidates if decoder.stacks]
+        capable = [decoder for decoder in candidates if all(getattr(decoder, flag) for flag in require)]
+        candidates = capable or candidates
+        if len(candidates) < 2:
+            return candidates
+        key = (file_extension.lower() or os.path.basename(file_path), tuple(require))
+        with self._lock:
+            chosen = self._chosen.get(key)
+            if chosen is None or chosen not in candidates:
+                chosen = self._time_decoders(file_path, candidates, require)
+                if chosen is None:
+                    return candidates
+                self._chosen[key] = chosen
+        return [chosen] + [decoder for decoder in candidates if decoder is not chosen]
+
+    @staticmethod
+    def _time_decoders(file_path: str, candidates: List[Decoder], require: Sequence[str]) -> Optional[Decoder]:
+        max_size = 256 if 'reduced_resolution' in require else None
+        timings = {}
+        shape = None
+        for decoder in candidates:
+            # Time the faster of two decodes, so the decoder which happens to read the file first is not penalised
+            elapsed = None
+            try:
+                for _ in range(2):
+                    start = time.perf_counter()
+                    image = decoder.read_file(file_path, max_size=max_size)
+                    elapsed = min(time.perf_counter() - start, elapsed or float('inf'))
+            except Exception as e:
+                logger.debug(f"The {decoder.name} decoder failed on {file_path}: {e}")
+                continue
+            if shape is None:
+                shape = image.shape
+            elif image.shape != shape:
+                logger.debug(f"The {decoder.name} decoder read {file_path} as {image.shape}, expected {shape}")
+                continue
+            timings[decoder] = elapsed
+        if not timings:
+            return None
+        chosen = min(timings, key=timings.get)
+        logger.info(f"Decoding {os.path.splitext(file_path)[1] or file_path} files with {chosen.name} ("
+                    + ", ".join(f"{decoder.name}: {t * 1000:.1f} ms" for decoder, t in timings.items()) + ")")
+        return chosen
+
+    def read_pixels(self, file_path: str, file_extension: str) -> np.ndarray:
+        """
+        Read the stored pixel values of an image file with the fastest decoder, without applying any look-up tables
+        or remapping.
+
+        :param file_path: The path to the image file
+        :type file_path: str
+        :param file_extension: The extension of the image file
+        :type file_extension: str
+        :return: The pixel array
+        :rtype: np.ndarray
+        """
+        return self._decode(file_path, file_extension, (), lambda decoder: decoder.read_pixels(file_path))
+
+    def read_file(self, file_path: str, file_extension: str,
+                  allocate: Optional[Callable[[Tuple[int, ...]], np.ndarray]] = None,
+                  max_size: Optional[int] = None) -> np.ndarray:
+        """
+        Read an image file with the fastest decoder and remap it to 8-bit for display.
+
+        :param file_path: The path to the image file
+        :type file_path: str
+        :param file_extension: The extension of the image file
+        :type file_extension: str
+        :param allocate: Optional function returning the uint8 array to write the image to, given its shape
+        :type allocate: Optional[Callable[[Tuple[int, ...]], np.ndarray]]
+        :param max_size: If set, the image may be decoded at a lower resolution, with its longest side at least this
+            long, by a decoder which supports it
+        :type max_size: Optional[int]
+        :return: The 8-bit image
+        :rtype: np.ndarray
+        """
+        require = ('reduced_resolution',) if max_size is not None else ()
+        return self._decode(file_path, file_extension, require,
+                            lambda decoder: decoder.read_file(file_path, allocate=allocate, max_size=max_size))
+
+    def members(self, file_path: str) -> Optional[List[str]]:
+        """
+        List the images within a file holding many images, with the first decoder which reads stacks of its format.
+
+        :param file_path: The path to the file
+        :type file_path: str
+        :return: The images within the file, or None if the file holds a single image or cannot be read
+        :rtype: Optional[List[str]]
+        """
+        for decoder in self.candidates(file_path, image_extension(file_path)):
+            if not decoder.stacks:
+                continue
+            try:
+                return decoder.members(file_path)
+            except Exception as e:
+                logger.debug(f"The {decoder.name} decoder failed to list the images in {file_path}: {e}")
+        return None
+
+    def _decode(self, file_path: str, file_extension: str, require: Sequence[str], decode: Callable):
+        if not is_file(split_image_key(file_path)[0]):
+            raise FileNotFoundError(f"No such file: '{file_path}'")
+        decoders = self.decoders_for(file_path, file_extension, require)
+        if not decoders:
+            raise ValueError(f"No decoder is available for {file_path}")
+        first_error = None
+        for decoder in decoders:
+            try:
+                return decode(decoder)
+            except Exception as e:
+                if first_error is None:
+                    first_error = e
+                if len(decoders) > 1:
+                    logger.debug(f"The {decoder.name} decoder failed on {file_path}: {e}")
+        raise first_error
+
+
+_registry = DecoderRegistry()
+for _decoder in (PydicomDecoder(), TifffileDecoder(), PillowDecoder(), ImageioDecoder(), NumpyDecoder(), HDF5Decoder(),
+                 NiftiDecoder()):
+    _registry.register(_decoder)
+
+
+def get_decoder_registry() -> DecoderRegistry:
+    """
+    Get the decoder registry used to read image files.
+
+    :return: The shared decoder registry
+    :rtype: DecoderRegistry
+    """
+    return _registry
+
+
+def register_decoder(decoder: Decoder, first: bool = False):
+    """
+    Register a decoder with the shared registry, e.g. for a new format. See `DecoderRegistry.register`.
+
+    :param decoder: The decoder
+    :type decoder: Decoder
+    :param first: Whether to prefer the decoder over the existing decoders
+    :type first: bool
+    """
+    _registry.register(decoder, first)
+
+
+def image_extensions() -> Tuple[str, ...]:
+    """
+    Get the extensions of the image files which can be read, to find the images in a directory.
+
+    :return: The extensions, without the leading dot, e.g. ('dcm', 'png')
+    :rtype: Tuple[str, ...]
+    """
+    return _registry.extensions()
+
+
+def image_members(file_path: str) -> Optional[List[str]]:
+    """
+    List the images within a file holding many images (e.g. a .npy stack), to index each image separately.
+
+    :param file_path: The path to the file
+    :type file_path: str
+    :return: The images within the file, to be joined to its path with `speedy_iqa.utils.join_image_key`, or None if
+        the file holds a single image
+    :rtype: Optional[List[str]]
+    """
+    return _registry.members(file_path)
+
+
+def read_pixels(file_path: str, file_extension: str) -> np.ndarray:
+    """
+    Read the stored pixel values of an image file, without applying any look-up tables or remapping.
+
+    :param file_path: The path to the image file
+    :type file_path: str
+    :param file_extension: The extension of the image file
+    :type file_extension: str
+    :return: The pixel array
+    :rtype: np.ndarray
+    """
+    return _registry.read_pixels(file_path, file_extension)
+
+
+def read_file(file_path: str, file_extension: str,
+              allocate: Optional[Callable[[Tuple[int, ...]], np.ndarray]] = None,
+              max_size: Optional[int] = None) -> np.ndarray:
+    """
+    Reads the image file and applies the look-up tables.
+
+    :param file_path: The path to the image file
+    :type file_path: str
+    :param file_extension: The extension of the image file
+    :type file_extension: str
+    :param allocate: Optional function returning the uint8 array to write the image to, given its shape (e.g. to
+        decode into shared memory). By default, a new array is allocated.
+    :type allocate: Optional[Callable[[Tuple[int, ...]], np.ndarray]]
+    :param max_size: If set, the image may be decoded at a lower resolution, with its longest side at least this long
+        (e.g. for thumbnails)
+    :type max_size: Optional[int]
+    :return: The 8-bit image
+    :rtype: np.ndarray
+    """
+    return _registry.read_file(file_path, file_extension, allocate, max_size)
@@ -0,0 +1,237 @@
+"""
+decoding.py
+
+Background decoding of image files, used to prefetch the images next to the current one so that navigating to them
+does not wait for them to be decoded on the GUI thread.
+
+Two backends are available, chosen with `decode_backend` in the config file:
+
+    - 'thread': decodes in a pool of threads. This has the least overhead, but pydicom's parsing and parts of the
+      look-up table chain hold the GIL, so decoding competes with the Qt event loop.
+    - 'process': decodes in a pool of worker processes, so the GUI thread is never held up by decoding. Each worker
+      writes the decoded 8-bit image straight into a `multiprocessing.shared_memory` block, which the GUI process
+      wraps as an array without copying it. The block is freed once the array is no longer used.
+
+Setting `decode_backend` to 'none' disables prefetching.
+
+Classes:
+    - DecodeBackend: Base class of the decode backends.
+    - ThreadDecodeBackend: Decodes images in a pool of threads.
+    - ProcessDecodeBackend: Decodes images in a pool of processes, handing them over in shared memory.
+
+Functions:
+    - create_decode_backend(name: str, max_workers: int) -> Optional[DecodeBackend]
+"""
+
+import sys
+import logging
+import multiprocessing
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from speedy_iqa.decoders import read_file
+from speedy_iqa.storage import archive_index_paths, set_archive_index_paths
+from speedy_iqa.staging import use_staging_dir
+
+logger = logging.getLogger('fileLogger')
+
+DECODE_BACKENDS = ('thread', 'process', 'none')
+DEFAULT_DECODE_WORKERS = 2
+
+
+def _init_worker(index_paths: Dict[str, str], staging_dir: Optional[str]):
+    # Share the archive indexes and the staged files of the GUI process with a worker process
+    set_archive_index_paths(index_paths)
+    use_staging_dir(staging_dir)
+
+
+class DecodeBackend:
+    """
+    Base class of the decode backends, which decode image files in the background.
+
+    :param max_workers: The maximum number of images decoded at once
+    :type max_workers: int
+    """
+    name = ""
+
+    def __init__(self, max_workers: int = DEFAULT_DECODE_WORKERS):
+        self.max_workers = max(1, int(max_workers))
+
+    def submit(self, file_path: str, file_extension: str) -> Future:
+        """
+        Start decoding an image file in the background.
+
+        :param file_path: The path to the image file
+        :type file_path: str
+        :param file_extension: The extension of the image file
+        :type file_extension: str
+        :return: A future whose result is the decoded 8-bit image, as returned by `decoders.read_file`
+        :rtype: Future
+        """
+        raise NotImplementedError
+
+    def shutdown(self):
+        """
+        Stop the workers, cancelling any decodes which have not started.
+        """
+        raise NotImplementedError
+
+
+def _shutdown_executor(executor):
+    if sys.version_info >= (3, 9):
+        executor.shutdown(wait=False, cancel_futures=True)
+    else:
+        executor.shutdown(wait=False)
+
+
+class ThreadDecodeBackend(DecodeBackend):
+    """
+    Decodes images in a pool of threads.
+
+    :param max_workers: The maximum number of images decoded at once
+    :type max_workers: int
+    """
+    name = "thread"
+
+    def __init__(self, max_workers: int = DEFAULT_DECODE_WORKERS):
+        super().__init__(max_workers)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="speedy_decode")
+
+    def submit(self, file_path: str, file_extension: str) -> Future:
+        return self._executor.submit(read_file, file_path, file_extension)
+
+    def shutdown(self):
+        _shutdown_executor(self._executor)
+
+
+def _decode_to_shared_memory(file_path: str, file_extension: str) -> Tuple[str, Tuple[int, ...]]:
+    """
+    Decode an image file in a worker process into a new shared memory block. The block is left for the GUI process to
+    attach to and free.
+    """
+    blocks = []
+
+    def allocate(shape: Tuple[int, ...]) -> np.ndarray:
+        block = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape))))
+        blocks.append(block)
+        return np.ndarray(shape, dtype=np.uint8, buffer=block.buf)
+
+    try:
+        image = read_file(file_path, file_extension, allocate=allocate)
+        shape = image.shape
+        del image
+    except BaseException:
+        for block in blocks:
+            _free_shared_memory(block)
+        raise
+    # If a decoder failed after allocating its output, the image is in the block allocated by the decoder which did not
+    for block in blocks[:-1]:
+        _free_shared_memory(block)
+    block = blocks[-1]
+    block.close()
+    return block.name, shape
+
+
+def _free_shared_memory(block: shared_memory.SharedMemory):
+    try:
+        block.close()
+    except BufferError:
+        pass
+    try:
+        block.unlink()
+    except FileNotFoundError:
+        pass
+
+
+class _SharedImage:
+    """
+    Owns the shared memory block an image was decoded into. Arrays made from it with `np.asarray` keep it alive, and
+    the block is freed once the last of them has been garbage collected.
+    """
+
+    def __init__(self, name: str, shape: Tuple[int, ...]):
+        self.block = shared_memory.SharedMemory(name=name)
+        address = np.frombuffer(self.block.buf, dtype=np.uint8).ctypes.data
+        self.__array_interface__ = {'shape': tuple(shape), 'typestr': '|u1', 'data': (address, False), 'version': 3}
+
+    def __del__(self):
+        _free_shared_memory(self.block)
+
+
+class ProcessDecodeBackend(DecodeBackend):
+    """
+    Decodes images in a pool of processes, which write the decoded images into shared memory for the GUI process to
+    wrap without copying. The workers are started with 'spawn', as forking a process running Qt is not safe, and load
+    the member indexes of the archives opened so far rather than scanning them again.
+
+    :param max_workers: The maximum number of images decoded at once
+    :type max_workers: int
+    :param staging_dir: The directory of the staged files the workers should read (see `speedy_iqa.staging`), if any
+    :type staging_dir: Optional[str]
+    """
+    name = "process"
+
+    def __init__(self, max_workers: int = DEFAULT_DECODE_WORKERS, staging_dir: Optional[str] = None):
+        super().__init__(max_workers)
+        self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                             mp_context=multiprocessing.get_context('spawn'),
+                                             initializer=_init_worker, initargs=(archive_index_paths(), staging_dir))
+
+    def submit(self, file_path: str, file_extension: str) -> Future:
+        result = Future()
+        decode = self._executor.submit(_decode_to_shared_memory, file_path, file_extension)
+        # Cancelling the result cancels the decode too, if it has not started
+        result.add_done_callback(lambda done: done.cancelled() and decode.cancel())
+        decode.add_done_callback(lambda done: self._hand_over(done, result))
+        return result
+
+    @staticmethod
+    def _hand_over(decode: Future, result: Future):
+        if decode.cancelled():
+            result.cancel()
+            result.set_running_or_notify_cancel()
+            return
+        error = decode.exception()
+        if error is not None:
+            if result.set_running_or_notify_cancel():
+                result.set_exception(error)
+            return
+        image = np.asarray(_SharedImage(*decode.result()))
+        if not result.set_running_or_notify_cancel():
+            return
+        result.set_result(image)
+
+    def shutdown(self):
+        _shutdown_executor(self._executor)
+
+
+def create_decode_backend(name: str, max_workers: int = DEFAULT_DECODE_WORKERS,
+                          staging_dir: Optional[str] = None) -> Optional[DecodeBackend]:
+    """
+    Create a decode backend by name.
+
+    :param name: The name of the backend: 'thread', 'process' or 'none'
+    :type name: str
+    :param max_workers: The maximum number of images decoded at once
+    :type max_workers: int
+    :param staging_dir: The directory of the staged files to read, if any, for worker processes (threads read them
+        already)
+    :type staging_dir: Optional[str]
+    :return: The backend, or None if decoding in the background is disabled
+    :rtype: Optional[DecodeBackend]
+    """
+    name = str(name).lower()
+    if name == 'process':
+        try:
+            return ProcessDecodeBackend(max_workers, staging_dir)
+        except (OSError, ValueError, NotImplementedError) as e:
+            logger.warning(f"Process decoding is not available, decoding in threads instead: {e}")
+            return ThreadDecodeBackend(max_workers)
+    if name == 'thread':
+        return ThreadDecodeBackend(max_workers)
+    if name != 'none':
+        logger.warning(f"Unknown decode_backend '{name}', expected one of {', '.join(DECODE_BACKENDS)}")
+    return None
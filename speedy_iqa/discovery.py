@@ -0,0 +1,149 @@
+"""
+discovery.py
+
+Finds the images of a new session in the background, so that the first image can be shown before a large directory
+tree (or a directory on a slow network share) has been walked.
+
+The image directory is walked in a worker thread, pairing each image with its reference image as it is found. The
+main window waits only for the first image which has a reference image, then picks up the rest in batches as they are
+found. Once the walk has finished, the images which have not yet been shown are put in presentation order (see
+`speedy_iqa.ordering`).
+
+Classes:
+    - ImageDiscovery: Walks the image directory in a worker thread, pairing the images with their reference images.
+"""
+
+import time
+import logging
+import threading
+from typing import Callable, Collection, List, Optional
+
+from PyQt6.QtCore import QObject, QThread, pyqtSignal
+
+from speedy_iqa.storage import is_file
+from speedy_iqa.utils import iter_relative_image_paths, find_reference_path, split_image_key
+
+logger = logging.getLogger('fileLogger')
+
+
+class ImageDiscovery(QThread):
+    """
+    Walks the image directory in a worker thread, pairing each image found with its reference image. The images are
+    taken in batches with `take_new`; `found` is emitted (at most every `batch_interval` seconds) when there are new
+    images to take and `completed` once the whole directory has been walked.
+
+    :param dir_path: The directory (or archive) containing the images
+    :type dir_path: str
+    :param reference_dir: The directory containing the reference images
+    :type reference_dir: str
+    :param delimiter: The delimiter separating the reference name from the rest of the image name
+    :type delimiter: str
+    :param extensions: The file extensions of the images
+    :type extensions: Collection[str]
+    :param expand: Optional function listing the images within files holding many images, see
+        `speedy_iqa.utils.iter_relative_image_paths`
+    :type expand: Optional[Callable[[str], Optional[List[str]]]]
+    :param batch_interval: The minimum time between `found` signals in seconds
+    :type batch_interval: float
+    """
+    found = pyqtSignal(int)
+    completed = pyqtSignal(int)
+
+    def __init__(self, dir_path: str, reference_dir: str, delimiter: str, extensions: Collection[str],
+                 expand: Optional[Callable[[str], Optional[List[str]]]] = None, batch_interval: float = 0.25,
+                 parent: Optional[QObject] = None):
+        super().__init__(parent)
+        self.dir_path = dir_path
+        self.reference_dir = reference_dir
+        self.delimiter = delimiter
+        self.extensions = tuple(extensions)
+        self.expand = expand
+        self.batch_interval = batch_interval
+
+        self._lock = threading.Lock()
+        self._first_paired = threading.Event()
+        self._first_image = None
+        self._new = []
+        self._without_reference = []
+        self._count = 0
+        self._done = False
+        self._stopped = False
+
+    @property
+    def done(self) -> bool:
+        """
+        Whether the whole directory has been walked (or the walk has failed or been stopped).
+        """
+        return self._done
+
+    @property
+    def count(self) -> int:
+        """
+        The number of images found so far.
+        """
+        return self._count
+
+    @property
+    def images_without_reference(self) -> List[str]:
+        """
+        The images found so far which have no reference image.
+        """
+        with self._lock:
+            return list(self._without_reference)
+
+    def wait_for_first(self, timeout: Optional[float] = None) -> Optional[str]:
+        """
+        Wait for the first image with a reference image to be found, or for the walk to finish without finding one.
+
+        :param timeout: The maximum time to wait in seconds, or None to wait indefinitely
+        :type timeout: Optional[float]
+        :return: The first image with a reference image, or None if there is none (yet)
+        :rtype: Optional[str]
+        """
+        self._first_paired.wait(timeout)
+        return self._first_image
+
+    def take_new(self) -> List[str]:
+        """
+        Take the images found since the last call, in the order they were found.
+
+        :return: The relative paths of the images
+        :rtype: List[str]
+        """
+        with self._lock:
+            new, self._new = self._new, []
+        return new
+
+    def stop(self):
+        """
+        Stop walking the directory and wait for the worker thread to finish.
+        """
+        self._stopped = True
+        self.wait()
+
+    def run(self):
+        last_emitted = time.monotonic()
+        try:
+            for filename in iter_relative_image_paths(self.dir_path, self.extensions, self.expand):
+                if self._stopped:
+                    return
+                reference_path = find_reference_path(filename, self.reference_dir, self.delimiter)
+                has_reference = is_file(split_image_key(reference_path)[0])
+                with self._lock:
+                    self._new.append(filename)
+                    self._count += 1
+                    if not has_reference:
+                        self._without_reference.append(filename)
+                if has_reference and self._first_image is None:
+                    self._first_image = filename
+                    self._first_paired.set()
+                if time.monotonic() - last_emitted >= self.batch_interval:
+                    self.found.emit(self._count)
+                    last_emitted = time.monotonic()
+        except Exception as e:
+            logger.exception(f"Failed to find the images in {self.dir_path}: {e}")
+        finally:
+            self._done = True
+            self._first_paired.set()
+        self.found.emit(self._count)
+        self.completed.emit(self._count)
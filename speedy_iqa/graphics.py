@@ -12,7 +12,7 @@ from PyQt6.QtGui import *
 from PyQt6.QtWidgets import *
 from typing import Optional
 from speedy_iqa.utils import ConnectionManager
-from qt_material import get_theme
+from speedy_iqa.themes import theme_color
 
 
 class CustomGraphicsView(QGraphicsView):
@@ -37,8 +37,8 @@ class CustomGraphicsView(QGraphicsView):
             self.label = QLabel(label.upper(), self)
             self.label.setAlignment(Qt.AlignmentFlag.AlignCenter)
             self.label.setStyleSheet(
-                f"background-color: {get_theme('dark_blue.xml')['primaryLightColor']}; margin: 3px; padding: 3px; "
-                f"font-size: 16px; font-weight: bold; color: {get_theme('dark_blue.xml')['secondaryDarkColor']};"
+                f"background-color: {theme_color('dark_blue.xml', 'primaryLightColor')}; margin: 3px; padding: 3px; "
+                f"font-size: 16px; font-weight: bold; color: {theme_color('dark_blue.xml', 'secondaryDarkColor')};"
             )
             self.label.move(5, 5)  # Place label at the top-left corner with 5px offset from the border.
 
@@ -86,15 +86,9 @@ class CustomGraphicsView(QGraphicsView):
         """
         Change the color of the label.
         """
-        try:
-            primary_light_color = get_theme(theme)['primaryLightColor']
-        except KeyError:
-            primary_light_color = get_theme(theme)['primaryColor']
-
-        try:
-            secondary_dark_color = get_theme(theme)['secondaryDarkColor']
-        except KeyError:
-            secondary_dark_color = get_theme(theme)['secondaryColor']
+        primary_light_color = theme_color(theme, 'primaryLightColor', 'primaryColor')
+
+        secondary_dark_color = theme_color(theme, 'secondaryDarkColor', 'secondaryColor')
 
         self.label.setStyleSheet(
             f"background-color: {primary_light_color}; margin: 3px; padding: 3px; font-size: 16px; font-weight: bold; "
@@ -0,0 +1,318 @@
+"""
+image_io.py
+
+Reading of image files into arrays for display.
+
+Uncompressed DICOM (little endian) and uncompressed TIFF files are memory-mapped, so the pixel data is viewed in place
+rather than read into Python bytes and then copied into an array. The only full-size copies are then made by the
+look-up tables and the remapping to 8-bit, which reduces both the decode time and the peak memory of large
+radiographs. Files are matched to these readers by the decoder registry in `speedy_iqa.decoders`.
+
+The DICOM look-up tables and the remapping to 8-bit are combined into a single table over the stored pixel values,
+applied with one `np.take` into the 8-bit output. Where that is not possible, they are computed in place, in
+intermediate buffers borrowed from a shared `BufferPool`. Either way, the 8-bit output is the only full-size array
+allocated for each image.
+
+Functions:
+    - memmap_dicom_pixels(file_path: str) -> Tuple[Optional[np.ndarray], pydicom.Dataset]
+    - memmap_tiff(file_path: str) -> Optional[np.ndarray]
+    - read_dicom_pixels(file_path: str) -> Tuple[np.ndarray, pydicom.Dataset]
+    - dicom_output_range(ds: pydicom.Dataset, ordered: bool) -> Tuple[float, float]
+    - build_display_lut(ds: pydicom.Dataset, dtype: np.dtype, pixel_range: Optional[Tuple[int, int]]) -> np.ndarray
+    - apply_luts(pixels: np.ndarray, ds: pydicom.Dataset, pool: Optional[BufferPool], out: Optional[np.ndarray])
+        -> np.ndarray
+"""
+
+import struct
+import logging
+from typing import BinaryIO, Optional, Tuple, Union
+
+import numpy as np
+import pydicom
+from pydicom.pixel_data_handlers.util import apply_modality_lut, apply_voi_lut, pixel_dtype
+from pydicom.multival import MultiValue
+from pydicom.uid import ExplicitVRLittleEndian, ImplicitVRLittleEndian
+
+from speedy_iqa.buffers import BufferPool, get_buffer_pool
+from speedy_iqa.transfer_syntax import get_transfer_syntax_router
+from speedy_iqa.utils import invert_grayscale, remap_range_to_8bit
+from speedy_iqa.utils import supports_lut, integer_lut_domain, apply_lut
+
+try:
+    import tifffile
+except ImportError:
+    tifffile = None
+
+logger = logging.getLogger('fileLogger')
+
+# Transfer syntaxes whose pixel data is stored uncompressed, in little endian byte order
+_MEMMAP_TRANSFER_SYNTAXES = {ExplicitVRLittleEndian, ImplicitVRLittleEndian}
+_PIXEL_DATA_TAG = (0x7FE0, 0x0010)
+_UNDEFINED_LENGTH = 0xFFFFFFFF
+
+
+def _pixel_data_offset(fp, implicit_vr: bool) -> Optional[Tuple[int, int]]:
+    """
+    Read the header of the Pixel Data element at the current position of the file, returning the offset and length
+    of its value, or None if it is not an uncompressed Pixel Data element.
+    """
+    start = fp.tell()
+    header = fp.read(8)
+    if len(header) < 8:
+        return None
+    group, element = struct.unpack('<HH', header[:4])
+    if (group, element) != _PIXEL_DATA_TAG:
+        return None
+    if implicit_vr:
+        length = struct.unpack('<L', header[4:])[0]
+        offset = start + 8
+    else:
+        if header[4:6] not in (b'OB', b'OW'):
+            return None
+        length_bytes = fp.read(4)
+        if len(length_bytes) < 4:
+            return None
+        length = struct.unpack('<L', length_bytes)[0]
+        offset = start + 12
+    if length == _UNDEFINED_LENGTH:
+        return None
+    return offset, length
+
+
+def memmap_dicom_pixels(file_path: str) -> Tuple[Optional[np.ndarray], pydicom.Dataset]:
+    """
+    Read the header of a DICOM file and, if its pixel data is a single uncompressed little endian greyscale frame,
+    memory-map the pixel data.
+
+    :param file_path: The path to the DICOM file
+    :type file_path: str
+    :return: The memory-mapped pixel array (or None if the pixel data cannot be memory-mapped) and the dataset,
+        without its pixel data
+    :rtype: Tuple[Optional[np.ndarray], pydicom.Dataset]
+    """
+    with open(file_path, 'rb') as fp:
+        ds = pydicom.dcmread(fp, stop_before_pixels=True)
+        # Reading stops at the start of the Pixel Data element
+        transfer_syntax = getattr(getattr(ds, 'file_meta', None), 'TransferSyntaxUID', None)
+        if transfer_syntax not in _MEMMAP_TRANSFER_SYNTAXES:
+            return None, ds
+        if (ds.get('SamplesPerPixel', 1) != 1 or int(ds.get('NumberOfFrames', 1) or 1) != 1
+                or ds.get('BitsAllocated') not in (8, 16, 32)):
+            return None, ds
+        value = _pixel_data_offset(fp, transfer_syntax == ImplicitVRLittleEndian)
+    if value is None:
+        return None, ds
+
+    offset, length = value
+    dtype = pixel_dtype(ds)
+    shape = (ds.Rows, ds.Columns)
+    if length < shape[0] * shape[1] * dtype.itemsize:
+        return None, ds
+    return np.memmap(file_path, dtype=dtype, mode='r', offset=offset, shape=shape), ds
+
+
+def memmap_tiff(file_path: str) -> Optional[np.ndarray]:
+    """
+    Memory-map the pixel data of a single page, uncompressed TIFF file. Requires the optional tifffile package.
+
+    :param file_path: The path to the TIFF file
+    :type file_path: str
+    :return: The memory-mapped pixel array, or None if the file cannot be memory-mapped
+    :rtype: Optional[np.ndarray]
+    """
+    if tifffile is None:
+        return None
+    try:
+        with tifffile.TiffFile(file_path) as tif:
+            if len(tif.pages) != 1 or not tif.pages[0].is_memmappable:
+                return None
+        return tifffile.memmap(file_path, page=0, mode='r')
+    except (OSError, ValueError, tifffile.TiffFileError) as e:
+        logger.debug(f"Could not memory-map {file_path}: {e}")
+        return None
+
+
+def read_dicom_pixels(file_path: Union[str, BinaryIO]) -> Tuple[np.ndarray, pydicom.Dataset]:
+    """
+    Read the stored pixel values of a DICOM file, memory-mapping them if possible. Compressed pixel data is decoded
+    with the fastest pixel data handler for its transfer syntax (see `speedy_iqa.transfer_syntax`).
+
+    :param file_path: The path to the DICOM file, or the open file (e.g. read from an archive), which is not
+        memory-mapped
+    :type file_path: Union[str, BinaryIO]
+    :return: The pixel array and the dataset
+    :rtype: Tuple[np.ndarray, pydicom.Dataset]
+    """
+    image = None
+    try:
+        if isinstance(file_path, str):
+            image, ds = memmap_dicom_pixels(file_path)
+    except (OSError, ValueError, struct.error) as e:
+        logger.debug(f"Could not memory-map {file_path}: {e}")
+        image = None
+    if image is None:
+        ds = pydicom.dcmread(file_path)
+        image = get_transfer_syntax_router().pixel_array(ds, file_path)
+    return image, ds
+
+
+def _first_value(value) -> float:
+    # Window Center and Window Width may hold several alternative views, use the first
+    if isinstance(value, (list, tuple, MultiValue)):
+        value = value[0]
+    return float(value)
+
+
+def _has_voi_lut_sequence(ds: pydicom.Dataset) -> bool:
+    if not ds.get('VOILUTSequence'):
+        return False
+    item = ds.VOILUTSequence[0]
+    return item.get('LUTDescriptor', None) is not None and item.get('LUTData', None) is not None
+
+
+def dicom_output_range(ds: pydicom.Dataset, ordered: bool = True) -> Tuple[float, float]:
+    """
+    Get the range of the values output by the modality and VOI look-up tables of a DICOM dataset, which is mapped to
+    0-255 for display. For windowing, this is the range pydicom maps the window to.
+
+    :param ds: The DICOM dataset
+    :type ds: pydicom.Dataset
+    :param ordered: Whether to order the values. If not, a negative rescale slope gives the values the lowest and
+        highest stored values are rescaled to, in that order, as pydicom's windowing uses.
+    :type ordered: bool
+    :return: The lowest and highest output values
+    :rtype: Tuple[float, float]
+    """
+    if _has_voi_lut_sequence(ds):
+        return 0, 2 ** int(ds.VOILUTSequence[0].LUTDescriptor[2]) - 1
+    if ds.get('ModalityLUTSequence'):
+        return 0, 2 ** int(ds.ModalityLUTSequence[0].LUTDescriptor[2]) - 1
+    bits_stored = int(ds.get('BitsStored', ds.get('BitsAllocated', 16)))
+    if ds.get('PixelRepresentation', 0) == 0:
+        low, high = 0, 2 ** bits_stored - 1
+    else:
+        low, high = -2 ** (bits_stored - 1), 2 ** (bits_stored - 1) - 1
+    if 'RescaleSlope' in ds and 'RescaleIntercept' in ds:
+        slope, intercept = float(ds.RescaleSlope), float(ds.RescaleIntercept)
+        low, high = low * slope + intercept, high * slope + intercept
+    return (min(low, high), max(low, high)) if ordered else (low, high)
+
+
+def _apply_windowing_in_place(work: np.ndarray, ds: pydicom.Dataset):
+    """
+    Apply a LINEAR or LINEAR_EXACT window to a float64 array in place, as `pydicom`'s `apply_windowing` does.
+    """
+    y_min, y_max = dicom_output_range(ds, ordered=False)
+    voi_function = str(ds.get('VOILUTFunction', 'LINEAR')).upper()
+    center = _first_value(ds.WindowCenter)
+    width = _first_value(ds.WindowWidth)
+    if voi_function == 'LINEAR':
+        if width < 1:
+            raise ValueError("The (0028,1051) Window Width must be greater than or equal to 1 for a 'LINEAR' "
+                             "windowing operation")
+        center -= 0.5
+        width -= 1
+    elif width <= 0:
+        raise ValueError("The (0028,1051) Window Width must be greater than 0 for a 'LINEAR_EXACT' windowing operation")
+
+    if width == 0:
+        above = work > center
+        work.fill(y_min)
+        work[above] = y_max
+        return
+    work -= center
+    work /= width
+    work += 0.5
+    work *= y_max - y_min
+    work += y_min
+    np.clip(work, min(y_min, y_max), max(y_min, y_max), out=work)
+
+
+def _rescale_and_window(work: np.ndarray, ds: pydicom.Dataset):
+    """
+    Apply the rescale and LINEAR windowing of a DICOM dataset to a float64 array of stored pixel values, in place.
+    """
+    if 'RescaleSlope' in ds and 'RescaleIntercept' in ds:
+        work *= float(ds.RescaleSlope)
+        work += float(ds.RescaleIntercept)
+        # Truncate to integers, as the stored values are
+        np.trunc(work, out=work)
+    if ds.get('WindowCenter', None) is not None and ds.get('WindowWidth', None) is not None:
+        _apply_windowing_in_place(work, ds)
+
+
+def build_display_lut(ds: pydicom.Dataset, dtype: np.dtype,
+                      pixel_range: Optional[Tuple[int, int]] = None) -> np.ndarray:
+    """
+    Build a look-up table mapping every stored pixel value of an integer dtype (of at most 16 bits) straight to its
+    8-bit display value, combining the rescale, windowing, MONOCHROME1 inversion and remapping of `apply_luts`.
+
+    :param ds: The DICOM dataset, without a modality or VOI LUT sequence
+    :type ds: pydicom.Dataset
+    :param dtype: The dtype of the stored pixel values
+    :type dtype: np.dtype
+    :param pixel_range: The lowest and highest stored pixel values in the image, needed to invert MONOCHROME1 images
+    :type pixel_range: Optional[Tuple[int, int]]
+    :return: The uint8 look-up table, to be applied with `apply_lut`
+    :rtype: np.ndarray
+    """
+    low, high = dicom_output_range(ds)
+    values = integer_lut_domain(dtype)
+    _rescale_and_window(values, ds)
+    if ds.PhotometricInterpretation == "MONOCHROME1":
+        # The rescale and windowing are monotonic, so the extremes of the image map to the extremes of the output
+        indices = np.array(pixel_range, dtype=dtype).view(f"u{np.dtype(dtype).itemsize}")
+        np.subtract(values[indices[0]] + values[indices[1]], values, out=values)
+    return remap_range_to_8bit(values, low, high, np.empty(values.shape, dtype=np.uint8))
+
+
+def apply_luts(pixels: np.ndarray, ds: pydicom.Dataset, pool: Optional[BufferPool] = None,
+               out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Apply the modality and VOI look-up tables of a DICOM dataset to its pixels, invert MONOCHROME1 images and remap
+    the result to 8-bit.
+
+    Rescaling and LINEAR windowing, which cover almost all radiographs, are elementwise, so for stored values of up to
+    16 bits they are combined with the remapping into a single look-up table over every stored value, applied with one
+    `np.take` into the uint8 output. Wider stored values are computed in place in a single float64 buffer borrowed
+    from the buffer pool. Either way, the only new full-size array is the 8-bit output. Modality and VOI LUT sequences
+    and SIGMOID windowing are applied with pydicom.
+
+    :param pixels: The stored pixel values
+    :type pixels: np.ndarray
+    :param ds: The DICOM dataset
+    :type ds: pydicom.Dataset
+    :param pool: The buffer pool to borrow the intermediate array from. Defaults to the shared pool.
+    :type pool: Optional[BufferPool]
+    :param out: Optional preallocated uint8 array, of the same shape as the pixels, to write the output to
+    :type out: Optional[np.ndarray]
+    :return: The 8-bit image
+    :rtype: np.ndarray
+    """
+    low, high = dicom_output_range(ds)
+    if out is None:
+        out = np.empty(pixels.shape, dtype=np.uint8)
+    windowing = ds.get('WindowCenter', None) is not None and ds.get('WindowWidth', None) is not None
+    voi_function = str(ds.get('VOILUTFunction', 'LINEAR')).upper()
+
+    if (ds.get('ModalityLUTSequence') or _has_voi_lut_sequence(ds)
+            or (windowing and voi_function not in ('LINEAR', 'LINEAR_EXACT'))):
+        image = apply_modality_lut(pixels, ds)
+        image = apply_voi_lut(image.astype(int), ds, 0)
+        if ds.PhotometricInterpretation == "MONOCHROME1":
+            image = invert_grayscale(image)
+        return remap_range_to_8bit(image.astype(np.float64), low, high, out)
+
+    if supports_lut(pixels.dtype):
+        pixel_range = None
+        if ds.PhotometricInterpretation == "MONOCHROME1":
+            pixel_range = (pixels.min(), pixels.max())
+        return apply_lut(pixels, build_display_lut(ds, pixels.dtype, pixel_range), out)
+
+    with (pool or get_buffer_pool()).borrow(pixels.shape, np.float64) as work:
+        np.copyto(work, pixels)
+        _rescale_and_window(work, ds)
+        if ds.PhotometricInterpretation == "MONOCHROME1":
+            np.subtract(work.max() + work.min(), work, out=work)
+        remap_range_to_8bit(work, low, high, out)
+    return out
@@ -22,6 +22,7 @@ Usage:
 
 import sys
 import os
+import multiprocessing
 
 
 def configure_qt_environment():
@@ -54,7 +55,7 @@ configure_qt_environment()
 from PyQt6.QtCore import *
 from PyQt6.QtGui import *
 from PyQt6.QtWidgets import *
-from qt_material import apply_stylesheet
+from speedy_iqa.themes import apply_theme
 
 from speedy_iqa.main_app import MainApp
 # from speedy_iqa.wizard import ConfigurationWizard
@@ -152,7 +153,7 @@ def main(theme='qt_material', material_theme=None, icon_theme='qtawesome'):
             material_theme = settings.value('theme', 'dark_blue.xml')
         else:
             settings.setValue('theme', material_theme)
-        apply_stylesheet(app, theme=material_theme, extra={})
+        apply_theme(app, material_theme)
     else:
         app.setStyle(QStyleFactory.create(theme))
 
@@ -232,4 +233,6 @@ def main(theme='qt_material', material_theme=None, icon_theme='qtawesome'):
 
 
 if __name__ == '__main__':
+    # Needed for the process decode backend in the executable application
+    multiprocessing.freeze_support()
     main()
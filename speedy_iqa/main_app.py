@@ -8,31 +8,44 @@ Classes:
 """
 
 import os
-import pydicom
 import numpy as np
 import pandas as pd
 from PyQt6.QtCore import *
 from PyQt6.QtGui import *
 from PyQt6.QtWidgets import *
-from pydicom.pixel_data_handlers.util import apply_modality_lut, apply_voi_lut
 from qimage2ndarray import array2qimage
-from qt_material import get_theme, apply_stylesheet
 import qtawesome as qta
 from PyQt6.QtCore import QTimer
 import datetime
-import json
-from typing import Dict, List, Optional
+import time
+import getpass
+from typing import Dict, List, Optional, Tuple
 import matplotlib.pyplot as plt
 import sys
 from math import ceil
 import imageio as iio
 from functools import partial
-from random import Random
 
 from speedy_iqa.windows import AboutMessageBox, FileSelectionDialog
 from speedy_iqa.utils import ConnectionManager, open_yml_file, setup_logging
-from speedy_iqa.utils import convert_to_checkstate, find_relative_image_path, invert_grayscale, remap_to_8bit
+from speedy_iqa.utils import convert_to_checkstate, array_to_qimage
+from speedy_iqa.utils import split_image_key, join_image_key, image_extension, find_reference_path
 from speedy_iqa.utils import make_column_categorical, expand_dict_column
+from speedy_iqa.session import save_session, load_session_columns, SESSION_FORMATS
+from speedy_iqa.cache import PreviewCache
+from speedy_iqa.decoders import read_file, image_extensions, image_members
+from speedy_iqa.decoding import create_decode_backend
+from speedy_iqa.staging import StagingCache, DEFAULT_STAGING_AHEAD
+from speedy_iqa.ordering import order_images, DEFAULT_ORDERING, DEFAULT_SEED, DEFAULT_MAX_GAP
+from speedy_iqa.discovery import ImageDiscovery
+from speedy_iqa.watching import FolderWatcher
+from speedy_iqa.preflight import preflight_images, summarise_preflight, UNREADABLE
+from speedy_iqa.storage import ArchiveStorage, get_storage, is_storage_root, is_file, archive_index_path
+from speedy_iqa.storage import ARCHIVE_INDEX_SUFFIX
+from speedy_iqa.thumbnails import ThumbnailModel, ThumbnailDock
+from speedy_iqa.profiling import StageTimer, LatencyMonitor, PerformanceOverlay
+from speedy_iqa.themes import apply_theme, theme_color
+from speedy_iqa.telemetry import NavigationTelemetry, telemetry_path, TELEMETRY_SUFFIX, LEFT, SHOWN, RATED
 from speedy_iqa.graphics import CustomGraphicsView
 
 if hasattr(sys, '_MEIPASS'):
@@ -109,6 +122,7 @@ class MainApp(QMainWindow):
         self.highlighted_groupbox_color = None
         self.highlighted_opacity = 0.15
         self.highlighted_radiogroup = None
+        self.highlighted_groupbox = None
 
         # Load the configuration file
         config = self.open_config_yml()
@@ -119,54 +133,98 @@ class MainApp(QMainWindow):
         self.max_backups = config.get('max_backups', 10)
         self.backup_dir = os.path.normpath(os.path.expanduser(config.get('backup_dir', '~/speedy_iqa/backups')))
         self.backup_interval = config.get('backup_interval', 5)
+        self.session_format = config.get('session_format', 'json')
+        self.cache_dir = os.path.normpath(os.path.expanduser(config.get('cache_dir', '~/speedy_iqa/cache')))
+        self.cache_max_size = config.get('cache_max_size', 2048)
+        self.profiling = config.get('profiling', False)
+        self.stage_timer = StageTimer(enabled=self.profiling)
+        self.latency_threshold = config.get('latency_threshold_ms', 0)
+        self.latency_monitor = LatencyMonitor(self.latency_threshold, logger=logger, parent=self)
         self.task = config.get('task', 'General use')
 
+        self.ordering = {
+            'strategy': config.get('ordering', DEFAULT_ORDERING),
+            'seed': config.get('ordering_seed', DEFAULT_SEED),
+            'max_gap': config.get('ordering_max_gap', DEFAULT_MAX_GAP),
+        }
+
+        self.discovery = None
+        self.folder_watcher = None
+        self.watch_folder = config.get('watch_folder', False)
+        self.watch_poll_interval = config.get('watch_poll_interval', 0)
+        self.preflight = config.get('preflight', False)
+        self.preflight_mode = config.get('preflight_mode', 'decode')
+        self.preflight_workers = config.get('preflight_workers', 0)
+        self.preflight_results = {}
+
         self.json_path = self.settings.value("json_path", "")
         self.loaded = self.load_from_json()
 
         if not self.loaded:
 
             self.dir_path = os.path.normpath(os.path.abspath(self.settings.value("image_path", ".")))
-            if not os.path.isdir(self.dir_path):
+            if not is_storage_root(self.dir_path):
                 if os.path.isdir(os.path.dirname(self.dir_path)):
                     self.dir_path = os.path.dirname(self.dir_path)
                 else:
                     raise FileNotFoundError(f"Directory {self.dir_path} not found, nor was the parent directory found.")
-
-            self.file_list = sorted(find_relative_image_path(self.dir_path))
-            Random(4).shuffle(self.file_list)
-
             self.reference_dir_path = os.path.normpath(
                 os.path.abspath(self.settings.value("reference_path", "."))
             )
             self.reference_delimiter = self.settings.value("reference_delimiter", "__")
+            self.open_storage()
 
             self.normalise_images = self.settings.value("normalise_images", False)
 
-            imgs_wout_ref = self.check_no_of_images_wout_ref()
-
-            if imgs_wout_ref:
-                self.show_imgs_wout_ref_warning(imgs_wout_ref)
-            if self.should_quit:
-                return
-
-            self.viewed_values = {f: False for f in self.file_list}
-            self.rotation = {f: 0 for f in self.file_list}
-            self.notes = {f: "" for f in self.file_list}
-            if bool(self.findings):
-                self.checkbox_values = {f: {finding: 0 for finding in self.findings} for f in self.file_list}
+            # Find the images in the background, only waiting for the first image with a reference image
+            self.discovery = ImageDiscovery(self.dir_path, self.reference_dir_path, self.reference_delimiter,
+                                            image_extensions(), expand=image_members, parent=self)
+            self.discovery.start()
+            first_image = self.discovery.wait_for_first()
+            # Checked before taking the images, so that no image found in between is left behind once the walk is done
+            discovery_done = self.discovery.done
+            found_images = self.discovery.take_new()
+
+            if discovery_done:
+                self.discovery = None
+                if not found_images:
+                    raise FileNotFoundError(f"No images found in {self.dir_path}.")
+                self.file_list = order_images(found_images, group_key=self.reference_key, **self.ordering)
+                imgs_wout_ref = self.check_no_of_images_wout_ref()
+
+                if imgs_wout_ref:
+                    self.show_imgs_wout_ref_warning(imgs_wout_ref)
+                if self.should_quit:
+                    return
             else:
-                self.checkbox_values = {f: {} for f in self.file_list}
-            if bool(self.radiobutton_groups1):
-                self.radiobutton_values = {f: {group['title']: None for group in self.radiobutton_groups1} for f in
-                                           self.file_list}
-            if bool(self.radiobutton_groups2):
-                self.radiobutton_values = {f: {group['title']: None for group in self.radiobutton_groups2} for f in
-                                           self.file_list}
-            if not bool(self.radiobutton_groups1) and not bool(self.radiobutton_groups2):
-                self.radiobutton_values = {f: {} for f in self.file_list}
+                # The rest of the images are added as they are found, see `on_images_found`
+                self.file_list = [first_image] + order_images(
+                    [f for f in found_images if f != first_image], group_key=self.reference_key, **self.ordering
+                )
+
+            self.add_image_state(self.file_list)
 
         self.backup_interval = self.settings.value("backup_interval", 5, type=int)
+        self.telemetry = NavigationTelemetry(reader=getpass.getuser(), task=self.task)
+        self.preview_cache = None
+        if self.cache_max_size and self.cache_max_size > 0:
+            try:
+                self.preview_cache = PreviewCache(self.cache_dir, self.cache_max_size)
+            except OSError as e:
+                logger.warning(f"Failed to open the image cache at {self.cache_dir}: {e}")
+        self.staging = None
+        self.staging_ahead = config.get('staging_ahead', DEFAULT_STAGING_AHEAD)
+        staging_max_size = config.get('staging_max_size', 0)
+        if staging_max_size and staging_max_size > 0:
+            staging_dir = os.path.normpath(os.path.expanduser(config.get('staging_dir', '~/speedy_iqa/staging')))
+            try:
+                self.staging = StagingCache(staging_dir, staging_max_size)
+            except OSError as e:
+                logger.warning(f"Failed to open the staging directory at {staging_dir}: {e}")
+        self.decoder = create_decode_backend(config.get('decode_backend', 'thread'), config.get('decode_workers', 2),
+                                             self.staging.staging_dir if self.staging is not None else None)
+        self.prefetched = {}
+        self.previous_images = {}
         self.image = None
         self.reference_image = None
 
@@ -175,13 +233,14 @@ class MainApp(QMainWindow):
 
         # Set the default colors for the icons
         qta.set_defaults(
-            color=get_theme("dark_blue.xml")['primaryLightColor'],
-            color_disabled=get_theme("dark_blue.xml")['secondaryDarkColor'],
-            color_active=get_theme("dark_blue.xml")['primaryColor'],
+            color=theme_color("dark_blue.xml", 'primaryLightColor'),
+            color_disabled=theme_color("dark_blue.xml", 'secondaryDarkColor'),
+            color_active=theme_color("dark_blue.xml", 'primaryColor'),
         )
 
         # Set the icons dictionary used in the main window
         self.icons = {}
+        self.icon_sets = {}
         self.set_icons()
 
         # Set the window icon
@@ -211,6 +270,7 @@ class MainApp(QMainWindow):
         if self.should_quit:
             return
         self.load_image()
+        self.prefetch_neighbours()
         self.image_scene.addItem(self.pixmap_item)
         self.reference_scene.addItem(self.reference_pixmap_item)
         self.image_view.setScene(self.image_scene)
@@ -221,6 +281,7 @@ class MainApp(QMainWindow):
         self.central_widget = QWidget(self)
         self.central_widget.setLayout(self.main_layout)
         self.setCentralWidget(self.central_widget)
+        self.performance_overlay = PerformanceOverlay(self.stage_timer, self.latency_monitor, self)
 
         # Create the navigation toolbar
         self.file_tool_bar = QToolBar(self)
@@ -317,7 +378,7 @@ class MainApp(QMainWindow):
 
         self.nav_toolbar = QToolBar(self)
         self.nav_spacer = QWidget()
-        self.line_color = get_theme("dark_blue.xml")['secondaryLightColor']
+        self.line_color = theme_color("dark_blue.xml", 'secondaryLightColor')
         self.nav_spacer.setStyleSheet(f"border-bottom: 1px solid {self.line_color};")
         self.nav_spacer.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Expanding)
         self.nav_toolbar.addWidget(self.nav_spacer)
@@ -351,14 +412,9 @@ class MainApp(QMainWindow):
 
         action_width = self.labelling_toolbar.sizeHint().width() // 4
 
-        try:
-            nav_bg_color1 = get_theme(self.settings.value("theme", 'dark_blue.xml'))['primaryLightColor']
-        except KeyError:
-            nav_bg_color1 = get_theme(self.settings.value("theme", 'dark_blue.xml'))['primaryColor']
-        try:
-            nav_bg_color2 = get_theme(self.settings.value("theme", 'dark_blue.xml'))['secondaryLightColor']
-        except KeyError:
-            nav_bg_color2 = get_theme(self.settings.value("theme", 'dark_blue.xml'))['secondaryColor']
+        theme = self.settings.value("theme", 'dark_blue.xml')
+        nav_bg_color1 = theme_color(theme, 'primaryLightColor', 'primaryColor')
+        nav_bg_color2 = theme_color(theme, 'secondaryLightColor', 'secondaryColor')
 
         self.prevButton = QToolButton()
         self.prevButton.setDefaultAction(self.prevAction)
@@ -399,6 +455,20 @@ class MainApp(QMainWindow):
         self.nav_toolbar.setSizePolicy(QSizePolicy.Policy.Fixed, QSizePolicy.Policy.Fixed)
         self.addToolBar(Qt.ToolBarArea.TopToolBarArea, self.nav_toolbar)
 
+        # Create the dockable thumbnail grid, toggled from the navigation menu
+        self.thumbnail_model = ThumbnailModel(
+            self.file_list, self.viewed_values, self.dir_path, self.read_file, self.preview_cache, parent=self
+        )
+        self.thumbnail_dock = ThumbnailDock(self.thumbnail_model, self)
+        self.addDockWidget(Qt.DockWidgetArea.BottomDockWidgetArea, self.thumbnail_dock)
+        self.thumbnail_dock.on_dock_location_changed(Qt.DockWidgetArea.BottomDockWidgetArea)
+        self.thumbnail_dock.setVisible(self.settings.value("show_thumbnails", False, type=bool))
+        self.thumbnail_dock.set_current(self.current_index)
+        self.thumbnailsAction = self.thumbnail_dock.toggleViewAction()
+        self.thumbnailsAction.setText("Show Thumbnails")
+        self.thumbnailsAction.setIcon(self.icons['thumbnails'])
+        self.thumbnailsAction.setShortcut(Qt.Key.Key_T)
+
         # Initiate connections between buttons / sliders and their functions
         self.init_connections()
 
@@ -425,16 +495,36 @@ class MainApp(QMainWindow):
         self.progress_text.setAlignment(Qt.AlignmentFlag.AlignVCenter)
         self.statusBar().addPermanentWidget(self.progress_text)
         self.statusBar().addPermanentWidget(self.progress_bar)
-        percent_viewed = 100 * len([value for value in self.viewed_values.values() if value]) / len(self.file_list)
-        self.update_progress_text()
-        self.update_progress_bar(percent_viewed)
+        viewed_no = self.count_viewed()
+        self.update_progress_text(viewed_no)
+        self.update_progress_bar(100 * viewed_no / len(self.file_list))
         self.change_theme(self.settings.value("theme", "dark_blue.xml"))
 
         self.highlighted_radiogroup = list(self.radiobuttons_boxes[self.stack.currentIndex()+1].keys())[0]
         self.highlight_radiogroup()
 
+        self.telemetry.record(SHOWN, self.file_list[self.current_index])
+
+        # Measure the latency from key presses to the image views or radio buttons painting
+        self.latency_monitor.watch('navigation', [self.image_view.viewport(), self.reference_view.viewport()])
+        self.latency_monitor.watch('rating', [
+            button for page in self.radiobuttons.values() for group in page.values() for button in group.buttons()
+        ])
+        self.latency_monitor.set_enabled(self.profiling or self.latency_threshold > 0)
+        self.connection_manager.connect(self.latency_monitor.measured, self.performance_overlay.refresh)
+
         QTimer.singleShot(0, self.set_items_on_initial_size)
 
+        if self.discovery is not None:
+            # Pick up the images found while the window was being set up, which were not signalled
+            QTimer.singleShot(0, self.on_images_found)
+            if self.discovery.done:
+                QTimer.singleShot(0, self.on_discovery_finished)
+        else:
+            self.start_watching()
+            if self.preflight and not self.loaded:
+                QTimer.singleShot(0, self.run_preflight)
+
         self.central_resize_timer = QTimer()
         self.central_resize_timer.setSingleShot(True)
         self.connection_manager.connect(self.resized, self.start_central_resize_timer)
@@ -497,18 +587,249 @@ class MainApp(QMainWindow):
         """
         self.progress_bar.setValue(int(progress))
 
-    def update_progress_text(self):
+    def count_viewed(self) -> int:
+        """
+        Count the images which have been rated (or failed to load)
+
+        :return: the number of images
+        :rtype: int
+        """
+        return sum(1 for value in self.viewed_values.values() if value)
+
+    def update_progress_text(self, viewed_no: Optional[int] = None):
         """
         Update the progress bar with the current progress
+
+        :param viewed_no: the number of images rated, counted if not given
+        :type viewed_no: Optional[int]
         """
-        viewed_no = len([value for value in self.viewed_values.values() if value])
+        if viewed_no is None:
+            viewed_no = self.count_viewed()
         total_no = len(self.file_list)
         self.progress_text.setText(f"Progress: {viewed_no}/{total_no}")
 
+    def add_image_state(self, filenames: List[str]):
+        """
+        Adds the unrated state of new images: not viewed, not rotated, no notes and no checkboxes or radio buttons set.
+
+        :param filenames: The relative paths of the images
+        :type filenames: List[str]
+        """
+        radiobutton_groups = self.radiobutton_groups2 or self.radiobutton_groups1 or []
+        for f in filenames:
+            self.viewed_values[f] = False
+            self.rotation[f] = 0
+            self.notes[f] = ""
+            self.checkbox_values[f] = {finding: 0 for finding in self.findings} if bool(self.findings) else {}
+            self.radiobutton_values[f] = {group['title']: None for group in radiobutton_groups}
+
+    def reference_key(self, filename: str) -> str:
+        """
+        Gets the reference image of an image, used to keep the images of each reference together when ordering them.
+
+        :param filename: The relative path of the image
+        :type filename: str
+        :return: The path of the reference image
+        :rtype: str
+        """
+        return find_reference_path(filename, self.reference_dir_path, self.reference_delimiter)
+
+    def on_images_found(self):
+        """
+        Adds the images found in the background since the last call to the end of the session, in presentation order.
+        """
+        if self.discovery is None:
+            return
+        new_images = [f for f in self.discovery.take_new() if f not in self.viewed_values]
+        if new_images:
+            self.append_images(order_images(new_images, group_key=self.reference_key, **self.ordering))
+
+    def append_images(self, new_images: List[str]):
+        """
+        Adds new images to the end of the session, unrated, keeping the order of the images already in the session.
+
+        :param new_images: The relative paths of the images, in the order to add them
+        :type new_images: List[str]
+        """
+        was_last = self.current_index == len(self.file_list) - 1
+        self.add_image_state(new_images)
+        self.thumbnail_model.append_files(new_images)
+        viewed_no = self.count_viewed()
+        self.update_progress_text(viewed_no)
+        self.update_progress_bar(100 * viewed_no / len(self.file_list))
+        if was_last:
+            # The next image was the first image again, until now
+            self.prefetch_neighbours()
+
+    def on_discovery_finished(self):
+        """
+        Once every image has been found, puts the images which have not yet been reached in presentation order, and
+        warns about any images without a reference image.
+        """
+        if self.discovery is None:
+            return
+        self.on_images_found()
+        imgs_wout_ref = self.discovery.images_without_reference
+        self.discovery.wait()
+        self.discovery = None
+
+        # Keep every image up to the current image or the last image rated where it is
+        reached = max([self.current_index] + [i for i, f in enumerate(self.file_list) if self.viewed_values[f]]) + 1
+        kept = self.file_list[:reached]
+        kept_images = set(kept)
+        rest = order_images([f for f in self.file_list if f not in kept_images], group_key=self.reference_key,
+                            **self.ordering)
+        self.thumbnail_model.set_file_order(kept + rest)
+        self.thumbnail_dock.set_current(self.current_index)
+        viewed_no = self.count_viewed()
+        self.update_progress_text(viewed_no)
+        self.update_progress_bar(100 * viewed_no / len(self.file_list))
+        self.prefetch_neighbours()
+
+        if imgs_wout_ref:
+            self.show_imgs_wout_ref_warning(imgs_wout_ref)
+            if self.should_quit:
+                self.quit_app()
+                return
+        self.start_watching()
+        if self.preflight:
+            self.run_preflight()
+
+    def start_watching(self):
+        """
+        Starts watching the image directory for images being added or removed, if `watch_folder` is set in the
+        configuration file. Images in archives are not watched.
+        """
+        if not self.watch_folder or self.folder_watcher is not None:
+            return
+        if not os.path.isdir(self.dir_path):
+            logger.info(f"Not watching {self.dir_path} for new images, only directories can be watched.")
+            return
+        self.folder_watcher = FolderWatcher(
+            self.dir_path, self.reference_dir_path, self.reference_delimiter, image_extensions(), self.file_list,
+            expand=image_members, poll_interval=self.watch_poll_interval, parent=self
+        )
+        self.connection_manager.connect(self.folder_watcher.images_added, self.on_images_added)
+        self.connection_manager.connect(self.folder_watcher.images_removed, self.on_images_removed)
+
+    def stop_watching(self):
+        """
+        Stops watching the image directory for new images.
+        """
+        if self.folder_watcher is not None:
+            self.folder_watcher.stop()
+            self.folder_watcher = None
+
+    def on_images_added(self, new_images: List[str]):
+        """
+        Adds the images which have arrived in the image directory to the end of the session.
+
+        :param new_images: The relative paths of the images
+        :type new_images: List[str]
+        """
+        new_images = [f for f in new_images if f not in self.viewed_values]
+        if new_images:
+            logger.info(f"Adding {len(new_images)} new images to the session.")
+            self.append_images(new_images)
+
+    def on_images_removed(self, removed_images: List[str]):
+        """
+        Removes the images whose files have been removed from the image directory from the session, unless they have
+        been rated, annotated or are being shown, keeping the order of the rest.
+
+        :param removed_images: The relative paths of the images
+        :type removed_images: List[str]
+        """
+        current_image = self.file_list[self.current_index]
+        removed = {
+            f for f in removed_images if f in self.viewed_values and f != current_image
+            and not self.viewed_values[f] and not self.notes[f]
+            and all(v is None for v in self.radiobutton_values[f].values())
+            and not any(self.checkbox_values[f].values())
+        }
+        if not removed or len(removed) == len(self.file_list):
+            return
+        logger.info(f"Removing {len(removed)} deleted images from the session.")
+        for values in (self.viewed_values, self.rotation, self.notes, self.checkbox_values, self.radiobutton_values):
+            for f in removed:
+                values.pop(f, None)
+        self.thumbnail_model.set_file_order([f for f in self.file_list if f not in removed])
+        self.current_index = self.file_list.index(current_image)
+        self.thumbnail_dock.set_current(self.current_index)
+        viewed_no = self.count_viewed()
+        self.update_progress_text(viewed_no)
+        self.update_progress_bar(100 * viewed_no / len(self.file_list))
+        self.prefetch_neighbours()
+
+    def run_preflight(self):
+        """
+        Checks that every image of the session and its reference image can be read, in a pool of worker processes,
+        showing the progress. The images which cannot be read are marked as failed, so that readers are not stopped
+        by an error when they reach them, and a summary is shown. See `speedy_iqa.preflight`.
+        """
+        file_list = list(self.file_list)
+        progress_dialog = QProgressDialog("Checking the images can be read...", "Stop", 0, len(file_list), self)
+        progress_dialog.setWindowTitle("Checking Images")
+        progress_dialog.setWindowModality(Qt.WindowModality.WindowModal)
+        progress_dialog.setMinimumDuration(0)
+
+        def update_progress(checked: int, total: int) -> bool:
+            progress_dialog.setMaximum(total)
+            progress_dialog.setValue(checked)
+            QApplication.processEvents()
+            return not progress_dialog.wasCanceled()
+
+        try:
+            results = preflight_images(file_list, self.dir_path, self.reference_dir_path, self.reference_delimiter,
+                                       self.preflight_mode, self.preflight_workers or None, update_progress)
+        except Exception as e:
+            logger.exception(f"Failed to check the images: {e}")
+            QMessageBox.warning(self, "Checking Images", f"Failed to check the images:\n{str(e)}")
+            return
+        finally:
+            stopped = progress_dialog.wasCanceled()
+            progress_dialog.close()
+
+        if not stopped:
+            # Forget earlier issues with images which can now be read
+            for filename in file_list:
+                if filename not in results:
+                    self.preflight_results.pop(filename, None)
+        self.preflight_results.update(results)
+        rows = {filename: row for row, filename in enumerate(self.file_list)}
+        for filename, result in results.items():
+            if result['issue'] == UNREADABLE and filename in rows and self.viewed_values.get(filename) is not True:
+                self.viewed_values[filename] = "FAILED"
+                self.thumbnail_model.refresh_status(rows[filename])
+        viewed_no = self.count_viewed()
+        self.update_progress_text(viewed_no)
+        self.update_progress_bar(100 * viewed_no / len(self.file_list))
+
+        counts = summarise_preflight(results)
+        summary = ", ".join(f"{count} {issue}" for issue, count in counts.items() if count)
+        message = (f"{'Stopped after checking' if stopped else 'Checked'} the images: "
+                   f"{summary or 'every image can be read'}.")
+        if counts[UNREADABLE]:
+            message += ("\n\nImages which cannot be read, or whose reference images cannot be read, have been marked "
+                        "as failed.")
+        logger.info(message.replace("\n\n", " "))
+        QMessageBox.information(self, "Checking Images", message)
+
+    def stop_discovery(self):
+        """
+        Stops finding images in the background, if the images are still being found.
+        """
+        if self.discovery is not None:
+            self.discovery.stop()
+            self.discovery = None
+
     def init_connections(self):
         """
         Initiate connections between buttons / sliders and their functions
         """
+        if self.discovery is not None:
+            self.connection_manager.connect(self.discovery.found, self.on_images_found)
+            self.connection_manager.connect(self.discovery.completed, self.on_discovery_finished)
         self.connection_manager.connect(self.textbox.textChanged, self.on_text_changed)
         self.connection_manager.connect(self.rotate_left_action.triggered, self.rotate_image_left)
         self.connection_manager.connect(self.rotate_right_action.triggered, self.rotate_image_right)
@@ -531,6 +852,8 @@ class MainApp(QMainWindow):
 
         self.connection_manager.connect(self.image_view.verticalScrollBar().valueChanged,
                                         self.sync_vertical_scrollbars)
+
+        self.connection_manager.connect(self.thumbnail_dock.image_selected, self.go_to_thumbnail)
         self.connection_manager.connect(self.reference_view.verticalScrollBar().valueChanged,
                                         self.sync_vertical_scrollbars)
 
@@ -544,6 +867,16 @@ class MainApp(QMainWindow):
             index = self.file_list.index(dialog.selected_file)
             self.change_image("go_to", index)
 
+    def go_to_thumbnail(self, index: int):
+        """
+        Go to the image of the thumbnail clicked in the thumbnail grid
+
+        :param index: The index of the image in the file list
+        :type index: int
+        """
+        if index != self.current_index:
+            self.change_image("go_to", index)
+
     def sync_horizontal_scrollbars(self, value):
         """
         Sync the horizontal scrollbars of the image and reference views
@@ -597,19 +930,28 @@ class MainApp(QMainWindow):
         current_time_str = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
 
         # Construct the backup file name
-        backup_file_name = f"auto_backup_{current_time_str}.bak"
+        if self.session_format == 'parquet':
+            backup_file_name = f"auto_backup_{current_time_str}.parquet"
+        else:
+            backup_file_name = f"auto_backup_{current_time_str}.bak"
 
         # Get a list of existing backup files
         backup_files = sorted(
-            [f for f in os.listdir(backup_folder_path)])
+            [f for f in os.listdir(backup_folder_path) if not f.endswith(TELEMETRY_SUFFIX)])
 
-        # If the number of backup files exceeds the maximum, delete the oldest one
+        # If the number of backup files exceeds the maximum, delete the oldest one (and its telemetry)
         if len(backup_files) >= self.max_backups:
-            os.remove(os.path.join(backup_folder_path, backup_files[0]))
+            oldest_backup = os.path.join(backup_folder_path, backup_files[0])
+            os.remove(oldest_backup)
+            if os.path.isfile(telemetry_path(oldest_backup)):
+                os.remove(telemetry_path(oldest_backup))
             backup_files.pop(0)
 
         # Copy the original file to the backup folder with the new name
-        self.save_json(os.path.join(backup_folder_path + backup_file_name))
+        self.save_json(os.path.join(backup_folder_path, backup_file_name), self.session_format)
+
+        if self.preview_cache is not None:
+            self.preview_cache.flush()
 
         # Add the new backup file name to the list
         self.backup_files.append(backup_file_name)
@@ -713,43 +1055,80 @@ class MainApp(QMainWindow):
         super().resizeEvent(event)
         self.resized.emit()
 
-    def load_file(self):
+    def open_storage(self):
         """
-        Loads the image file and applies the look-up tables.
+        Opens the image and reference image directories, either of which may be a zip or tar archive. The index of the
+        members of an archive is cached alongside the session file or, for a new session, in the cache directory.
         """
-        img_path = os.path.join(self.dir_path, self.file_list[self.current_index])
-        img_extension = os.path.splitext(img_path)[1]
-        # print(img_path)
-        # print(img_extension)
-        # print(self.reference_dir_path)
-
-        ## Uncomment this block if adding delimiter to reference name
-        if self.reference_delimiter and self.reference_delimiter != "":
-            reference_name = self.file_list[self.current_index].rsplit(self.reference_delimiter, 1)[0]
+        if self.settings.value("new_json", False) or not self.json_path:
+            index_path = os.path.join(self.cache_dir, 'new_session' + ARCHIVE_INDEX_SUFFIX)
         else:
-            reference_name = os.path.splitext(self.file_list[self.current_index])[0]
+            index_path = archive_index_path(self.json_path)
+        for path in (self.dir_path, self.reference_dir_path):
+            try:
+                get_storage(path, index_path)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Failed to open {path}: {e}")
 
-        reference_name = os.path.basename(reference_name)
+    def save_archive_index(self, session_path: str):
+        """
+        Saves the index of the members of the image and reference image archives, if either is an archive, alongside
+        a session file so that they are not scanned again when the session is loaded.
 
-        if not reference_name.endswith(img_extension) and os.path.isfile(
-                os.path.join(self.reference_dir_path, reference_name + img_extension)
-        ):
-            reference_name = reference_name + img_extension
+        :param session_path: The path to the session file
+        :type session_path: str
+        """
+        for path in (self.dir_path, self.reference_dir_path):
+            try:
+                storage = get_storage(path)
+            except (OSError, ValueError):
+                continue
+            if isinstance(storage, ArchiveStorage):
+                storage.save_index(archive_index_path(session_path))
 
-        # print(reference_name)
-        # print(os.path.isfile(
-        #         os.path.join(self.reference_dir_path, reference_name + img_extension)
-        # ))
+    def get_file_paths(self, index: int) -> Tuple[str, str, str]:
+        """
+        Gets the paths to an image in the file list and to its reference image.
 
-        ## Comment out this line if adding delimiter to reference name
-        # reference_name = os.path.basename(self.file_list[self.current_index])
+        :param index: The index of the image in the file list
+        :type index: int
+        :return: The path to the image, the path to the reference image and the extension of both. Images within a file
+            holding many images (e.g. a .npy stack) are given as image keys, e.g. 'stack.npy::12'.
+        :rtype: Tuple[str, str, str]
+        """
+        file_name, member = split_image_key(self.file_list[index])
+        img_path = join_image_key(os.path.join(self.dir_path, file_name), member)
+        img_extension = image_extension(file_name)
+        reference_path = find_reference_path(self.file_list[index], self.reference_dir_path, self.reference_delimiter)
+        return img_path, reference_path, img_extension
 
-        reference_path = os.path.join(self.reference_dir_path, reference_name)
+    def load_file(self):
+        """
+        Loads the image file and applies the look-up tables.
+        """
+        img_path, reference_path, img_extension = self.get_file_paths(self.current_index)
+        preflight_result = self.preflight_results.get(self.file_list[self.current_index])
+        if preflight_result is not None:
+            self.statusBar().showMessage(f"Image check: the {preflight_result['file']} is {preflight_result['issue']} "
+                                         f"({preflight_result['message']})")
+        else:
+            self.statusBar().clearMessage()
         try:
-            self.image = self.read_file(img_path, img_extension)
-            self.reference_image = self.read_file(reference_path, img_extension)
+            self.image = self.read_cached_file(img_path, img_extension)
+            self.reference_image = self.read_cached_file(reference_path, img_extension)
+            # Keep the decoded images, so going back to this image does not decode it again
+            self.previous_images = {img_path: self.image, reference_path: self.reference_image}
 
         except Exception as e:
+            if preflight_result is not None and preflight_result['issue'] == UNREADABLE:
+                # Already found by the image check, so show blank images rather than stopping the reader
+                self.image = np.zeros((256, 256), dtype=np.uint8)
+                self.reference_image = self.image
+                self.previous_images = {}
+                self.viewed_values[self.file_list[self.current_index]] = "FAILED"
+                logger.warning(f"Failed to load file: {img_path} - Message: {str(e)}")
+                return
+
             # QMessageBox.critical(self, "Error", f"Failed to load file:\n{str(e)}",
             #                      QMessageBox.StandardButton.Ok,
             #                      defaultButton=QMessageBox.StandardButton.Ok)
@@ -778,24 +1157,9 @@ class MainApp(QMainWindow):
         """
         images_wout_ref = []
         for i, file in enumerate(self.file_list):
-            img_extension = os.path.splitext(file)[1]
-            if self.reference_delimiter and self.reference_delimiter != "":
-                reference_name = self.file_list[self.current_index].rsplit(self.reference_delimiter, 1)[0]
-            else:
-                reference_name = os.path.splitext(os.path.basename(self.file_list[self.current_index]))[0]
-            reference_name = os.path.basename(reference_name)
-            if not reference_name.endswith(img_extension) and os.path.isfile(
-                    os.path.join(self.reference_dir_path, reference_name + img_extension)
-            ):
-                reference_name = reference_name + img_extension
-            if not os.path.isfile(os.path.join(self.reference_dir_path, reference_name)):
+            reference_path = self.get_file_paths(i)[1]
+            if not is_file(split_image_key(reference_path)[0]):
                 images_wout_ref.append(file)
-            # if i == 0:
-            #     print(f"File: {file}")
-            #     print(f"Reference delimiter: {self.reference_delimiter}")
-            #     print(f"Reference name: {reference_name}")
-            #     print(f"Reference path: {os.path.join(self.reference_dir_path, reference_name)}")
-            #     print(f"Reference exists: {os.path.isfile(os.path.join(self.reference_dir_path, reference_name))}")
         return images_wout_ref
 
     def show_imgs_wout_ref_warning(self, imgs_wout):
@@ -838,40 +1202,122 @@ class MainApp(QMainWindow):
             self.should_quit = "no_ref"
 
     @staticmethod
-    def read_file(file_path: str, file_extension: str):
+    def read_file(file_path: str, file_extension: str, max_size: Optional[int] = None):
         """
-        Reads the image file and applies the look-up tables.
+        Reads the image file and applies the look-up tables. See `speedy_iqa.decoders.read_file`.
 
         :param file_path: The path to the image file
         :type file_path: str
         :param file_extension: The extension of the image file
         :type file_extension: str
+        :param max_size: If set, the image may be decoded at a lower resolution, with its longest side at least this
+            long (e.g. for thumbnails)
+        :type max_size: Optional[int]
         """
-        if file_extension == ".dcm":
-            # Read the DICOM file
-            ds = pydicom.dcmread(file_path)
-            image = ds.pixel_array
-            image = apply_modality_lut(image, ds)
-            image = apply_voi_lut(image.astype(int), ds, 0)
-            if ds.PhotometricInterpretation == "MONOCHROME1":
-                image = invert_grayscale(image)
-        else:
-            # Read the image file
-            image = iio.v3.imread(file_path)
-        image = remap_to_8bit(image)
+        return read_file(file_path, file_extension, max_size=max_size)
+
+    def read_cached_file(self, file_path: str, file_extension: str) -> np.ndarray:
+        """
+        Reads the image file from the image cache if it is cached and unchanged, otherwise reads it with `read_file`
+        and adds it to the cache.
+
+        :param file_path: The path to the image file
+        :type file_path: str
+        :param file_extension: The extension of the image file
+        :type file_extension: str
+        :return: The 8-bit image
+        :rtype: np.ndarray
+        """
+        image = self.previous_images.get(file_path)
+        if image is not None:
+            return image
+        image = self.take_prefetched(file_path)
+        if image is not None and self.preview_cache is None:
+            return image
+        if self.preview_cache is None:
+            with self.stage_timer.stage("read_file"):
+                return self.read_file(file_path, file_extension)
+        if image is None:
+            with self.stage_timer.stage("cache_get"):
+                image = self.preview_cache.get(file_path)
+            if image is not None:
+                return image
+            with self.stage_timer.stage("read_file"):
+                image = self.read_file(file_path, file_extension)
+        with self.stage_timer.stage("cache_put"):
+            self.preview_cache.put(file_path, image)
         return image
 
+    def take_prefetched(self, file_path: str) -> Optional[np.ndarray]:
+        """
+        Takes the image decoded in the background for a file, waiting for the decode to finish if it is still running.
+
+        :param file_path: The path to the image file
+        :type file_path: str
+        :return: The 8-bit image, or None if the file was not prefetched or could not be decoded in the background
+        :rtype: Optional[np.ndarray]
+        """
+        future = self.prefetched.pop(file_path, None)
+        if future is None or future.cancelled():
+            return None
+        try:
+            with self.stage_timer.stage("prefetch_wait"):
+                return future.result()
+        except Exception as e:
+            logger.warning(f"Failed to decode {file_path} in the background, reading it again: {e}")
+            return None
+
+    def prefetch_neighbours(self):
+        """
+        Starts decoding the images (and reference images) either side of the current image in the background, so that
+        moving to them does not wait for them to be decoded. The image shown before the current one is kept rather
+        than decoded again. Decodes of images which are no longer neighbours are cancelled if they have not started.
+        """
+        self.stage_upcoming()
+        if self.decoder is None or len(self.file_list) < 2:
+            return
+        wanted = {}
+        for index in (self.current_index + 1, self.current_index - 1):
+            img_path, reference_path, img_extension = self.get_file_paths(index % len(self.file_list))
+            for path in (img_path, reference_path):
+                wanted[path] = img_extension
+
+        for path in list(self.prefetched):
+            if path not in wanted:
+                self.prefetched.pop(path).cancel()
+        for path, extension in wanted.items():
+            if path in self.prefetched or path in self.previous_images:
+                continue
+            if not is_file(split_image_key(path)[0]):
+                continue
+            if self.preview_cache is not None and self.preview_cache.has_image(path):
+                continue
+            self.prefetched[path] = self.decoder.submit(path, extension)
+
+    def stage_upcoming(self):
+        """
+        Starts copying the files of the images (and reference images) after the current image to the local staging
+        directory, if staging is enabled, so that decoding them does not wait on slow storage.
+        """
+        if self.staging is None or len(self.file_list) < 2:
+            return
+        paths = []
+        for offset in range(1, min(self.staging_ahead, len(self.file_list) - 1) + 1):
+            img_path, reference_path = self.get_file_paths((self.current_index + offset) % len(self.file_list))[:2]
+            paths += [split_image_key(img_path)[0], split_image_key(reference_path)[0]]
+        self.staging.stage(paths)
+
     def load_image(self):
         """
         Loads the image into the image view.
         """
         # Load the main image
-        qimage = array2qimage(self.image, normalize=self.normalise_images)
+        qimage = array_to_qimage(self.image, normalize=self.normalise_images)
         self.pixmap = QPixmap.fromImage(qimage)
         self.pixmap_item.setPixmap(self.pixmap)
 
         # Load the reference image
-        reference_qimage = array2qimage(self.reference_image, normalize=self.normalise_images)
+        reference_qimage = array_to_qimage(self.reference_image, normalize=self.normalise_images)
         self.reference_pixmap = QPixmap.fromImage(reference_qimage)
         self.reference_pixmap_item.setPixmap(self.reference_pixmap)
 
@@ -923,7 +1369,9 @@ class MainApp(QMainWindow):
                                            f"{default_gb_color.green()}, "
                                            f"{default_gb_color.blue()}, "
                                            f"{int(default_gb_color.alpha() * self.highlighted_opacity)})")
-        group_box.setStyleSheet("QGroupBox { font-size: 14px; }")
+        # Styled by the application stylesheet rules in highlight_stylesheet
+        group_box.setProperty("radiogroup", True)
+        group_box.setProperty("highlighted", False)
         options = [str(option) for option in options_list]
         max_label_length = max([len(label) for label in options])
         layout = QGridLayout()
@@ -949,6 +1397,7 @@ class MainApp(QMainWindow):
                                         partial(self.on_radiobutton_changed, name))
         self.connection_manager.connect(self.radiobuttons[page][name].idClicked,
                                         partial(self.highlight_next_radiogroup, name))
+        self.connection_manager.connect(self.radiobuttons[page][name].idClicked, self.record_rating)
 
     def on_radiobutton_changed(self, name, id, checked):
         """
@@ -966,10 +1415,15 @@ class MainApp(QMainWindow):
 
         if all(v is not None for v in self.radiobutton_values[self.file_list[self.current_index]].values()):
             self.viewed_values[self.file_list[self.current_index]] = True
-            self.viewed_icon.setPixmap(
-                QPixmap(self.icons['viewed'].pixmap(self.file_tool_bar.iconSize() * 2) if self.is_image_viewed()
-                        else self.icons['not_viewed'].pixmap(self.file_tool_bar.iconSize() * 2))
-            )
+            self.thumbnail_model.refresh_status(self.current_index)
+            self.set_viewed_indicator(label=False)
+
+    def record_rating(self, *args):
+        """
+        Records a rating by the user in the navigation telemetry. Not connected to idToggled, as that is also emitted
+        when restoring the saved ratings of an image.
+        """
+        self.telemetry.record(RATED, self.file_list[self.current_index])
 
     def highlight_next_radiogroup(self, name):
         """
@@ -988,19 +1442,35 @@ class MainApp(QMainWindow):
 
     def highlight_radiogroup(self):
         """
-        Highlights the next radio group.
+        Highlights the next radio group, by setting the `highlighted` property used by the application stylesheet. Only
+        the group boxes which are highlighted or unhighlighted are re-polished, rather than re-parsing a stylesheet for
+        every group box.
         """
-        for name, group_box in self.radiobuttons_boxes[self.stack.currentIndex()+1].items():
-            if name == self.highlighted_radiogroup:
-                group_box.setStyleSheet(
-                    f"QGroupBox {{ font-size: 14px; "
-                    f"background-color: {self.highlighted_groupbox_color}; }}"
-                )
-            else:
-                group_box.setStyleSheet(
-                    f"QGroupBox {{ font-size: 14px; "
-                    f"background-color: {self.default_groupbox_color}; }}"
-                )
+        group_box = self.radiobuttons_boxes[self.stack.currentIndex()+1].get(self.highlighted_radiogroup)
+        if group_box is self.highlighted_groupbox:
+            return
+        for box, highlighted in ((self.highlighted_groupbox, False), (group_box, True)):
+            if box is not None:
+                box.setProperty("highlighted", highlighted)
+                box.style().unpolish(box)
+                box.style().polish(box)
+                box.update()
+        self.highlighted_groupbox = group_box
+
+    def highlight_stylesheet(self) -> str:
+        """
+        Gets the rules styling the radio group boxes, and highlighting the current one, to be appended to the
+        stylesheet of the theme.
+
+        :return: The stylesheet rules
+        :rtype: str
+        """
+        return (
+            f"\nQGroupBox[radiogroup=\"true\"] {{ font-size: 14px; "
+            f"background-color: {self.default_groupbox_color}; }}"
+            f"\nQGroupBox[radiogroup=\"true\"][highlighted=\"true\"] {{ "
+            f"background-color: {self.highlighted_groupbox_color}; }}\n"
+        )
 
     def uncheck_all_radiobuttons(self):
         """
@@ -1045,23 +1515,28 @@ class MainApp(QMainWindow):
                 self.uncheck_all_radiobuttons_in_group(self.radiobuttons[page][name])
                 # self.uncheck_all_radiobuttons()
 
-    def open_page2_if_required_and_page1_complete(self):
+    def open_page2_if_required_and_page1_complete(self, highlight: bool = True):
         """
         Opens page 2 if required and page 1 is complete.
+
+        :param highlight: Whether to highlight the first radio group, False if the caller will highlight a group
+        :type highlight: bool
         """
         if 1 in self.radiobuttons:
             for name in self.radiobuttons[1].keys():
                 if self.radiobutton_values.get(self.file_list[self.current_index]).get(name) is None:
-                    self.show_page1()
+                    self.show_page1(highlight=False)
                     self.highlighted_radiogroup = list(self.radiobuttons[1].keys())[0]
-                    self.highlight_radiogroup()
+                    if highlight:
+                        self.highlight_radiogroup()
                     return
         if 2 in self.radiobuttons:
             for name in self.radiobuttons[2].keys():
                 if self.radiobutton_values.get(self.file_list[self.current_index]).get(name) is None:
-                    self.show_page2()
+                    self.show_page2(highlight=False)
                     self.highlighted_radiogroup = list(self.radiobuttons[2].keys())[0]
-                    self.highlight_radiogroup()
+                    if highlight:
+                        self.highlight_radiogroup()
         return
 
     def set_labelling_toolbar(self):
@@ -1089,13 +1564,9 @@ class MainApp(QMainWindow):
 
         self.viewed_label.setAlignment(Qt.AlignmentFlag.AlignHCenter)
         self.viewed_label.setObjectName("viewed_label")
-        self.viewed_label.setText(("" if self.is_image_viewed() else "NOT ") + "PREVIOUSLY RATED")
         main_content_layout.addWidget(self.viewed_label)
         self.viewed_icon.setAlignment(Qt.AlignmentFlag.AlignHCenter)
-        self.viewed_icon.setPixmap(
-            QPixmap(self.icons['viewed'].pixmap(self.file_tool_bar.iconSize() * 2) if self.is_image_viewed()
-                    else self.icons['not_viewed'].pixmap(self.file_tool_bar.iconSize() * 2))
-        )
+        self.set_viewed_indicator()
         main_content_layout.addWidget(self.viewed_icon)
 
         spacer2 = QWidget()
@@ -1267,21 +1738,29 @@ class MainApp(QMainWindow):
         """Correct the orientation of the labelling toolbar."""
         self.labelling_toolbar.setOrientation(Qt.Orientation.Vertical)
 
-    def show_page1(self):
+    def show_page1(self, highlight: bool = True):
         """
         Shows the first page of the stacked widget.
+
+        :param highlight: Whether to highlight the first radio group, False if the caller will highlight a group
+        :type highlight: bool
         """
         self.stack.setCurrentIndex(0)
         self.highlighted_radiogroup = list(self.radiobuttons_boxes[self.stack.currentIndex()+1].keys())[0]
-        self.highlight_radiogroup()
+        if highlight:
+            self.highlight_radiogroup()
 
-    def show_page2(self):
+    def show_page2(self, highlight: bool = True):
         """
         Shows the second page of the stacked widget.
+
+        :param highlight: Whether to highlight the first radio group, False if the caller will highlight a group
+        :type highlight: bool
         """
         self.stack.setCurrentIndex(1)
         self.highlighted_radiogroup = list(self.radiobuttons_boxes[self.stack.currentIndex()+1].keys())[0]
-        self.highlight_radiogroup()
+        if highlight:
+            self.highlight_radiogroup()
 
     def go_to_next_page_or_image(self):
         """
@@ -1322,6 +1801,9 @@ class MainApp(QMainWindow):
         if direction not in ("previous", "next", "go_to", "next_unrated"):
             raise ValueError("Invalid direction value. Expected 'previous' or 'next'.")
 
+        previous_index = self.current_index
+        self.telemetry.record(LEFT, self.file_list[self.current_index])
+
         if self.viewed_values[self.file_list[self.current_index]] != "FAILED":
             if all(v is not None for v in self.radiobutton_values[self.file_list[self.current_index]].values()):
                 self.viewed_values[self.file_list[self.current_index]] = True
@@ -1338,7 +1820,11 @@ class MainApp(QMainWindow):
         elif direction == "go_to":
             self.current_index = go_to_index
         elif direction == "next":
-            if self.current_index == len(self.file_list) - 1:
+            if self.current_index == len(self.file_list) - 1 and self.discovery is not None:
+                self.on_images_found()
+            if self.current_index == len(self.file_list) - 1 and self.discovery is not None:
+                QMessageBox.information(self, "Finding Images", "More images are still being found, please try again.")
+            elif self.current_index == len(self.file_list) - 1:
                 # All images have been viewed
                 QMessageBox.information(self, "All Images Viewed", "You have viewed all the images.")
                 self.current_index = 0
@@ -1357,37 +1843,87 @@ class MainApp(QMainWindow):
             else:
                 self.current_index = self.file_list.index(next_unrated)
 
-        self.load_file()
-        self.apply_stored_rotation()
-        self.load_image()
-
-        self.setWindowTitle(f"Speedy IQA - File: {self.file_list[self.current_index]}")
-        self.image_view.zoom = 1
-        self.reference_view.zoom = 1
+        change_image_start = time.perf_counter()
+        with self.stage_timer.stage("load_file"):
+            self.load_file()
+        with self.stage_timer.stage("apply_stored_rotation"):
+            self.apply_stored_rotation()
 
-        self.image_view.fitInView(self.image_scene.items()[-1].boundingRect(), Qt.AspectRatioMode.KeepAspectRatio)
-        self.reference_view.fitInView(self.reference_scene.items()[-1].boundingRect(), Qt.AspectRatioMode.KeepAspectRatio)
-
-        self.show_page1()
-        self.set_checkbox_value()
-        self.set_checked_radiobuttons(1)
-        self.set_checked_radiobuttons(2)
-
-        self.viewed_label.setText(("" if self.is_image_viewed() else "NOT ") + "PREVIOUSLY RATED")
-        self.viewed_icon.setPixmap(
-            QPixmap(self.icons['viewed'].pixmap(self.file_tool_bar.iconSize() * 2) if self.is_image_viewed()
-                    else self.icons['not_viewed'].pixmap(self.file_tool_bar.iconSize() * 2))
-        )
-
-        self.open_page2_if_required_and_page1_complete()
-        self.highlighted_radiogroup = list(self.radiobuttons_boxes[self.stack.currentIndex()+1].keys())[0]
-        self.highlight_radiogroup()
-
-        self.update_progress_text()
-        percent_viewed = 100*len([value for value in self.viewed_values.values() if value])/len(self.file_list)
-        self.update_progress_bar(percent_viewed)
+        # Update the whole window in one transaction, so that restoring the state of the new image causes a single
+        # relayout and repaint rather than one per widget changed
+        self.setUpdatesEnabled(False)
+        try:
+            with self.stage_timer.stage("load_image"):
+                self.load_image()
+
+            self.setWindowTitle(f"Speedy IQA - File: {self.file_list[self.current_index]}")
+            self.image_view.zoom = 1
+            self.reference_view.zoom = 1
+
+            with self.stage_timer.stage("fitInView"):
+                self.image_view.fitInView(self.image_scene.items()[-1].boundingRect(),
+                                          Qt.AspectRatioMode.KeepAspectRatio)
+                self.reference_view.fitInView(self.reference_scene.items()[-1].boundingRect(),
+                                              Qt.AspectRatioMode.KeepAspectRatio)
+
+            with self.stage_timer.stage("restore_labels"):
+                # The stored values are being restored, not changed, so the radio button slots are not needed
+                blockers = [QSignalBlocker(group) for page in self.radiobuttons.values() for group in page.values()]
+                self.show_page1(highlight=False)
+                self.set_checkbox_value()
+                self.set_checked_radiobuttons(1)
+                self.set_checked_radiobuttons(2)
+                del blockers
+
+                self.set_viewed_indicator()
+
+                self.open_page2_if_required_and_page1_complete(highlight=False)
+                self.highlighted_radiogroup = list(self.radiobuttons_boxes[self.stack.currentIndex()+1].keys())[0]
+                self.highlight_radiogroup()
+
+            viewed_no = self.count_viewed()
+            self.update_progress_text(viewed_no)
+            self.update_progress_bar(100 * viewed_no / len(self.file_list))
+
+            notes = self.notes[self.file_list[self.current_index]]
+            if self.textbox.toPlainText() != notes:
+                self.textbox.setPlainText(notes)
+
+            self.thumbnail_model.refresh_status(previous_index)
+            self.thumbnail_model.refresh_status(self.current_index)
+            self.thumbnail_dock.set_current(self.current_index)
+        finally:
+            self.setUpdatesEnabled(True)
+
+        self.telemetry.record(SHOWN, self.file_list[self.current_index])
+        self.prefetch_neighbours()
+
+        if self.stage_timer.enabled:
+            self.stage_timer.record("change_image", time.perf_counter() - change_image_start)
+            self.performance_overlay.refresh()
+
+    def toggle_performance_overlay(self, checked: bool):
+        """
+        Shows or hides the overlay of stage timings and key-to-paint latencies. Timing is always enabled while the
+        overlay is shown, otherwise it is only enabled if `profiling` (or, for the latencies, `latency_threshold_ms`)
+        is set in the config file.
+
+        :param checked: Whether to show the overlay
+        :type checked: bool
+        """
+        self.stage_timer.enabled = checked or self.profiling
+        self.latency_monitor.set_enabled(checked or self.profiling or self.latency_threshold > 0)
+        self.performance_overlay.setVisible(checked)
+        self.performance_overlay.refresh()
 
-        self.textbox.setPlainText(self.notes[self.file_list[self.current_index]])
+    def dump_stage_timings(self):
+        """
+        Writes the stage timings to the log.
+        """
+        self.stage_timer.dump(logger)
+        logger.info("Key-to-paint latencies:\n" + self.latency_monitor.format_summary())
+        console_msg.info("Stage timings:\n" + self.stage_timer.format_summary())
+        console_msg.info("Key-to-paint latencies:\n" + self.latency_monitor.format_summary())
 
     def previous_image(self):
         """
@@ -1407,6 +1943,28 @@ class MainApp(QMainWindow):
         """
         self.change_image("next_unrated")
 
+    def set_viewed_indicator(self, label: bool = True):
+        """
+        Sets the icon (and label) showing whether the current image has been rated. The icon pixmaps are rendered once
+        per theme and only set when the state shown changes.
+
+        :param label: Whether to also set the label, which describes whether the image was rated before it was shown
+        :type label: bool
+        """
+        viewed = bool(self.is_image_viewed())
+        if label:
+            self.viewed_label.setText(("" if viewed else "NOT ") + "PREVIOUSLY RATED")
+        if self.viewed_pixmaps is None:
+            icon_size = self.file_tool_bar.iconSize() * 2
+            self.viewed_pixmaps = {
+                True: self.icons['viewed'].pixmap(icon_size),
+                False: self.icons['not_viewed'].pixmap(icon_size),
+            }
+            self.viewed_icon_state = None
+        if viewed != self.viewed_icon_state:
+            self.viewed_icon.setPixmap(self.viewed_pixmaps[viewed])
+            self.viewed_icon_state = viewed
+
     def is_image_viewed(self) -> bool:
         """
         Checks if the current image has been viewed previously.
@@ -1443,6 +2001,7 @@ class MainApp(QMainWindow):
             elif key == Qt.Key.Key_4:
                 self.radiobuttons[self.stack.currentIndex()+1][self.highlighted_radiogroup].button(3).setChecked(True)
                 self.highlight_next_radiogroup(self.highlighted_radiogroup)
+            self.record_rating()
 
         elif key == Qt.Key.Key_Enter or key == Qt.Key.Key_Return:
             self.go_to_next_page_or_image()
@@ -1476,17 +2035,20 @@ class MainApp(QMainWindow):
         """
         Save as dialog.
         """
-        file_dialog = QFileDialog(self, 'Save to JSON', self.settings.value("default_directory", resource_dir))
-        mime_type_filters = ["application/json", "application/octet-stream"]
-        file_dialog.setMimeTypeFilters(mime_type_filters)
+        file_dialog = QFileDialog(self, 'Save Progress', self.settings.value("default_directory", resource_dir))
+        name_filters = ["JSON Files (*.json)", "Parquet Files (*.parquet)", "All Files (*)"]
+        file_dialog.setNameFilters(name_filters)
+        file_dialog.selectNameFilter(name_filters[1] if self.session_format == 'parquet' else name_filters[0])
         file_dialog.setFileMode(QFileDialog.FileMode.ExistingFile)
         file_dialog.setAcceptMode(QFileDialog.AcceptMode.AcceptSave)
-        file_dialog.setDefaultSuffix("json")
-        file_dialog.selectFile('untitled.json')
+        suffix = SESSION_FORMATS.get(self.session_format, '.json').lstrip('.')
+        file_dialog.setDefaultSuffix(suffix)
+        file_dialog.selectFile(f'untitled.{suffix}')
 
         if file_dialog.exec() == QFileDialog.DialogCode.Accepted:
             save_path = file_dialog.selectedFiles()[0]
             self.save_json(save_path)
+            self.save_archive_index(save_path)
             self.settings.setValue("default_directory", file_dialog.directory().path())
             self.save_settings()
             return True
@@ -1498,6 +2060,8 @@ class MainApp(QMainWindow):
             'image_directory': self.dir_path,
             'reference_image_directory': self.reference_dir_path,
             'reference_delimiter': self.reference_delimiter,
+            'ordering': self.ordering,
+            'preflight': self.preflight_results,
             'files': []
         }
         for filename in self.file_list:
@@ -1527,20 +2091,25 @@ class MainApp(QMainWindow):
             })
         return data
 
-    def save_json(self, selected_file: str):
+    def save_json(self, selected_file: str, session_format: Optional[str] = None):
         """
-        Saves the current outputs to a JSON file.
+        Saves the current outputs to a session file, either as JSON or Parquet.
 
         :param selected_file: Path to the file to save to
         :type selected_file: str
+        :param session_format: 'json' or 'parquet', if None the format is taken from the file extension
+        :type session_format: Optional[str]
         """
         data = self.create_output_dictionary()
-        with open(selected_file, 'w') as file:
-            json.dump(data, file, indent=2)
+        save_session(data, selected_file, session_format)
+        try:
+            self.telemetry.save(selected_file)
+        except OSError as e:
+            logger.warning(f"Failed to save the navigation telemetry for {selected_file}: {e}")
 
     def load_from_json(self) -> bool:
         """
-        Loads the previous saved outputs from a JSON file.
+        Loads the previous saved outputs from a JSON or Parquet session file.
 
         :return: Whether the load was successful
         :rtype: bool
@@ -1550,34 +2119,24 @@ class MainApp(QMainWindow):
             return False
         else:
             self.settings.setValue("default_directory", os.path.dirname(self.json_path))
-            with open(self.json_path, 'r') as file:
-                data = json.load(file)
-
-            self.file_list = [entry['filename'] for entry in data['files']]
-            self.dir_path = os.path.normpath(data['image_directory'])
-            self.reference_dir_path = os.path.normpath(data['reference_image_directory'])
-            self.reference_delimiter = data['reference_delimiter']
-            self.normalise_images = data['normalise_images']
-
-            for entry in data['files']:
-                filename = entry['filename']
-                self.viewed_values[filename] = entry['rated']
-                self.rotation[filename] = entry['rotation']
-                self.notes[filename] = entry['notes']
-
-                if 'checkboxes' in entry:
-                    for cbox, value in entry['checkboxes'].items():
-                        if filename in self.checkbox_values:
-                            self.checkbox_values[filename][cbox] = value
-                        else:
-                            self.checkbox_values[filename] = {cbox: value}
-
-                if 'radiobuttons' in entry:
-                    for name, value in entry['radiobuttons'].items():
-                        if filename in self.radiobutton_values:
-                            self.radiobutton_values[filename][name] = value
-                        else:
-                            self.radiobutton_values[filename] = {name: value}
+            metadata, columns = load_session_columns(self.json_path)
+
+            self.file_list = columns['filename']
+            self.dir_path = os.path.normpath(metadata['image_directory'])
+            self.reference_dir_path = os.path.normpath(metadata['reference_image_directory'])
+            self.open_storage()
+            self.reference_delimiter = metadata['reference_delimiter']
+            # The order is kept in the session, the strategy and seed which made it are kept to be saved again
+            self.ordering = metadata.get('ordering', {'strategy': 'random', 'seed': DEFAULT_SEED})
+            self.normalise_images = metadata.get('normalise_images', self.settings.value("normalise_images", False))
+            self.preflight_results = metadata.get('preflight', {})
+
+            # Build the per-file state straight from the columns, avoiding a dictionary per file entry
+            self.viewed_values = dict(zip(self.file_list, columns['rated']))
+            self.rotation = dict(zip(self.file_list, columns['rotation']))
+            self.notes = dict(zip(self.file_list, columns['notes']))
+            self.checkbox_values = dict(zip(self.file_list, columns['checkboxes']))
+            self.radiobutton_values = dict(zip(self.file_list, columns['radiobuttons']))
             return True
 
     def export_to_csv(self):
@@ -1658,8 +2217,30 @@ class MainApp(QMainWindow):
             event.ignore()
             return
 
+        self.settings.setValue("show_thumbnails", self.thumbnail_dock.isVisible())
+        self.stop_discovery()
+        self.stop_watching()
+        self.thumbnail_model.shutdown()
+        self.shutdown_decoder()
+        if self.preview_cache is not None:
+            self.preview_cache.flush()
+
         event.accept()
 
+    def shutdown_decoder(self):
+        """
+        Stops decoding and staging images in the background, cancelling the outstanding prefetches.
+        """
+        for future in self.prefetched.values():
+            future.cancel()
+        self.prefetched.clear()
+        if self.decoder is not None:
+            self.decoder.shutdown()
+            self.decoder = None
+        if self.staging is not None:
+            self.staging.close()
+            self.staging = None
+
     def init_menus(self):
         """
         Initializes the menus.
@@ -1668,7 +2249,8 @@ class MainApp(QMainWindow):
             self.rotate_left_action, self.rotate_right_action, self.zoom_in_action, self.zoom_out_action,
         ]
 
-        nav_actions = [self.prevAction, self.nextAction, self.nextUnratedAction, self.goToAction]
+        nav_actions = [self.prevAction, self.nextAction, self.nextUnratedAction, self.goToAction,
+                       self.thumbnailsAction]
 
         # create the help menu
         help_menu = QMenu("Help", self)
@@ -1689,6 +2271,9 @@ class MainApp(QMainWindow):
         help_menu.addAction(menu_save_as_action)
         file_menu.addSeparator()
         file_menu.addAction(self.exportAction)
+        self.preflightAction = QAction("&Check Images...", self)
+        file_menu.addAction(self.preflightAction)
+        self.connection_manager.connect(self.preflightAction.triggered, self.run_preflight)
         help_menu.addAction(self.exportAction)
         file_menu.addSeparator()
         file_menu.addAction(self.exitAction)
@@ -1755,6 +2340,16 @@ class MainApp(QMainWindow):
             style_menu.addAction(self.theme_actions[theme])
 
         # add the menus to the menu bar
+        help_menu.addSeparator()
+        self.performanceOverlayAction = QAction("Show Performance Overlay", self)
+        self.performanceOverlayAction.setCheckable(True)
+        self.performanceOverlayAction.setShortcut(Qt.Key.Key_F12)
+        self.connection_manager.connect(self.performanceOverlayAction.toggled, self.toggle_performance_overlay)
+        help_menu.addAction(self.performanceOverlayAction)
+        self.dumpTimingsAction = QAction("Log Stage Timings", self)
+        self.connection_manager.connect(self.dumpTimingsAction.triggered, self.dump_stage_timings)
+        help_menu.addAction(self.dumpTimingsAction)
+
         menu_bar = QMenuBar(self)
         menu_bar.addMenu(file_menu)
         menu_bar.addMenu(image_menu)
@@ -1773,7 +2368,7 @@ class MainApp(QMainWindow):
         :type theme: str
         """
 
-        apply_stylesheet(self.app, theme=theme)
+        apply_theme(self.app, theme, self.highlight_stylesheet())
         self.settings.setValue("theme", theme)
 
         self.image_view.change_label_color(theme)
@@ -1781,28 +2376,27 @@ class MainApp(QMainWindow):
         self.set_scroll_bar_colors()
         self.set_icons()
         self.set_action_icons()
-        try:
-            self.line_color = get_theme(theme)['secondaryLightColor']
-        except KeyError:
-            self.line_color = get_theme(theme)['secondaryColor']
+        self.line_color = theme_color(theme, 'secondaryLightColor', 'secondaryColor')
         self.nav_spacer.setStyleSheet(f"border-bottom: 1px solid {self.line_color};")
         self.nav_spacer.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Expanding)
+        self.thumbnail_dock.delegate.set_colors(
+            theme_color(theme, 'primaryColor'), self.line_color, theme_color(theme, 'primaryTextColor')
+        )
+        self.thumbnail_dock.view.viewport().update()
 
     def set_icons(self):
         """
-        Sets the icons for the application and their colors.
+        Sets the icons for the application and their colors. The icons of each theme are only rendered once.
         """
-        try:
-            icon_color = get_theme(self.settings.value("theme", 'dark_blue.xml'))['primaryLightColor']
-        except KeyError:
-            icon_color = get_theme(self.settings.value("theme", 'dark_blue.xml'))['primaryColor']
-
-        try:
-            nav_color = get_theme(self.settings.value("theme", 'dark_blue.xml'))['secondaryColor']
-        except KeyError:
-            nav_color = get_theme(self.settings.value("theme", 'dark_blue.xml'))['secondaryDarkColor']
+        theme = self.settings.value("theme", 'dark_blue.xml')
+        self.viewed_pixmaps = None
+        if theme in self.icon_sets:
+            self.icons = self.icon_sets[theme]
+            return
 
-        self.icons = {
+        icon_color = theme_color(theme, 'primaryLightColor', 'primaryColor')
+        nav_color = theme_color(theme, 'secondaryColor', 'secondaryDarkColor')
+        self.icons = self.icon_sets[theme] = {
             'save': qta.icon("mdi.content-save-all", color=icon_color),
             'save_as': qta.icon("mdi.content-save-edit", color=icon_color),
             'next': qta.icon("mdi.arrow-right-circle", color=nav_color),
@@ -1823,6 +2417,7 @@ class MainApp(QMainWindow):
             'question': qta.icon("mdi.help-circle", color="white", scale=2),
             'export': qta.icon("mdi.file-export", color=icon_color),
             'next_unrated': qta.icon("mdi.skip-next-circle", color=icon_color),
+            'thumbnails': qta.icon("mdi.view-grid", color=icon_color),
         }
 
     def set_action_icons(self):
@@ -1841,26 +2436,28 @@ class MainApp(QMainWindow):
         self.zoom_in_action.setIcon(self.icons['zoom_in'])
         self.zoom_out_action.setIcon(self.icons['zoom_out'])
         self.exportAction.setIcon(self.icons['export'])
+        self.thumbnailsAction.setIcon(self.icons['thumbnails'])
 
     def set_scroll_bar_colors(self):
         """
         Sets the colors of the scroll bars in the image views.
         """
         # Set scrollbar style (too dark with qt material dark theme...)
+        primary_color = theme_color(self.settings.value("theme", 'dark_blue.xml'), 'primaryColor')
         self.image_view.setStyleSheet(f"""
             QScrollBar::handle:vertical {{
-                background: {get_theme(self.settings.value("theme", 'dark_blue.xml'))['primaryColor']};
+                background: {primary_color};
                 }}
             QScrollBar::handle:horizontal {{
-                background: {get_theme(self.settings.value("theme", 'dark_blue.xml'))['primaryColor']};
+                background: {primary_color};
                 }}
         """)
         self.reference_view.setStyleSheet(f"""
                     QScrollBar::handle:vertical {{
-                        background: {get_theme(self.settings.value("theme", 'dark_blue.xml'))['primaryColor']};
+                        background: {primary_color};
                         }}
                     QScrollBar::handle:horizontal {{
-                        background: {get_theme(self.settings.value("theme", 'dark_blue.xml'))['primaryColor']};
+                        background: {primary_color};
                         }}
                 """)
 
@@ -1868,7 +2465,7 @@ class MainApp(QMainWindow):
         """
         Sets the color of the progress bar.
         """
-        progress_color = QColor(get_theme(self.settings.value("theme", 'dark_blue.xml'))['primaryColor'])
+        progress_color = QColor(theme_color(self.settings.value("theme", 'dark_blue.xml'), 'primaryColor'))
         progress_color.setAlpha(100)
         self.progress_bar.setStyleSheet(
             f"""QProgressBar::chunk {{background: {progress_color.name(QColor.NameFormat.HexArgb)};}}""")
@@ -1885,6 +2482,8 @@ class MainApp(QMainWindow):
         """
         if hasattr(self, 'timer'):
             self.timer.stop()
+        self.stop_discovery()
+        self.stop_watching()
         if hasattr(self, 'connection_manager'):
             self.connection_manager.disconnect_all()
         if hasattr(self, 'about_box'):
@@ -0,0 +1,180 @@
+"""
+ordering.py
+
+Presentation order of the images in a new session.
+
+The images are shuffled so that readers do not see them in a predictable order. Images which share a reference image
+can be kept close together, so that the reference image is still decoded (or cached) when it is next needed:
+
+    - 'random': every image in a random order, scattering the images of each reference.
+    - 'blocked': the images of each reference are shown one after another, with the references and the images of each
+      in a random order.
+    - 'constrained': a random order in which each reference image is reused within `max_gap` images of its last use,
+      by interleaving the images of a few references at a time.
+
+The strategy and the seed of the random number generator are saved in the session, so the order can be reproduced.
+
+Functions:
+    - order_random(file_list: List[str], seed: int, group_key: Callable[[str], str], max_gap: int) -> List[str]
+    - order_blocked(file_list: List[str], seed: int, group_key: Callable[[str], str], max_gap: int) -> List[str]
+    - order_constrained(file_list: List[str], seed: int, group_key: Callable[[str], str], max_gap: int) -> List[str]
+    - order_images(file_list: Iterable[str], strategy: str, seed: int, group_key: Optional[Callable[[str], str]],
+        max_gap: int) -> List[str]
+    - max_reuse_gap(file_list: Sequence[str], group_key: Callable[[str], str]) -> int
+"""
+
+import logging
+from random import Random
+from typing import Callable, Dict, Iterable, List, Optional, Sequence
+
+logger = logging.getLogger('fileLogger')
+
+DEFAULT_ORDERING = 'random'
+DEFAULT_SEED = 4
+DEFAULT_MAX_GAP = 8
+
+
+def _group(file_list: List[str], group_key: Callable[[str], str]) -> List[List[str]]:
+    groups: Dict[str, List[str]] = {}
+    for filename in file_list:
+        groups.setdefault(group_key(filename), []).append(filename)
+    return list(groups.values())
+
+
+def order_random(file_list: List[str], seed: int, group_key: Callable[[str], str], max_gap: int) -> List[str]:
+    """
+    Order the images at random.
+
+    :param file_list: The images, sorted
+    :type file_list: List[str]
+    :param seed: The seed of the random number generator
+    :type seed: int
+    :param group_key: Not used
+    :type group_key: Callable[[str], str]
+    :param max_gap: Not used
+    :type max_gap: int
+    :return: The images in presentation order
+    :rtype: List[str]
+    """
+    order = list(file_list)
+    Random(seed).shuffle(order)
+    return order
+
+
+def order_blocked(file_list: List[str], seed: int, group_key: Callable[[str], str], max_gap: int) -> List[str]:
+    """
+    Order the images in blocks of the same reference image, with the blocks and the images within each block in a
+    random order.
+
+    :param file_list: The images, sorted
+    :type file_list: List[str]
+    :param seed: The seed of the random number generator
+    :type seed: int
+    :param group_key: Function giving the reference image of an image
+    :type group_key: Callable[[str], str]
+    :param max_gap: Not used
+    :type max_gap: int
+    :return: The images in presentation order
+    :rtype: List[str]
+    """
+    rng = Random(seed)
+    blocks = _group(file_list, group_key)
+    rng.shuffle(blocks)
+    order = []
+    for block in blocks:
+        rng.shuffle(block)
+        order += block
+    return order
+
+
+def order_constrained(file_list: List[str], seed: int, group_key: Callable[[str], str], max_gap: int) -> List[str]:
+    """
+    Order the images at random, such that consecutive images of the same reference image are at most `max_gap`
+    positions apart. The images of (max_gap + 1) // 2 references, chosen at random, are interleaved in rounds of one
+    image from each reference in a random order; a reference is replaced by the next once its images run out.
+
+    :param file_list: The images, sorted
+    :type file_list: List[str]
+    :param seed: The seed of the random number generator
+    :type seed: int
+    :param group_key: Function giving the reference image of an image
+    :type group_key: Callable[[str], str]
+    :param max_gap: The maximum distance between consecutive uses of a reference image
+    :type max_gap: int
+    :return: The images in presentation order
+    :rtype: List[str]
+    """
+    rng = Random(seed)
+    waiting = _group(file_list, group_key)
+    rng.shuffle(waiting)
+    for block in waiting:
+        rng.shuffle(block)
+    waiting.reverse()
+    # A reference used early in one round and late in the next is reused 2 * active - 1 positions later
+    active_count = max(1, (max_gap + 1) // 2)
+    active = []
+    order = []
+    while waiting or active:
+        while waiting and len(active) < active_count:
+            active.append(waiting.pop())
+        rng.shuffle(active)
+        for block in active:
+            order.append(block.pop())
+        active = [block for block in active if block]
+    return order
+
+
+ORDERING_STRATEGIES: Dict[str, Callable[[List[str], int, Callable[[str], str], int], List[str]]] = {
+    'random': order_random,
+    'blocked': order_blocked,
+    'constrained': order_constrained,
+}
+
+
+def order_images(file_list: Iterable[str], strategy: str = DEFAULT_ORDERING, seed: int = DEFAULT_SEED,
+                 group_key: Optional[Callable[[str], str]] = None, max_gap: int = DEFAULT_MAX_GAP) -> List[str]:
+    """
+    Order the images of a new session. The images are sorted first, so the same images, strategy and seed always give
+    the same order.
+
+    :param file_list: The images
+    :type file_list: Iterable[str]
+    :param strategy: The ordering strategy: 'random', 'blocked' or 'constrained'
+    :type strategy: str
+    :param seed: The seed of the random number generator
+    :type seed: int
+    :param group_key: Function giving the reference image of an image, by default the image itself
+    :type group_key: Optional[Callable[[str], str]]
+    :param max_gap: For 'constrained', the maximum distance between consecutive uses of a reference image
+    :type max_gap: int
+    :return: The images in presentation order
+    :rtype: List[str]
+    """
+    order = ORDERING_STRATEGIES.get(strategy)
+    if order is None:
+        logger.warning(f"Unknown ordering '{strategy}', expected one of {', '.join(ORDERING_STRATEGIES)}. "
+                       f"Using '{DEFAULT_ORDERING}' instead.")
+        order = ORDERING_STRATEGIES[DEFAULT_ORDERING]
+    return order(sorted(file_list), int(seed), group_key or (lambda filename: filename), max(1, int(max_gap)))
+
+
+def max_reuse_gap(file_list: Sequence[str], group_key: Callable[[str], str]) -> int:
+    """
+    Get the largest distance between consecutive uses of the same reference image in an order, e.g. to compare the
+    strategies.
+
+    :param file_list: The images in presentation order
+    :type file_list: Sequence[str]
+    :param group_key: Function giving the reference image of an image
+    :type group_key: Callable[[str], str]
+    :return: The largest distance, or 0 if no reference image is used twice
+    :rtype: int
+    """
+    last_used = {}
+    gap = 0
+    for position, filename in enumerate(file_list):
+        key = group_key(filename)
+        if key in last_used:
+            gap = max(gap, position - last_used[key])
+        last_used[key] = position
+    return gap
@@ -0,0 +1,341 @@
+"""
+preflight.py
+
+Checks every image of a session, and its reference image, before it is read, so that files which cannot be decoded or
+which hold no image (blank or constant pixels) are found up front, rather than when a reader reaches them.
+
+The files are read in a pool of worker processes and their pixels checked with vectorised tests. Each file is given
+one of the following issues, or none:
+
+    - 'unreadable': the file is missing, empty, truncated or corrupt, or no decoder can read it.
+    - 'invalid': some of the pixels are NaN or infinite.
+    - 'blank': every pixel is zero.
+    - 'constant': every pixel has the same, non-zero, value.
+
+In the 'header' mode, only the first bytes of each file are read and checked against the magic bytes of its format,
+which is much faster but does not find truncated files or blank images.
+
+The results are saved in the session (under 'preflight'), and images which cannot be read are marked as failed, so
+readers are not stopped by an error when they reach them. The check can be run from the app or headless, e.g.
+
+    `speedy_preflight progress.json --save`
+
+Functions:
+    - check_pixels(pixels: np.ndarray) -> Optional[str]
+    - check_file(file_path: str, file_extension: str, mode: str) -> Optional[Tuple[str, str]]
+    - check_files(files: Dict[str, str], mode: str, max_workers: Optional[int], progress: Optional[Callable])
+        -> Dict[str, Tuple[str, str]]
+    - preflight_images(file_list: List[str], dir_path: str, reference_dir: str, delimiter: str, mode: str,
+        max_workers: Optional[int], progress: Optional[Callable]) -> Dict[str, Dict[str, str]]
+    - summarise_preflight(results: Dict[str, Dict[str, str]]) -> Dict[str, int]
+    - apply_preflight(data: Dict, results: Dict[str, Dict[str, str]]) -> int
+    - main(): Command line entry point for checking the images of a session or folder.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from speedy_iqa.decoders import get_decoder_registry, read_pixels, image_extensions, image_members
+from speedy_iqa.session import load_session, save_session
+from speedy_iqa.storage import archive_index_paths, set_archive_index_paths, read_header, stat_file
+from speedy_iqa.utils import find_reference_path, find_relative_image_path, image_extension, join_image_key
+from speedy_iqa.utils import split_image_key
+
+PREFLIGHT_MODES = ('decode', 'header')
+UNREADABLE = 'unreadable'
+INVALID = 'invalid'
+BLANK = 'blank'
+CONSTANT = 'constant'
+PREFLIGHT_ISSUES = (UNREADABLE, INVALID, BLANK, CONSTANT)
+
+# Files are handed to the workers in chunks, so that small files do not wait on the inter-process round trip
+_CHUNK_SIZE = 8
+_GZIP_MAGIC = b'\x1f\x8b'
+
+
+def check_pixels(pixels: np.ndarray) -> Optional[str]:
+    """
+    Check the pixels of an image for NaN or infinite values, and for a blank or constant image.
+
+    :param pixels: The stored pixel values of the image
+    :type pixels: np.ndarray
+    :return: The issue found ('invalid', 'blank' or 'constant'), or None
+    :rtype: Optional[str]
+    """
+    if pixels.size == 0:
+        return BLANK
+    if pixels.dtype.kind in 'fc' and not np.isfinite(pixels).all():
+        return INVALID
+    low, high = pixels.min(), pixels.max()
+    if low == high:
+        return BLANK if low == 0 else CONSTANT
+    return None
+
+
+def _check_header(file_path: str, file_extension: str) -> Optional[str]:
+    decoders = get_decoder_registry().candidates(file_path, file_extension)
+    if not decoders:
+        return f"No decoder is available for {file_path}"
+    # Only formats with magic bytes can be checked, e.g. a DICOM file without its preamble is reported
+    decoders = [decoder for decoder in decoders if decoder.magic]
+    if not decoders:
+        return None
+    length = max(offset + len(magic) for decoder in decoders for offset, magic in decoder.magic)
+    header = read_header(split_image_key(file_path)[0], length)
+    # Compressed files (e.g. .nii.gz) are only recognised once decompressed
+    if header.startswith(_GZIP_MAGIC) or any(decoder.matches_magic(header) for decoder in decoders):
+        return None
+    return f"Not a {file_extension or 'known'} image file"
+
+
+def check_file(file_path: str, file_extension: str, mode: str = 'decode') -> Optional[Tuple[str, str]]:
+    """
+    Check that an image file can be read and holds an image. Called in the worker processes.
+
+    :param file_path: The path to the image file, or an image key
+    :type file_path: str
+    :param file_extension: The extension of the image file
+    :type file_extension: str
+    :param mode: 'decode' to read the pixels of the image, or 'header' to check only the start of the file
+    :type mode: str
+    :return: The issue found (see `PREFLIGHT_ISSUES`) and a description of it, or None if there is no issue
+    :rtype: Optional[Tuple[str, str]]
+    """
+    stat = stat_file(split_image_key(file_path)[0])
+    if stat is None:
+        return UNREADABLE, f"No such file: '{file_path}'"
+    if stat[0] == 0:
+        return UNREADABLE, "The file is empty"
+    if mode == 'header':
+        message = _check_header(file_path, file_extension)
+        return (UNREADABLE, message) if message is not None else None
+    try:
+        pixels = read_pixels(file_path, file_extension)
+    except Exception as e:
+        return UNREADABLE, f"{type(e).__name__}: {e}"
+    pixels = np.asarray(pixels)
+    issue = check_pixels(pixels)
+    if issue == INVALID:
+        return issue, "Some pixels are NaN or infinite"
+    if issue is not None:
+        return issue, f"Every pixel is {pixels.flat[0]}" if pixels.size else "The image is empty"
+    return None
+
+
+def _check_file(args: Tuple[str, str, str]) -> Optional[Tuple[str, str]]:
+    return check_file(*args)
+
+
+def check_files(files: Dict[str, str], mode: str = 'decode', max_workers: Optional[int] = None,
+                progress: Optional[Callable[[int, int], bool]] = None) -> Dict[str, Tuple[str, str]]:
+    """
+    Check many image files in a pool of worker processes, see `check_file`.
+
+    :param files: The extension of each image file, keyed by its path (or image key)
+    :type files: Dict[str, str]
+    :param mode: 'decode' or 'header', see `check_file`
+    :type mode: str
+    :param max_workers: The number of worker processes, by default one per CPU
+    :type max_workers: Optional[int]
+    :param progress: Optional function called with the number of files checked and the total as the check goes on,
+        returning False to stop the check
+    :type progress: Optional[Callable[[int, int], bool]]
+    :return: The issue found and its description, keyed by the path of each file with an issue. If the check is
+        stopped, only the files checked so far are included.
+    :rtype: Dict[str, Tuple[str, str]]
+    """
+    if mode not in PREFLIGHT_MODES:
+        raise ValueError(f"Unknown preflight mode '{mode}'. Expected one of {list(PREFLIGHT_MODES)}.")
+    paths = list(files)
+    issues = {}
+    if not paths:
+        return issues
+    max_workers = max(1, min(max_workers or os.cpu_count() or 1, len(paths)))
+    executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'),
+                                   initializer=set_archive_index_paths, initargs=(archive_index_paths(),))
+    stopped = False
+    try:
+        results = executor.map(_check_file, [(path, files[path], mode) for path in paths], chunksize=_CHUNK_SIZE)
+        for checked, (path, issue) in enumerate(zip(paths, results), 1):
+            if issue is not None:
+                issues[path] = issue
+            if progress is not None and progress(checked, len(paths)) is False:
+                stopped = True
+                break
+    finally:
+        if stopped and sys.version_info >= (3, 9):
+            executor.shutdown(wait=True, cancel_futures=True)
+        else:
+            executor.shutdown(wait=True)
+    return issues
+
+
+def preflight_images(file_list: List[str], dir_path: str, reference_dir: str, delimiter: str, mode: str = 'decode',
+                     max_workers: Optional[int] = None,
+                     progress: Optional[Callable[[int, int], bool]] = None) -> Dict[str, Dict[str, str]]:
+    """
+    Check every image of a session and its reference image, see `check_files`. Reference images shared by many images
+    are only checked once.
+
+    :param file_list: The relative paths (or image keys) of the images
+    :type file_list: List[str]
+    :param dir_path: The directory containing the images
+    :type dir_path: str
+    :param reference_dir: The directory containing the reference images
+    :type reference_dir: str
+    :param delimiter: The delimiter separating the reference name from the rest of the image name
+    :type delimiter: str
+    :param mode: 'decode' or 'header', see `check_file`
+    :type mode: str
+    :param max_workers: The number of worker processes, by default one per CPU
+    :type max_workers: Optional[int]
+    :param progress: Optional function called with the number of files checked and the total, see `check_files`
+    :type progress: Optional[Callable[[int, int], bool]]
+    :return: For each image with an issue, keyed by its relative path: the issue, whether it is with the 'image' or
+        its 'reference' image and a description of it. An issue with the image itself is reported before one with its
+        reference image.
+    :rtype: Dict[str, Dict[str, str]]
+    """
+    pairs = {}
+    files = {}
+    for filename in file_list:
+        file_name, member = split_image_key(filename)
+        extension = image_extension(file_name)
+        img_path = join_image_key(os.path.join(dir_path, file_name), member)
+        reference_path = find_reference_path(filename, reference_dir, delimiter)
+        pairs[filename] = (img_path, reference_path)
+        files[img_path] = extension
+        files.setdefault(reference_path, extension)
+
+    issues = check_files(files, mode, max_workers, progress)
+    results = {}
+    for filename, (img_path, reference_path) in pairs.items():
+        for file, path in (('image', img_path), ('reference', reference_path)):
+            if path in issues:
+                issue, message = issues[path]
+                results[filename] = {'issue': issue, 'file': file, 'message': message}
+                break
+    return results
+
+
+def summarise_preflight(results: Dict[str, Dict[str, str]]) -> Dict[str, int]:
+    """
+    Count the images with each issue.
+
+    :param results: The results of `preflight_images`
+    :type results: Dict[str, Dict[str, str]]
+    :return: The number of images with each issue, keyed by the issue
+    :rtype: Dict[str, int]
+    """
+    counts = {issue: 0 for issue in PREFLIGHT_ISSUES}
+    for result in results.values():
+        counts[result['issue']] = counts.get(result['issue'], 0) + 1
+    return counts
+
+
+def apply_preflight(data: Dict, results: Dict[str, Dict[str, str]]) -> int:
+    """
+    Record the results of a check in a session dictionary (see `MainApp.create_output_dictionary`), marking the images
+    which cannot be read (or whose reference images cannot be read) as failed, unless they have already been rated.
+
+    :param data: The session dictionary, which is changed in place
+    :type data: Dict
+    :param results: The results of `preflight_images`
+    :type results: Dict[str, Dict[str, str]]
+    :return: The number of images marked as failed
+    :rtype: int
+    """
+    data['preflight'] = results
+    failed = 0
+    for entry in data.get('files', []):
+        result = results.get(entry['filename'])
+        if result is None or result['issue'] != UNREADABLE or entry.get('rated') is True:
+            continue
+        if entry.get('rated') != "FAILED":
+            failed += 1
+        entry['rated'] = "FAILED"
+        entry['checkboxes'] = {cbox: "FAIL" for cbox in entry.get('checkboxes', {})}
+    return failed
+
+
+def _progress_printer() -> Callable[[int, int], bool]:
+    # Print the progress to stderr at most once a second
+    last_printed = 0.0
+
+    def print_progress(checked: int, total: int) -> bool:
+        nonlocal last_printed
+        now = time.monotonic()
+        if checked == total or now - last_printed >= 1:
+            last_printed = now
+            print(f"\rChecked {checked}/{total} files", end='\n' if checked == total else '', file=sys.stderr,
+                  flush=True)
+        return True
+
+    return print_progress
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Command line entry point to check the images of a session file, or of an image and a reference image folder, e.g.
+        `speedy_preflight progress.json --save`
+        `speedy_preflight --images images/ --references references/ --delimiter __`
+    """
+    parser = argparse.ArgumentParser(description="Check that the images of a Speedy IQA session can be read.")
+    parser.add_argument('session', nargs='?', help="The session file to check (.json or .parquet).")
+    parser.add_argument('--images', help="The image folder to check, if no session file is given.")
+    parser.add_argument('--references', help="The reference image folder, if no session file is given.")
+    parser.add_argument('--delimiter', default='__',
+                        help="The image to reference filename delimiter, if no session file is given "
+                             "(default: %(default)s).")
+    parser.add_argument('--mode', choices=PREFLIGHT_MODES, default='decode',
+                        help="Decode every image, or only check the start of each file (default: %(default)s).")
+    parser.add_argument('--workers', type=int, help="The number of worker processes (default: one per CPU).")
+    parser.add_argument('--save', action='store_true',
+                        help="Save the results in the session file, marking images which cannot be read as failed.")
+    parser.add_argument('--json', action='store_true', help="Print the results as JSON.")
+    args = parser.parse_args(argv)
+
+    data = None
+    if args.session:
+        data = load_session(args.session)
+        dir_path = data['image_directory']
+        reference_dir = data['reference_image_directory']
+        delimiter = data['reference_delimiter']
+        file_list = [entry['filename'] for entry in data.get('files', [])]
+    elif args.images and args.references:
+        dir_path, reference_dir, delimiter = args.images, args.references, args.delimiter
+        file_list = sorted(find_relative_image_path(dir_path, image_extensions(), expand=image_members))
+    else:
+        parser.error("Give a session file, or both --images and --references.")
+
+    results = preflight_images(file_list, os.path.normpath(dir_path), os.path.normpath(reference_dir), delimiter,
+                               args.mode, args.workers, None if args.json else _progress_printer())
+    counts = summarise_preflight(results)
+
+    if args.json:
+        print(json.dumps({'images': len(file_list), 'issues': counts, 'results': results}, indent=2))
+    else:
+        for filename, result in sorted(results.items()):
+            print(f"{result['issue']:<12}{filename}"
+                  + (" (reference image)" if result['file'] == 'reference' else "") + f": {result['message']}")
+        print(f"Checked {len(file_list)} images: {len(file_list) - len(results)} ok, "
+              + ", ".join(f"{count} {issue}" for issue, count in counts.items()))
+
+    if args.save and data is not None:
+        failed = apply_preflight(data, results)
+        save_session(data, args.session)
+        if not args.json:
+            print(f"Saved the results to {args.session}, marking {failed} images as failed.")
+    return 1 if results else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
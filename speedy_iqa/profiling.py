@@ -0,0 +1,370 @@
+"""
+profiling.py
+
+Opt-in timing of the stages of loading and displaying an image, to find out where the time goes when changing image
+is slow, and of the latency the reader actually experiences, from pressing a key to the result being painted.
+
+Each stage's recent durations are kept in a fixed-size ring buffer, from which the median (p50) and 95th percentile
+(p95) are reported, either in an overlay on the main window or in the log. When timing is disabled, timing a stage
+costs no more than entering an empty context manager.
+
+Classes:
+    - StageTimer: Records the durations of named stages in ring buffers.
+    - LatencyMonitor: Measures the latency from a key press to the next paint of the widgets it updates.
+    - PerformanceOverlay: Label overlaid on the main window showing the p50/p95 duration of each stage.
+"""
+
+import time
+import logging
+from collections import OrderedDict, deque
+from contextlib import nullcontext
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+from PyQt6.QtCore import *
+from PyQt6.QtGui import *
+from PyQt6.QtWidgets import *
+
+_DISABLED_CONTEXT = nullcontext()
+
+
+class _StageContext:
+    """
+    Context manager which records the duration of a stage on exit.
+    """
+    __slots__ = ('timer', 'name', 'start')
+
+    def __init__(self, timer: "StageTimer", name: str):
+        self.timer = timer
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.timer.record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class StageTimer:
+    """
+    Records the durations of named stages in ring buffers, e.g.
+
+        with timer.stage("load_file"):
+            self.load_file()
+
+    :param enabled: Whether to record durations
+    :type enabled: bool
+    :param maxlen: The number of recent durations kept for each stage
+    :type maxlen: int
+    """
+
+    def __init__(self, enabled: bool = False, maxlen: int = 500):
+        self.enabled = enabled
+        self.maxlen = maxlen
+        self._durations = OrderedDict()
+
+    def stage(self, name: str):
+        """
+        Get a context manager which records the duration of a stage, or does nothing if timing is disabled.
+
+        :param name: The name of the stage
+        :type name: str
+        """
+        if not self.enabled:
+            return _DISABLED_CONTEXT
+        return _StageContext(self, name)
+
+    def record(self, name: str, duration: float):
+        """
+        Record the duration of a stage.
+
+        :param name: The name of the stage
+        :type name: str
+        :param duration: The duration in seconds
+        :type duration: float
+        """
+        durations = self._durations.get(name)
+        if durations is None:
+            durations = self._durations[name] = deque(maxlen=self.maxlen)
+        durations.append(duration)
+
+    def clear(self):
+        """
+        Remove all recorded durations.
+        """
+        self._durations.clear()
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """
+        Get the number of recorded durations and the p50 and p95 duration (in milliseconds) of each stage, in the order
+        the stages were first recorded.
+
+        :return: The summary of each stage
+        :rtype: Dict[str, Dict[str, float]]
+        """
+        summary = OrderedDict()
+        for name, durations in self._durations.items():
+            if not durations:
+                continue
+            p50, p95 = np.percentile(np.fromiter(durations, dtype=float, count=len(durations)) * 1000, [50, 95])
+            summary[name] = {'n': len(durations), 'p50_ms': float(p50), 'p95_ms': float(p95)}
+        return summary
+
+    def format_summary(self) -> str:
+        """
+        Format the summary of each stage as a table.
+
+        :return: The table
+        :rtype: str
+        """
+        summary = self.summary()
+        if not summary:
+            return "No timings recorded yet."
+        width = max(len(name) for name in summary)
+        lines = [f"{'stage':<{width}}  {'p50 ms':>8}  {'p95 ms':>8}  {'n':>5}"]
+        for name, stats in summary.items():
+            lines.append(f"{name:<{width}}  {stats['p50_ms']:>8.1f}  {stats['p95_ms']:>8.1f}  {stats['n']:>5}")
+        return "\n".join(lines)
+
+    def dump(self, logger: logging.Logger):
+        """
+        Write the summary of each stage to the log.
+
+        :param logger: The logger to write to
+        :type logger: logging.Logger
+        """
+        logger.info("Stage timings:\n" + self.format_summary())
+
+
+class LatencyMonitor(QObject):
+    """
+    Measures the latency from a key press to the next paint of the widgets it updates: for navigation keys (e.g. → or
+    Enter), until every navigation widget (the image views) has started painting; for rating keys (1-4), until any
+    rating widget (the radio buttons) has started painting. The latencies are kept in a histogram and a ring buffer of
+    recent latencies, from which p50/p95 are reported. If a threshold is set, a warning is written to the log when the
+    p95 latency exceeds it.
+
+    While enabled, the monitor is installed as an application event filter, so it sees key presses handled by
+    shortcuts as well as by `keyPressEvent`.
+
+    :param threshold_ms: The p95 latency in milliseconds above which to warn in the log, 0 to not warn
+    :type threshold_ms: float
+    :param logger: The logger to warn in
+    :type logger: Optional[logging.Logger]
+    :param maxlen: The number of recent latencies kept for the percentiles
+    :type maxlen: int
+    """
+    measured = pyqtSignal()
+
+    NAVIGATION_KEYS = {
+        Qt.Key.Key_Right, Qt.Key.Key_Left, Qt.Key.Key_Space, Qt.Key.Key_N, Qt.Key.Key_B, Qt.Key.Key_Back,
+        Qt.Key.Key_Backspace, Qt.Key.Key_Enter, Qt.Key.Key_Return,
+    }
+    RATING_KEYS = {Qt.Key.Key_1, Qt.Key.Key_2, Qt.Key.Key_3, Qt.Key.Key_4}
+    # Upper edges of the histogram bins in milliseconds, the last bin holds everything slower
+    HISTOGRAM_EDGES_MS = (16, 33, 50, 75, 100, 150, 200, 300, 500, 1000, 2000)
+    # Key presses not followed by a paint within this time (in seconds) are discarded
+    TIMEOUT = 5.0
+    # The minimum number of latencies before warning, and the minimum time between warnings in seconds
+    MIN_SAMPLES = 20
+    WARNING_INTERVAL = 60.0
+
+    def __init__(self, threshold_ms: float = 0, logger: Optional[logging.Logger] = None, maxlen: int = 500,
+                 parent: Optional[QObject] = None):
+        super().__init__(parent)
+        self.threshold_ms = threshold_ms
+        self.logger = logger
+        self.enabled = False
+        self._app = None
+        self._targets = {'navigation': [], 'rating': []}
+        self._latencies = {kind: deque(maxlen=maxlen) for kind in self._targets}
+        self._histograms = {kind: np.zeros(len(self.HISTOGRAM_EDGES_MS) + 1, dtype=int) for kind in self._targets}
+        self._pending = None
+        self._pending_timestamp = None
+        self._painted = set()
+        self._last_warning = {kind: -float('inf') for kind in self._targets}
+
+    def watch(self, kind: str, widgets: Iterable[QWidget]):
+        """
+        Set the widgets whose painting completes a key press of a kind.
+
+        :param kind: 'navigation' or 'rating'
+        :type kind: str
+        :param widgets: The widgets updated by the key press
+        :type widgets: Iterable[QWidget]
+        """
+        self._targets[kind] = list(widgets)
+
+    def set_enabled(self, enabled: bool):
+        """
+        Start or stop measuring latencies.
+
+        :param enabled: Whether to measure latencies
+        :type enabled: bool
+        """
+        app = QApplication.instance()
+        if enabled and not self.enabled and app is not None:
+            app.installEventFilter(self)
+            self._app = app
+        elif not enabled and self.enabled and self._app is not None:
+            self._app.removeEventFilter(self)
+            self._app = None
+        self.enabled = enabled and self._app is not None
+        self._pending = None
+
+    def eventFilter(self, obj: QObject, event: QEvent) -> bool:
+        event_type = event.type()
+        if event_type == QEvent.Type.Paint:
+            if self._pending is not None:
+                self._on_paint(obj)
+        elif event_type in (QEvent.Type.KeyPress, QEvent.Type.ShortcutOverride):
+            self._on_key(event)
+        return False
+
+    def _on_key(self, event: QKeyEvent):
+        if event.isAutoRepeat():
+            return
+        # The same key press is delivered several times (shortcut override, then to each widget it propagates to)
+        if self._pending is not None and event.timestamp() == self._pending_timestamp:
+            return
+        key = event.key()
+        if key in self.NAVIGATION_KEYS:
+            kind = 'navigation'
+        elif key in self.RATING_KEYS:
+            kind = 'rating'
+        else:
+            return
+        self._pending = (kind, time.perf_counter())
+        self._pending_timestamp = event.timestamp()
+        self._painted = set()
+
+    def _on_paint(self, obj: QObject):
+        kind, start = self._pending
+        targets = self._targets[kind]
+        if not any(obj is target for target in targets):
+            return
+        now = time.perf_counter()
+        if now - start > self.TIMEOUT:
+            self._pending = None
+            return
+        self._painted.add(id(obj))
+        if kind == 'rating' or len(self._painted) >= len(targets):
+            self._pending = None
+            self.record(kind, now - start)
+
+    def record(self, kind: str, latency: float):
+        """
+        Record a key-to-paint latency.
+
+        :param kind: 'navigation' or 'rating'
+        :type kind: str
+        :param latency: The latency in seconds
+        :type latency: float
+        """
+        latency_ms = latency * 1000
+        self._latencies[kind].append(latency_ms)
+        self._histograms[kind][np.searchsorted(self.HISTOGRAM_EDGES_MS, latency_ms)] += 1
+        self.measured.emit()
+        self._check_threshold(kind)
+
+    def _check_threshold(self, kind: str):
+        latencies = self._latencies[kind]
+        if self.threshold_ms <= 0 or self.logger is None or len(latencies) < self.MIN_SAMPLES:
+            return
+        now = time.monotonic()
+        if now - self._last_warning[kind] < self.WARNING_INTERVAL:
+            return
+        p95 = float(np.percentile(np.fromiter(latencies, dtype=float, count=len(latencies)), 95))
+        if p95 > self.threshold_ms:
+            self._last_warning[kind] = now
+            self.logger.warning(f"p95 {kind} key-to-paint latency is {p95:.0f} ms, above the threshold of "
+                                f"{self.threshold_ms:.0f} ms.")
+
+    def summary(self) -> Dict[str, Dict]:
+        """
+        Get the number of recorded latencies, the p50, p95 and maximum recent latency (in milliseconds) and the
+        histogram of all latencies of each kind of key press.
+
+        :return: The summary of each kind of key press
+        :rtype: Dict[str, Dict]
+        """
+        summary = OrderedDict()
+        for kind, latencies in self._latencies.items():
+            if not latencies:
+                continue
+            values = np.fromiter(latencies, dtype=float, count=len(latencies))
+            p50, p95 = np.percentile(values, [50, 95])
+            summary[kind] = {
+                'n': int(self._histograms[kind].sum()),
+                'p50_ms': float(p50),
+                'p95_ms': float(p95),
+                'max_ms': float(values.max()),
+                'histogram': self._histograms[kind].tolist(),
+            }
+        return summary
+
+    def format_summary(self) -> str:
+        """
+        Format the summary of each kind of key press as a table, with its histogram.
+
+        :return: The table
+        :rtype: str
+        """
+        summary = self.summary()
+        if not summary:
+            return "No key-to-paint latencies recorded yet."
+        labels = [f"<{edge}" for edge in self.HISTOGRAM_EDGES_MS] + [f">={self.HISTOGRAM_EDGES_MS[-1]}"]
+        lines = [f"{'key-to-paint':<12}  {'p50 ms':>8}  {'p95 ms':>8}  {'max ms':>8}  {'n':>5}"]
+        for kind, stats in summary.items():
+            lines.append(f"{kind:<12}  {stats['p50_ms']:>8.1f}  {stats['p95_ms']:>8.1f}  {stats['max_ms']:>8.1f}  "
+                         f"{stats['n']:>5}")
+        for kind, stats in summary.items():
+            bins = ", ".join(f"{label}: {count}" for label, count in zip(labels, stats['histogram']) if count)
+            lines.append(f"{kind} histogram (ms): {bins}")
+        return "\n".join(lines)
+
+
+class PerformanceOverlay(QLabel):
+    """
+    Label overlaid on the top left of a widget (or of its central widget, for a main window, as the central widget may
+    be replaced), showing the p50/p95 duration of each stage recorded by a StageTimer.
+
+    :param timer: The timer to show the durations of
+    :type timer: StageTimer
+    :param latency_monitor: The monitor to show the key-to-paint latencies of, if any
+    :type latency_monitor: Optional[LatencyMonitor]
+    :param parent: The widget to overlay
+    :type parent: Optional[QWidget]
+    """
+
+    def __init__(self, timer: StageTimer, latency_monitor: Optional[LatencyMonitor] = None,
+                 parent: Optional[QWidget] = None):
+        super().__init__(parent)
+        self.timer = timer
+        self.latency_monitor = latency_monitor
+        self.setAttribute(Qt.WidgetAttribute.WA_TransparentForMouseEvents)
+        self.setFont(QFontDatabase.systemFont(QFontDatabase.SystemFont.FixedFont))
+        self.setStyleSheet("background-color: rgba(0, 0, 0, 160); color: white; padding: 6px; border-radius: 4px;")
+        self.setAlignment(Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignTop)
+        self.hide()
+
+    def refresh(self):
+        """
+        Update the overlay with the latest durations, if it is visible.
+        """
+        if not self.isVisible():
+            return
+        parent = self.parentWidget()
+        anchor = QPoint(0, 0)
+        if isinstance(parent, QMainWindow) and parent.centralWidget() is not None:
+            anchor = parent.centralWidget().geometry().topLeft()
+        text = self.timer.format_summary()
+        if self.latency_monitor is not None:
+            text += "\n\n" + self.latency_monitor.format_summary()
+        self.setText(text)
+        self.adjustSize()
+        self.move(anchor + QPoint(10, 10))
+        self.raise_()
@@ -0,0 +1,432 @@
+"""
+session.py
+
+Reading and writing of Speedy IQA session (progress) files.
+
+Sessions can be stored either as the original, pretty-printed JSON file or as a columnar Parquet file. The Parquet
+format holds exactly the same top-level metadata and per-file fields (`filename`, `rated`, `rotation`, `notes`,
+`checkboxes` and `radiobuttons`) but is a fraction of the size and is much faster to load for large sessions. The two
+formats can be converted between each other without loss.
+
+Classes:
+    - SessionSummary: The parts of a session needed to validate it against the image folder and config file.
+
+Functions:
+    - session_format_from_path(path: str) -> str
+    - save_session(data: dict, path: str, session_format: Optional[str] = None) -> str
+    - load_session(path: str) -> dict
+    - load_session_columns(path: str) -> Tuple[dict, dict]
+    - load_session_summary(path: str) -> SessionSummary
+    - convert_session(src_path: str, dst_path: str) -> str
+    - main(): Command line entry point for converting session files.
+"""
+
+import os
+import sys
+import json
+import argparse
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+# The fields stored for each file in a session
+SESSION_COLUMNS = ('filename', 'rated', 'rotation', 'notes', 'checkboxes', 'radiobuttons')
+
+SESSION_FORMATS = {
+    'json': '.json',
+    'parquet': '.parquet',
+}
+
+# Keys used to store the non-tabular parts of the session in the Parquet schema metadata
+_METADATA_KEY = b'speedy_iqa'
+_FORMAT_VERSION = 1
+
+# `rated` may be True, False or "FAILED", so it is stored as a small integer code
+_RATED_CODES = {False: 0, True: 1, "FAILED": -1}
+_RATED_VALUES = {code: value for value, code in _RATED_CODES.items()}
+
+# Checkbox values are 0/1/2 (tri-state) or "FAIL" for images which failed to load, or False (or True) for keys a file
+# did not have, which are stored with their own codes so that they are read back unchanged
+_CHECKBOX_FAIL_CODE = -1
+_CHECKBOX_BOOL_CODES = {False: -2, True: -3}
+_CHECKBOX_BOOL_VALUES = {code: value for value, code in _CHECKBOX_BOOL_CODES.items()}
+
+# Suffix of the bitmask column recording which keys each file has, only written if not all files have all keys
+_KEYS_SUFFIX = '.__keys__'
+
+
+def session_format_from_path(path: str) -> str:
+    """
+    Determine the session format from the file extension, defaulting to json.
+
+    :param path: Path to the session file.
+    :type path: str
+    :return: The session format, either 'json' or 'parquet'.
+    :rtype: str
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension in ('.parquet', '.pq'):
+        return 'parquet'
+    return 'json'
+
+
+def _check_pyarrow():
+    """
+    Raise an informative error if pyarrow is not available.
+    """
+    if pa is None:
+        raise ImportError("The 'pyarrow' package is required to read and write Parquet session files. "
+                          "Install it with `pip install pyarrow`.")
+
+
+def _encode_checkbox_value(value) -> int:
+    if isinstance(value, str) and value == "FAIL":
+        return _CHECKBOX_FAIL_CODE
+    if isinstance(value, bool):
+        return _CHECKBOX_BOOL_CODES[value]
+    return int(value)
+
+
+def _decode_checkbox_value(value: int):
+    if value == _CHECKBOX_FAIL_CODE:
+        return "FAIL"
+    return _CHECKBOX_BOOL_VALUES.get(value, value)
+
+
+def _int_column_to_list(column: "pa.ChunkedArray") -> List[Optional[int]]:
+    """
+    Convert a nullable integer column to a list of python ints and Nones. Going through numpy is considerably faster
+    than `to_pylist` for large sessions.
+
+    :param column: The arrow column.
+    :type column: pa.ChunkedArray
+    :return: The column values.
+    :rtype: List[Optional[int]]
+    """
+    if column.null_count == 0:
+        return column.to_numpy().tolist()
+    values = column.fill_null(0).to_numpy().tolist()
+    is_null = column.is_null().to_numpy(zero_copy_only=False).tolist()
+    return [None if null else value for value, null in zip(values, is_null)]
+
+
+def _flatten_dict_column(entries: List[Dict], prefix: str, encode=None) -> Tuple[List[str], Dict[str, "pa.Array"]]:
+    """
+    Flatten a column of dictionaries (e.g. the radiobutton values of each file) into one nullable integer column per
+    key. If any file is missing one of the keys, an extra bitmask column records which keys each file had, so that
+    the original dictionaries can be restored exactly.
+
+    :param entries: The dictionaries for each file.
+    :type entries: List[Dict]
+    :param prefix: The prefix for the column names, e.g. 'radiobuttons'.
+    :type prefix: str
+    :param encode: Optional function to encode each non-null value as an integer.
+    :type encode: callable
+    :return: The keys in order of first appearance and a dictionary of column name to arrow array.
+    :rtype: Tuple[List[str], Dict[str, pa.Array]]
+    """
+    keys = []
+    seen = set()
+    for entry in entries:
+        for key in entry:
+            if key not in seen:
+                seen.add(key)
+                keys.append(key)
+
+    columns = {}
+    for key in keys:
+        values = [entry.get(key) for entry in entries]
+        if encode is not None:
+            values = [None if value is None else encode(value) for value in values]
+        columns[f"{prefix}.{key}"] = pa.array(values, type=pa.int64())
+
+    if any(len(entry) != len(keys) for entry in entries):
+        columns[f"{prefix}{_KEYS_SUFFIX}"] = pa.array(
+            [sum(1 << i for i, key in enumerate(keys) if key in entry) for entry in entries], type=pa.int64()
+        )
+    return keys, columns
+
+
+def _unflatten_dict_column(table: "pa.Table", prefix: str, keys: List[str], decode=None) -> List[Dict]:
+    """
+    Restore a column of dictionaries flattened with `_flatten_dict_column`.
+
+    :param table: The arrow table read from the Parquet file.
+    :type table: pa.Table
+    :param prefix: The prefix of the column names, e.g. 'radiobuttons'.
+    :type prefix: str
+    :param keys: The keys of the dictionaries in their original order.
+    :type keys: List[str]
+    :param decode: Optional function to decode each non-null integer value.
+    :type decode: callable
+    :return: The dictionaries for each file.
+    :rtype: List[Dict]
+    """
+    n_rows = table.num_rows
+    if not keys:
+        return [{} for _ in range(n_rows)]
+
+    value_columns = []
+    for key in keys:
+        values = _int_column_to_list(table.column(f"{prefix}.{key}"))
+        if decode is not None:
+            values = [None if value is None else decode(value) for value in values]
+        value_columns.append(values)
+
+    rows = [dict(zip(keys, row)) for row in zip(*value_columns)]
+    if f"{prefix}{_KEYS_SUFFIX}" in table.column_names:
+        # Only the files which did not have every key need to be rebuilt
+        full_mask = (1 << len(keys)) - 1
+        masks = table.column(f"{prefix}{_KEYS_SUFFIX}").to_pylist()
+        for row_no, mask in enumerate(masks):
+            if mask != full_mask:
+                rows[row_no] = {key: value for i, (key, value) in enumerate(rows[row_no].items()) if mask >> i & 1}
+    return rows
+
+
+def _save_parquet(data: Dict, path: str):
+    """
+    Save the session dictionary to a Parquet file.
+
+    :param data: The session dictionary, as created by `MainApp.create_output_dictionary`.
+    :type data: Dict
+    :param path: Path to save the Parquet file to.
+    :type path: str
+    """
+    _check_pyarrow()
+    files = data.get('files', [])
+    columns = {
+        'filename': pa.array([entry['filename'] for entry in files], type=pa.string()),
+        'rated': pa.array([_RATED_CODES[entry.get('rated', False)] for entry in files], type=pa.int8()),
+        'rotation': pa.array([entry.get('rotation', 0) for entry in files], type=pa.int16()),
+        'notes': pa.array([entry.get('notes', "") for entry in files], type=pa.string()),
+    }
+    checkbox_keys, checkbox_columns = _flatten_dict_column(
+        [entry.get('checkboxes', {}) for entry in files], 'checkboxes', _encode_checkbox_value
+    )
+    radiobutton_keys, radiobutton_columns = _flatten_dict_column(
+        [entry.get('radiobuttons', {}) for entry in files], 'radiobuttons'
+    )
+    columns.update(checkbox_columns)
+    columns.update(radiobutton_columns)
+
+    metadata = {key: value for key, value in data.items() if key != 'files'}
+    table_metadata = {
+        'format_version': _FORMAT_VERSION,
+        'metadata': metadata,
+        'checkboxes': checkbox_keys,
+        'radiobuttons': radiobutton_keys,
+    }
+    table = pa.table(columns).replace_schema_metadata({_METADATA_KEY: json.dumps(table_metadata).encode('utf-8')})
+    pq.write_table(table, path, compression='zstd')
+
+
+def _load_parquet_columns(path: str) -> Tuple[Dict, Dict[str, List]]:
+    """
+    Load the metadata and per-file columns of a session from a Parquet file.
+
+    :param path: Path to the Parquet file.
+    :type path: str
+    :return: The top-level metadata and a dictionary of column name to the list of values for each file.
+    :rtype: Tuple[Dict, Dict[str, List]]
+    """
+    _check_pyarrow()
+    table = pq.read_table(path)
+    schema_metadata = table.schema.metadata or {}
+    table_metadata = json.loads(schema_metadata[_METADATA_KEY].decode('utf-8'))
+    metadata = dict(table_metadata['metadata'])
+
+    columns = {
+        'filename': table.column('filename').to_pylist(),
+        'rated': [_RATED_VALUES[rated] for rated in _int_column_to_list(table.column('rated'))],
+        'rotation': _int_column_to_list(table.column('rotation')),
+        'notes': table.column('notes').to_pylist(),
+        'checkboxes': _unflatten_dict_column(
+            table, 'checkboxes', table_metadata['checkboxes'], _decode_checkbox_value
+        ),
+        'radiobuttons': _unflatten_dict_column(table, 'radiobuttons', table_metadata['radiobuttons']),
+    }
+    return metadata, columns
+
+
+def save_session(data: Dict, path: str, session_format: Optional[str] = None) -> str:
+    """
+    Save the session dictionary to file.
+
+    :param data: The session dictionary, as created by `MainApp.create_output_dictionary`.
+    :type data: Dict
+    :param path: Path to the file to save to.
+    :type path: str
+    :param session_format: Either 'json' or 'parquet'. If None, the format is taken from the file extension.
+    :type session_format: Optional[str]
+    :return: The format the session was saved in.
+    :rtype: str
+    """
+    if session_format is None:
+        session_format = session_format_from_path(path)
+    if session_format not in SESSION_FORMATS:
+        raise ValueError(f"Unknown session format '{session_format}'. Expected one of {list(SESSION_FORMATS)}.")
+
+    if session_format == 'parquet':
+        _save_parquet(data, path)
+    else:
+        with open(path, 'w') as file:
+            json.dump(data, file, indent=2)
+    return session_format
+
+
+def load_session(path: str) -> Dict:
+    """
+    Load a session dictionary from a JSON or Parquet session file.
+
+    :param path: Path to the session file.
+    :type path: str
+    :return: The session dictionary.
+    :rtype: Dict
+    """
+    if session_format_from_path(path) == 'parquet':
+        metadata, columns = _load_parquet_columns(path)
+        data = dict(metadata)
+        data['files'] = [dict(zip(SESSION_COLUMNS, row)) for row in zip(*(columns[c] for c in SESSION_COLUMNS))]
+        return data
+    with open(path, 'r') as file:
+        return json.load(file)
+
+
+def load_session_columns(path: str) -> Tuple[Dict, Dict[str, List]]:
+    """
+    Load a session file as its top-level metadata and one list of values per field. This avoids building a dictionary
+    for every file, which dominates the time taken to open large Parquet sessions.
+
+    :param path: Path to the session file.
+    :type path: str
+    :return: The top-level metadata and a dictionary of field name (see `SESSION_COLUMNS`) to the list of values for
+        each file. Files without checkboxes or radiobuttons have empty dictionaries.
+    :rtype: Tuple[Dict, Dict[str, List]]
+    """
+    if session_format_from_path(path) == 'parquet':
+        return _load_parquet_columns(path)
+
+    with open(path, 'r') as file:
+        data = json.load(file)
+    files = data.pop('files', [])
+    columns = {
+        'filename': [entry['filename'] for entry in files],
+        'rated': [entry.get('rated', False) for entry in files],
+        'rotation': [entry.get('rotation', 0) for entry in files],
+        'notes': [entry.get('notes', "") for entry in files],
+        'checkboxes': [entry.get('checkboxes', {}) for entry in files],
+        'radiobuttons': [entry.get('radiobuttons', {}) for entry in files],
+    }
+    return data, columns
+
+
+class SessionSummary:
+    """
+    The parts of a session file needed to check it is compatible with the image folder and the config file. The
+    filenames are held as a set so that compatibility checks are linear in the number of files.
+
+    :param path: Path to the session file.
+    :type path: str
+    :param metadata: The top-level metadata of the session, e.g. the image directory.
+    :type metadata: Dict
+    :param filenames: The filenames in the session.
+    :type filenames: List[str]
+    :param checkboxes: The checkbox values of each file.
+    :type checkboxes: List[Dict]
+    :param radiobuttons: The radiobutton values of each file.
+    :type radiobuttons: List[Dict]
+    """
+
+    def __init__(self, path: str, metadata: Dict, filenames: List[str], checkboxes: List[Dict],
+                 radiobuttons: List[Dict]):
+        self.path = path
+        self.metadata = metadata
+        self.filenames = set(filenames)
+        self.n_files = len(filenames)
+
+        cboxes = set()
+        cbox_values = set()
+        for entry in checkboxes:
+            cboxes.update(entry.keys())
+            cbox_values.update(entry.values())
+        radiobs = set()
+        for entry in radiobuttons:
+            radiobs.update(entry.keys())
+
+        self.unique_cboxes = sorted(cboxes)
+        self.unique_cbox_values = sorted(cbox_values, key=str)
+        self.unique_radiobs = sorted(radiobs)
+
+    @property
+    def image_directory(self) -> Optional[str]:
+        return self.metadata.get('image_directory')
+
+    @property
+    def reference_image_directory(self) -> Optional[str]:
+        return self.metadata.get('reference_image_directory')
+
+
+# Session summaries keyed by path, stored with the modification time and size of the file when it was parsed
+_summary_cache: Dict[str, Tuple[Tuple[int, int], SessionSummary]] = {}
+
+
+def load_session_summary(path: str) -> SessionSummary:
+    """
+    Load a summary of a session file. The file is only parsed again if it has been modified since it was last
+    summarised, so repeated compatibility checks of the same session are free.
+
+    :param path: Path to the session file.
+    :type path: str
+    :return: The session summary.
+    :rtype: SessionSummary
+    """
+    path = os.path.normpath(os.path.abspath(path))
+    stat = os.stat(path)
+    file_key = (stat.st_mtime_ns, stat.st_size)
+
+    cached = _summary_cache.get(path)
+    if cached is not None and cached[0] == file_key:
+        return cached[1]
+
+    metadata, columns = load_session_columns(path)
+    summary = SessionSummary(path, metadata, columns['filename'], columns['checkboxes'], columns['radiobuttons'])
+    _summary_cache[path] = (file_key, summary)
+    return summary
+
+
+def convert_session(src_path: str, dst_path: str) -> str:
+    """
+    Convert a session file between the JSON and Parquet formats. The formats are determined from the file extensions.
+
+    :param src_path: Path to the session file to convert.
+    :type src_path: str
+    :param dst_path: Path to save the converted session file to.
+    :type dst_path: str
+    :return: The format of the converted file.
+    :rtype: str
+    """
+    return save_session(load_session(src_path), dst_path)
+
+
+def main(argv: Optional[List[str]] = None):
+    """
+    Command line entry point to convert a session file between JSON and Parquet, e.g.
+        `speedy_session progress.json progress.parquet`
+    """
+    parser = argparse.ArgumentParser(description="Convert Speedy IQA session files between JSON and Parquet.")
+    parser.add_argument('src', help="The session file to convert (.json or .parquet).")
+    parser.add_argument('dst', help="The path to save the converted session file to (.json or .parquet).")
+    args = parser.parse_args(argv)
+
+    session_format = convert_session(args.src, args.dst)
+    print(f"Saved {args.src} as {session_format} to {args.dst}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,334 @@
+"""
+staging.py
+
+Read-ahead staging of image files from slow storage (e.g. SMB or NFS network shares, where the latency of each read
+dominates the decode time) to a local directory.
+
+While an image is shown, the raw bytes of the files coming up next in the session are copied in the background to a
+local staging directory, so that decoding them reads from local disk. The files are copied in one thread, in the order
+they are stored (grouped by directory, and by offset within an archive) to keep seeking on the share to a minimum,
+except that the next file is always copied first. Staged files are found by `speedy_iqa.storage.open_source`, so every
+decoder (and the decode worker processes) reads them. This is separate from the cache of decoded images (see
+`speedy_iqa.cache`), which is only filled once an image has been decoded.
+
+Each staged copy is named from the path, size and modification time of the source file, so a file which changes is
+staged again. The source file is only checked for changes when it is staged, and the staged copies are then found from
+an in-memory map of the files staged in the session, so reading a staged file never waits on the share. Decode worker
+processes read the same map from a manifest in the staging directory. The total size of the staging directory is
+capped, and the files staged longest ago are removed first. Only the files named as staged copies are ever removed, so
+other files in the staging directory are left alone.
+
+Classes:
+    - StagingCache: Copies upcoming image files to a size-capped local staging directory in the background.
+
+Functions:
+    - staged_file_name(path: str, stat: Tuple[int, int]) -> str
+    - use_staging_dir(staging_dir: Optional[str])
+"""
+
+import os
+import re
+import json
+import shutil
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+from speedy_iqa.storage import open_source, read_position, set_staged_file_lookup, stat_file
+
+logger = logging.getLogger('fileLogger')
+
+DEFAULT_STAGING_AHEAD = 10
+_COPY_BUFFER_SIZE = 1024 * 1024
+_TMP_SUFFIX = '.tmp'
+_MANIFEST_NAME = 'staged.json'
+# The names given by `staged_file_name`
+_STAGED_NAME = re.compile(r'^[0-9a-f]{20}-.+$')
+
+
+def staged_file_name(path: str, stat: Tuple[int, int]) -> str:
+    """
+    Get the name of the staged copy of a file, from its absolute path, size and modification time. The file name is
+    kept at the end, so that the copy has the same extension.
+
+    :param path: The path to the file
+    :type path: str
+    :param stat: The size and modification time of the file, as given by `speedy_iqa.storage.stat_file`
+    :type stat: Tuple[int, int]
+    :return: The name of the staged copy
+    :rtype: str
+    """
+    path = os.path.normpath(os.path.abspath(path))
+    identity = f"{path}|{stat[0]}|{stat[1]}"
+    return f"{hashlib.sha1(identity.encode('utf-8')).hexdigest()[:20]}-{os.path.basename(path)}"
+
+
+def _source_key(path: str) -> str:
+    return os.path.normpath(os.path.abspath(path))
+
+
+class _ManifestLookup:
+    # Finds the staged copies of files from the manifest written by a StagingCache, e.g. in a decode worker process.
+    # The manifest is read again whenever it changes, which only needs a stat of the local staging directory.
+
+    def __init__(self, staging_dir: str):
+        self.staging_dir = staging_dir
+        self._manifest_path = os.path.join(staging_dir, _MANIFEST_NAME)
+        self._mtime = None
+        self._staged: Dict[str, str] = {}
+
+    def __call__(self, path: str) -> Optional[str]:
+        try:
+            mtime = os.stat(self._manifest_path).st_mtime_ns
+        except OSError:
+            return None
+        if mtime != self._mtime:
+            try:
+                with open(self._manifest_path, 'r') as f:
+                    self._staged = json.load(f)
+                self._mtime = mtime
+            except (OSError, ValueError):
+                return None
+        name = self._staged.get(_source_key(path))
+        if name is None:
+            return None
+        staged_path = os.path.join(self.staging_dir, name)
+        # Copies are moved into place once complete, so a staged file which exists is whole
+        return staged_path if os.path.isfile(staged_path) else None
+
+
+def use_staging_dir(staging_dir: Optional[str]):
+    """
+    Read the files staged in a directory in place of the originals, e.g. in a decode worker process. The staging
+    directory is not changed.
+
+    :param staging_dir: The staging directory, or None to stop reading staged files
+    :type staging_dir: Optional[str]
+    """
+    if staging_dir is None:
+        set_staged_file_lookup(None)
+    else:
+        set_staged_file_lookup(_ManifestLookup(staging_dir))
+
+
+class StagingCache:
+    """
+    Copies the raw bytes of upcoming image files to a size-capped local staging directory, in a background thread.
+    Once started, the staged copies are read in place of the originals.
+
+    :param staging_dir: The local directory in which to stage files
+    :type staging_dir: str
+    :param max_size_mb: The maximum size of the staged files in megabytes
+    :type max_size_mb: float
+    """
+
+    def __init__(self, staging_dir: str, max_size_mb: float = 4096):
+        self.staging_dir = os.path.normpath(os.path.abspath(os.path.expanduser(staging_dir)))
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self._condition = threading.Condition()
+        self._entries = OrderedDict()
+        # The staged copy of each file staged in this session, keyed by the path to the file, and the reverse
+        self._staged: Dict[str, str] = {}
+        self._sources: Dict[str, str] = {}
+        self._total_size = 0
+        self._pending = []
+        self._copying = None
+        self._stopped = False
+        os.makedirs(self.staging_dir, exist_ok=True)
+        self._load_entries()
+        self._write_manifest()
+        self._thread = threading.Thread(target=self._run, name="speedy_staging", daemon=True)
+        self._thread.start()
+        set_staged_file_lookup(self.staged_path)
+
+    @property
+    def total_size(self) -> int:
+        """
+        The total size of the staged files in bytes.
+        """
+        return self._total_size
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def staged_path(self, path: str) -> Optional[str]:
+        """
+        Get the staged copy of a file, if it has been staged in this session. Whether the file has changed is checked
+        when it is staged, not here, so that reading a staged file does not wait on the storage holding the original.
+
+        :param path: The path to the file
+        :type path: str
+        :return: The path to the staged copy, or None
+        :rtype: Optional[str]
+        """
+        name = self._staged.get(_source_key(path))
+        if name is None:
+            return None
+        staged_path = os.path.join(self.staging_dir, name)
+        return staged_path if os.path.isfile(staged_path) else None
+
+    def stage(self, paths: Iterable[str]):
+        """
+        Stage files in the background, replacing any files still waiting to be staged. The first file is staged first
+        and the rest in the order they are stored. Files which have already been staged are checked for changes, and
+        staged again if they have changed.
+
+        :param paths: The paths to the files, most urgent first
+        :type paths: Iterable[str]
+        """
+        paths = list(dict.fromkeys(paths))
+        if paths:
+            paths = paths[:1] + sorted(paths[1:], key=read_position)
+        with self._condition:
+            self._pending = paths
+            self._condition.notify()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait for the files waiting to be staged to be copied.
+
+        :param timeout: The maximum time to wait in seconds, or None to wait indefinitely
+        :type timeout: Optional[float]
+        :return: True if every file has been staged, False if the wait timed out
+        :rtype: bool
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: not self._pending and self._copying is None, timeout)
+
+    def close(self):
+        """
+        Stop staging files, leaving the staged copies to be used next time. Staged copies are no longer read.
+        """
+        with self._condition:
+            self._stopped = True
+            self._pending = []
+            self._condition.notify_all()
+        self._thread.join(timeout=5)
+        use_staging_dir(None)
+
+    def clear(self):
+        """
+        Remove every staged file.
+        """
+        with self._condition:
+            for name in list(self._entries):
+                self._remove(name)
+            self._write_manifest()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._copying = None
+                self._condition.notify_all()
+                self._condition.wait_for(lambda: self._pending or self._stopped)
+                if self._stopped:
+                    return
+                self._copying = self._pending.pop(0)
+            try:
+                self._copy(self._copying)
+            except Exception as e:
+                logger.debug(f"Failed to stage {self._copying}: {e}")
+
+    def _copy(self, path: str):
+        # The source is checked for changes here, in the background, rather than each time its copy is read
+        key = _source_key(path)
+        stat = stat_file(path)
+        name = staged_file_name(path, stat) if stat is not None and stat[0] <= self.max_size else None
+        with self._condition:
+            if self._staged.get(key) not in (None, name):
+                # The file has changed (or gone) since it was staged
+                self._unmap(key)
+                self._write_manifest()
+            if name is None:
+                return
+            if name in self._entries:
+                self._entries.move_to_end(name)
+                if key not in self._staged:
+                    self._map(key, name)
+                    self._write_manifest()
+                return
+        staged_path = os.path.join(self.staging_dir, name)
+        tmp_path = staged_path + _TMP_SUFFIX
+        try:
+            with open_source(path, staged=False) as source:
+                if isinstance(source, str):
+                    shutil.copyfile(source, tmp_path)
+                else:
+                    with open(tmp_path, 'wb') as f:
+                        shutil.copyfileobj(source, f, _COPY_BUFFER_SIZE)
+            os.replace(tmp_path, staged_path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        with self._condition:
+            self._entries[name] = stat[0]
+            self._total_size += stat[0]
+            self._map(key, name)
+            self._evict()
+            self._write_manifest()
+
+    def _map(self, key: str, name: str):
+        self._unmap(key)
+        self._staged[key] = name
+        self._sources[name] = key
+
+    def _unmap(self, key: str):
+        name = self._staged.pop(key, None)
+        if name is not None:
+            self._sources.pop(name, None)
+
+    def _write_manifest(self):
+        # Write the staged copies of this session for decode worker processes to read, see `_ManifestLookup`
+        manifest_path = os.path.join(self.staging_dir, _MANIFEST_NAME)
+        tmp_path = manifest_path + _TMP_SUFFIX
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(self._staged, f)
+            os.replace(tmp_path, manifest_path)
+        except OSError as e:
+            logger.debug(f"Failed to write the staging manifest: {e}")
+
+    def _remove(self, name: str):
+        size = self._entries.pop(name, None)
+        if size is None:
+            return
+        self._total_size -= size
+        source = self._sources.pop(name, None)
+        if source is not None:
+            self._staged.pop(source, None)
+        try:
+            os.remove(os.path.join(self.staging_dir, name))
+        except OSError:
+            pass
+
+    def _evict(self):
+        while self._total_size > self.max_size and self._entries:
+            self._remove(next(iter(self._entries)))
+
+    def _load_entries(self):
+        # Pick up the files staged by a previous run, oldest first, and remove any interrupted copies. Other files in
+        # the staging directory are not staged copies, so are neither counted nor removed. The files staged by a
+        # previous run are only read once they have been staged again in this session and found to be unchanged.
+        files = []
+        for name in os.listdir(self.staging_dir):
+            path = os.path.join(self.staging_dir, name)
+            if not _STAGED_NAME.match(name):
+                continue
+            try:
+                if name.endswith(_TMP_SUFFIX):
+                    os.remove(path)
+                    continue
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if os.path.isfile(path):
+                files.append((stat.st_mtime, name, stat.st_size))
+        for _, name, size in sorted(files):
+            self._entries[name] = size
+            self._total_size += size
+        self._evict()
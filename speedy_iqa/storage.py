@@ -0,0 +1,682 @@
+"""
+storage.py
+
+Storage of the image files, so that images can be read from a directory or straight from a zip or tar archive without
+unpacking it.
+
+Files within an archive are addressed as if the archive were a directory, e.g. '/data/study.zip/images/1.dcm', so the
+image directory of a session (and its reference image directory) may be an archive. The first time an archive is
+opened, an index of its members (the offset and size of each file within the archive) is built, which may be cached in
+a JSON file (e.g. next to the session file) so that the archive is not scanned again when the session is reopened.
+Members are then read by seeking to their offset in the archive: files stored without compression (as in a tar
+archive, or a zip archive of already compressed images) are read in place and deflated zip members are inflated in
+memory. Compressed tar archives (e.g. .tar.gz) cannot be read by offset, so are not supported.
+
+Files may also be read from a local copy, staged ahead of time from a slow network share (see `speedy_iqa.staging`),
+by setting a lookup with `set_staged_file_lookup`.
+
+Classes:
+    - Storage: Base class of the storage backends.
+    - LocalStorage: Reads files from a directory.
+    - ArchiveStorage: Base class of the archive backends, which read the members of an archive by offset.
+    - ZipStorage: Reads the members of a zip archive.
+    - TarStorage: Reads the members of an uncompressed tar archive.
+
+Functions:
+    - archive_index_path(session_path: str) -> str
+    - get_storage(path: str, index_path: Optional[str] = None) -> Storage
+    - is_storage_root(path: str) -> bool
+    - is_file(path: str) -> bool
+    - stat_file(path: str) -> Optional[Tuple[int, int]]
+    - read_header(path: str, length: int) -> bytes
+    - open_source(path: str, staged: bool = True) -> ContextManager[Union[str, BinaryIO]]
+    - read_position(path: str) -> Tuple[str, int, str]
+    - set_staged_file_lookup(lookup: Optional[Callable[[str], Optional[str]]])
+    - archive_index_paths() -> Dict[str, str]
+    - set_archive_index_paths(index_paths: Dict[str, str])
+"""
+
+import io
+import os
+import json
+import zlib
+import struct
+import logging
+import tarfile
+import zipfile
+import threading
+from contextlib import contextmanager
+from typing import BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+logger = logging.getLogger('fileLogger')
+
+ARCHIVE_EXTENSIONS = ('.zip', '.tar')
+ARCHIVE_INDEX_SUFFIX = '.archives.json'
+
+_INDEX_VERSION = 1
+# The fixed length part of a zip local file header, which is followed by the file name and extra field
+_ZIP_LOCAL_HEADER = struct.Struct('<4s5H3L2H')
+_ZIP_LOCAL_SIGNATURE = b'PK\x03\x04'
+
+
+def archive_index_path(session_path: str) -> str:
+    """
+    Get the path of the file caching the member indexes of the archives a session reads from, next to the session file.
+
+    :param session_path: The path to the session file
+    :type session_path: str
+    :return: The path to the index file
+    :rtype: str
+    """
+    return os.path.splitext(session_path)[0] + ARCHIVE_INDEX_SUFFIX
+
+
+def _is_hidden(relative_path: str) -> bool:
+    return any(part.startswith('.') or part == '__MACOSX' for part in relative_path.split(os.sep))
+
+
+class Storage:
+    """
+    Base class of the storage backends, which list and read the files under a root directory or archive. Files are
+    given by their path relative to the root.
+
+    :param root: The path to the directory or archive
+    :type root: str
+    """
+
+    def __init__(self, root: str):
+        self.root = os.path.normpath(os.path.abspath(root))
+
+    def iter_files(self, mtimes: Optional[Dict[str, float]] = None) -> Iterator[str]:
+        """
+        Iterate over the files in the storage, recursively, skipping hidden files and directories as glob does. Files
+        are given as they are found, so the first can be used before the whole storage has been listed.
+
+        :param mtimes: Optional dictionary to fill with the modification times of the directories listed (or of the
+            archive), keyed by their absolute paths, taken before they are listed, to tell later whether any files
+            have been added or removed
+        :type mtimes: Optional[Dict[str, float]]
+        :return: The relative paths of the files
+        :rtype: Iterator[str]
+        """
+        raise NotImplementedError
+
+    def list_files(self) -> List[str]:
+        """
+        List the files in the storage, see `iter_files`.
+
+        :return: The relative paths of the files
+        :rtype: List[str]
+        """
+        return list(self.iter_files())
+
+    def is_file(self, relative_path: str) -> bool:
+        """
+        Check whether a file exists in the storage.
+
+        :param relative_path: The path of the file, relative to the root
+        :type relative_path: str
+        :return: True if the file exists
+        :rtype: bool
+        """
+        raise NotImplementedError
+
+    def stat(self, relative_path: str) -> Optional[Tuple[int, int]]:
+        """
+        Get the size and modification time of a file, to tell whether it has changed.
+
+        :param relative_path: The path of the file, relative to the root
+        :type relative_path: str
+        :return: The size in bytes and the modification time in nanoseconds, or None if the file does not exist
+        :rtype: Optional[Tuple[int, int]]
+        """
+        raise NotImplementedError
+
+    def open(self, relative_path: str) -> BinaryIO:
+        """
+        Open a file for reading.
+
+        :param relative_path: The path of the file, relative to the root
+        :type relative_path: str
+        :return: The file, opened in binary mode
+        :rtype: BinaryIO
+        """
+        raise NotImplementedError
+
+
+class LocalStorage(Storage):
+    """
+    Reads files from a directory.
+
+    :param root: The path to the directory
+    :type root: str
+    """
+
+    def iter_files(self, mtimes: Optional[Dict[str, float]] = None) -> Iterator[str]:
+        # Walked top-down like os.walk (following links), but each directory is stat'ed before it is listed
+        relative_dirs = ['']
+        while relative_dirs:
+            relative_dir = relative_dirs.pop()
+            dir_path = os.path.join(self.root, relative_dir)
+            try:
+                if mtimes is not None:
+                    mtimes[os.path.normpath(dir_path)] = os.stat(dir_path).st_mtime
+                entries = list(os.scandir(dir_path))
+            except OSError:
+                continue
+            sub_dirs = []
+            for entry in entries:
+                if entry.name.startswith('.'):
+                    continue
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    continue
+                if is_dir:
+                    sub_dirs.append(os.path.join(relative_dir, entry.name))
+                else:
+                    yield os.path.normpath(os.path.join(relative_dir, entry.name))
+            relative_dirs.extend(reversed(sub_dirs))
+
+    def is_file(self, relative_path: str) -> bool:
+        return os.path.isfile(os.path.join(self.root, relative_path))
+
+    def stat(self, relative_path: str) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(os.path.join(self.root, relative_path))
+        except OSError:
+            return None
+        return stat.st_size, stat.st_mtime_ns
+
+    def open(self, relative_path: str) -> BinaryIO:
+        return open(os.path.join(self.root, relative_path), 'rb')
+
+
+class _MemberFile(io.RawIOBase):
+    """
+    A read-only view of the bytes of an archive member stored without compression, read from the archive in place.
+    """
+
+    def __init__(self, archive: BinaryIO, offset: int, size: int, name: str):
+        super().__init__()
+        self._archive = archive
+        self._offset = offset
+        self._size = size
+        self._position = 0
+        self.name = name
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self._size
+        self._position = max(0, offset)
+        return self._position
+
+    def readinto(self, buffer) -> int:
+        length = max(0, min(len(buffer), self._size - self._position))
+        if length == 0:
+            return 0
+        self._archive.seek(self._offset + self._position)
+        read = self._archive.readinto(memoryview(buffer)[:length])
+        self._position += read
+        return read
+
+    def close(self):
+        if not self.closed:
+            self._archive.close()
+        super().close()
+
+
+class ArchiveStorage(Storage):
+    """
+    Base class of the archive backends, which read the members of an archive by their offset within it. The index of
+    members is built once, when the archive is opened, and is cached in a JSON file if `index_path` is given.
+
+    :param root: The path to the archive
+    :type root: str
+    :param index_path: Optional path to a JSON file in which to cache the index of members. One file may hold the
+        indexes of several archives.
+    :type index_path: Optional[str]
+    """
+
+    def __init__(self, root: str, index_path: Optional[str] = None):
+        super().__init__(root)
+        self.index_path = index_path
+        stat = os.stat(self.root)
+        self._archive_stat = (stat.st_size, stat.st_mtime_ns)
+        self._members = self._load_index()
+        if self._members is None:
+            self._members = self.build_index()
+            self.save_index()
+
+    def build_index(self) -> Dict[str, list]:
+        """
+        Scan the archive for its members.
+
+        :return: The location of each file in the archive, keyed by its normalised relative path
+        :rtype: Dict[str, list]
+        """
+        raise NotImplementedError
+
+    def iter_files(self, mtimes: Optional[Dict[str, float]] = None) -> Iterator[str]:
+        if mtimes is not None:
+            mtimes[self.root] = os.stat(self.root).st_mtime
+        return (name for name in self._members if not _is_hidden(name))
+
+    def is_file(self, relative_path: str) -> bool:
+        return os.path.normpath(relative_path) in self._members
+
+    def stat(self, relative_path: str) -> Optional[Tuple[int, int]]:
+        member = self._members.get(os.path.normpath(relative_path))
+        if member is None:
+            return None
+        return self.member_size(member), self._archive_stat[1]
+
+    @staticmethod
+    def member_size(member: list) -> int:
+        """
+        Get the size of an archive member, uncompressed.
+
+        :param member: The location of the member in the index
+        :type member: list
+        :return: The size in bytes
+        :rtype: int
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def member_offset(member: list) -> int:
+        """
+        Get the offset of an archive member within the archive.
+
+        :param member: The location of the member in the index
+        :type member: list
+        :return: The offset in bytes
+        :rtype: int
+        """
+        raise NotImplementedError
+
+    def offset(self, relative_path: str) -> int:
+        """
+        Get the offset of a file within the archive, e.g. to read several files in the order they are stored.
+
+        :param relative_path: The path of the file, relative to the root
+        :type relative_path: str
+        :return: The offset in bytes
+        :rtype: int
+        """
+        return self.member_offset(self._member(relative_path))
+
+    def _member(self, relative_path: str) -> list:
+        member = self._members.get(os.path.normpath(relative_path))
+        if member is None:
+            raise FileNotFoundError(f"No such file in {self.root}: '{relative_path}'")
+        return member
+
+    def _load_index(self) -> Optional[Dict[str, list]]:
+        if self.index_path is None or not os.path.isfile(self.index_path):
+            return None
+        try:
+            with open(self.index_path, 'r') as f:
+                entry = json.load(f).get(self.root)
+        except (OSError, ValueError, AttributeError) as e:
+            logger.warning(f"Failed to read the archive index {self.index_path}, it will be rebuilt: {e}")
+            return None
+        if (not isinstance(entry, dict) or entry.get('version') != _INDEX_VERSION
+                or tuple(entry.get('stat', ())) != self._archive_stat):
+            return None
+        return entry['members']
+
+    def save_index(self, index_path: Optional[str] = None):
+        """
+        Write the index of members to a JSON file, alongside the indexes of any other archives in the file.
+
+        :param index_path: The path to the JSON file, by default `index_path`
+        :type index_path: Optional[str]
+        """
+        index_path = index_path or self.index_path
+        if index_path is None:
+            return
+        with _lock:
+            indexes = {}
+            if os.path.isfile(index_path):
+                try:
+                    with open(index_path, 'r') as f:
+                        indexes = json.load(f)
+                except (OSError, ValueError):
+                    indexes = {}
+            indexes[self.root] = {'version': _INDEX_VERSION, 'stat': list(self._archive_stat),
+                                  'members': self._members}
+            tmp_path = index_path + '.tmp'
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(index_path)), exist_ok=True)
+                with open(tmp_path, 'w') as f:
+                    json.dump(indexes, f)
+                os.replace(tmp_path, index_path)
+            except OSError as e:
+                logger.warning(f"Failed to write the archive index {index_path}: {e}")
+
+
+class ZipStorage(ArchiveStorage):
+    """
+    Reads the members of a zip archive. Members stored without compression are read in place and deflated members are
+    inflated in memory; other compression methods are read with `zipfile`.
+
+    :param root: The path to the zip archive
+    :type root: str
+    :param index_path: Optional path to a JSON file in which to cache the index of members
+    :type index_path: Optional[str]
+    """
+
+    def build_index(self) -> Dict[str, list]:
+        members = {}
+        with zipfile.ZipFile(self.root) as archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                # [name in the archive, offset of the local header, compressed size, size, compression, encrypted]
+                members[os.path.normpath(info.filename)] = [
+                    info.filename, info.header_offset, info.compress_size, info.file_size, info.compress_type,
+                    bool(info.flag_bits & 0x1)
+                ]
+        return members
+
+    @staticmethod
+    def member_size(member: list) -> int:
+        return member[3]
+
+    @staticmethod
+    def member_offset(member: list) -> int:
+        return member[1]
+
+    def open(self, relative_path: str) -> BinaryIO:
+        name, header_offset, compress_size, size, compress_type, encrypted = self._member(relative_path)
+        if encrypted:
+            raise ValueError(f"{name} in {self.root} is encrypted")
+        archive = open(self.root, 'rb')
+        try:
+            archive.seek(header_offset)
+            header = _ZIP_LOCAL_HEADER.unpack(archive.read(_ZIP_LOCAL_HEADER.size))
+            if header[0] != _ZIP_LOCAL_SIGNATURE:
+                raise ValueError(f"{name} in {self.root} has a bad local file header")
+            data_offset = header_offset + _ZIP_LOCAL_HEADER.size + header[9] + header[10]
+            full_name = os.path.join(self.root, relative_path)
+            if compress_type == zipfile.ZIP_STORED:
+                return io.BufferedReader(_MemberFile(archive, data_offset, size, full_name))
+            if compress_type == zipfile.ZIP_DEFLATED:
+                archive.seek(data_offset)
+                data = zlib.decompressobj(-zlib.MAX_WBITS).decompress(archive.read(compress_size))
+            else:
+                with zipfile.ZipFile(archive) as zip_file:
+                    data = zip_file.read(name)
+        except BaseException:
+            archive.close()
+            raise
+        archive.close()
+        member = io.BytesIO(data)
+        member.name = full_name
+        return member
+
+
+class TarStorage(ArchiveStorage):
+    """
+    Reads the members of an uncompressed tar archive in place.
+
+    :param root: The path to the tar archive
+    :type root: str
+    :param index_path: Optional path to a JSON file in which to cache the index of members
+    :type index_path: Optional[str]
+    """
+
+    def build_index(self) -> Dict[str, list]:
+        members = {}
+        try:
+            archive = tarfile.open(self.root, 'r:')
+        except tarfile.ReadError as e:
+            raise ValueError(f"{self.root} is not an uncompressed tar archive, which is required to read its members "
+                             f"without extracting them: {e}") from e
+        with archive:
+            for info in archive:
+                if info.isfile() and not info.sparse:
+                    # [offset of the data, size]
+                    members[os.path.normpath(info.name)] = [info.offset_data, info.size]
+        return members
+
+    @staticmethod
+    def member_size(member: list) -> int:
+        return member[1]
+
+    @staticmethod
+    def member_offset(member: list) -> int:
+        return member[0]
+
+    def open(self, relative_path: str) -> BinaryIO:
+        offset, size = self._member(relative_path)
+        member = _MemberFile(open(self.root, 'rb'), offset, size, os.path.join(self.root, relative_path))
+        return io.BufferedReader(member)
+
+
+_lock = threading.RLock()
+# The archives opened so far, and the files their member indexes are cached in, keyed by normalised path
+_archives: Dict[str, ArchiveStorage] = {}
+_index_paths: Dict[str, str] = {}
+_staged_file_lookup: Optional[Callable[[str], Optional[str]]] = None
+
+
+def _is_archive(path: str) -> bool:
+    return path.lower().endswith(ARCHIVE_EXTENSIONS) and os.path.isfile(path)
+
+
+def _open_archive(path: str, index_path: Optional[str] = None) -> ArchiveStorage:
+    path = os.path.normpath(os.path.abspath(path))
+    with _lock:
+        archive = _archives.get(path)
+        if index_path is not None:
+            _index_paths[path] = index_path
+        index_path = _index_paths.get(path)
+        if archive is not None:
+            stat = os.stat(path)
+            if archive._archive_stat == (stat.st_size, stat.st_mtime_ns):
+                if index_path is not None and archive.index_path != index_path:
+                    archive.index_path = index_path
+                    archive.save_index()
+                return archive
+        backend = ZipStorage if path.lower().endswith('.zip') else TarStorage
+        archive = backend(path, index_path)
+        _archives[path] = archive
+        return archive
+
+
+def get_storage(path: str, index_path: Optional[str] = None) -> Storage:
+    """
+    Get the storage backend for a directory or archive.
+
+    :param path: The path to the directory or archive
+    :type path: str
+    :param index_path: For an archive, optional path to a JSON file in which to cache the index of its members (e.g.
+        next to the session file), used by every later reader of the archive
+    :type index_path: Optional[str]
+    :return: The storage
+    :rtype: Storage
+    """
+    if _is_archive(path):
+        return _open_archive(path, index_path)
+    return LocalStorage(path)
+
+
+def is_storage_root(path: str) -> bool:
+    """
+    Check whether a path is a directory or an archive which images can be read from.
+
+    :param path: The path
+    :type path: str
+    :return: True if the path is a directory or a supported archive
+    :rtype: bool
+    """
+    return os.path.isdir(path) or _is_archive(path)
+
+
+def _find_member(path: str) -> Optional[Tuple[ArchiveStorage, str]]:
+    # Walk up the path until reaching an archive, e.g. '/data/study.zip' for '/data/study.zip/images/1.dcm'
+    parent, relative_path = os.path.normpath(os.path.abspath(path)), ''
+    while True:
+        parent, name = os.path.split(parent)
+        if not name:
+            return None
+        relative_path = os.path.join(name, relative_path) if relative_path else name
+        if _is_archive(parent):
+            return _open_archive(parent), relative_path
+
+
+def is_file(path: str) -> bool:
+    """
+    Check whether a file exists, on disk or within an archive.
+
+    :param path: The path to the file
+    :type path: str
+    :return: True if the file exists
+    :rtype: bool
+    """
+    if os.path.isfile(path):
+        return True
+    try:
+        member = _find_member(path)
+    except (OSError, ValueError):
+        return False
+    return member is not None and member[0].is_file(member[1])
+
+
+def stat_file(path: str) -> Optional[Tuple[int, int]]:
+    """
+    Get the size and modification time of a file, on disk or within an archive (whose members take the modification
+    time of the archive).
+
+    :param path: The path to the file
+    :type path: str
+    :return: The size in bytes and the modification time in nanoseconds, or None if the file does not exist
+    :rtype: Optional[Tuple[int, int]]
+    """
+    try:
+        stat = os.stat(path)
+        return stat.st_size, stat.st_mtime_ns
+    except OSError:
+        pass
+    try:
+        member = _find_member(path)
+    except (OSError, ValueError):
+        return None
+    return member[0].stat(member[1]) if member is not None else None
+
+
+@contextmanager
+def open_source(path: str, staged: bool = True) -> Iterator[Union[str, BinaryIO]]:
+    """
+    Open a file to be decoded. Files on disk are given by their path, so that decoders can memory-map them, and files
+    within an archive as an open binary file. If the file has been staged to a local copy, the copy is given instead.
+
+    :param path: The path to the file
+    :type path: str
+    :param staged: Whether to give the staged copy of the file, if there is one
+    :type staged: bool
+    :return: A context manager giving the path or the open file
+    :rtype: Iterator[Union[str, BinaryIO]]
+    """
+    if staged and _staged_file_lookup is not None:
+        staged_path = _staged_file_lookup(path)
+        if staged_path is not None:
+            yield staged_path
+            return
+    if os.path.isfile(path):
+        yield path
+        return
+    member = _find_member(path)
+    if member is None:
+        raise FileNotFoundError(f"No such file: '{path}'")
+    with member[0].open(member[1]) as f:
+        yield f
+
+
+def read_header(path: str, length: int) -> bytes:
+    """
+    Read the first bytes of a file, on disk or within an archive, e.g. to check its magic bytes.
+
+    :param path: The path to the file
+    :type path: str
+    :param length: The number of bytes to read
+    :type length: int
+    :return: The bytes read, or no bytes if the file cannot be read
+    :rtype: bytes
+    """
+    try:
+        with open_source(path) as source:
+            if isinstance(source, str):
+                with open(source, 'rb') as f:
+                    return f.read(length)
+            return source.read(length)
+    except (OSError, ValueError):
+        return b''
+
+
+def read_position(path: str) -> Tuple[str, int, str]:
+    """
+    Get a key giving the position of a file on its storage, so that files sorted by it are read with as few seeks as
+    possible: files within an archive in the order they are stored, and other files grouped by directory.
+
+    :param path: The path to the file
+    :type path: str
+    :return: The directory or archive holding the file, the offset of the file within an archive (or 0) and its name
+    :rtype: Tuple[str, int, str]
+    """
+    if not os.path.isfile(path):
+        try:
+            member = _find_member(path)
+            if member is not None:
+                return member[0].root, member[0].offset(member[1]), member[1]
+        except (OSError, ValueError):
+            pass
+    return os.path.dirname(path), 0, os.path.basename(path)
+
+
+def set_staged_file_lookup(lookup: Optional[Callable[[str], Optional[str]]]):
+    """
+    Set the function used to find the staged local copy of a file, which `open_source` gives in place of the file.
+
+    :param lookup: Function returning the path to the staged copy of a file, or None if it has not been staged. None
+        reads every file from where it is stored.
+    :type lookup: Optional[Callable[[str], Optional[str]]]
+    """
+    global _staged_file_lookup
+    _staged_file_lookup = lookup
+
+
+def archive_index_paths() -> Dict[str, str]:
+    """
+    Get the files in which the member indexes of the open archives are cached, e.g. to pass to worker processes.
+
+    :return: The index file of each archive, keyed by the path to the archive
+    :rtype: Dict[str, str]
+    """
+    with _lock:
+        return dict(_index_paths)
+
+
+def set_archive_index_paths(index_paths: Dict[str, str]):
+    """
+    Set the files in which the member indexes of archives are cached, so that archives opened later (e.g. by a worker
+    process) load their index rather than scanning the archive.
+
+    :param index_paths: The index file of each archive, keyed by the path to the archive
+    :type index_paths: Dict[str, str]
+    """
+    with _lock:
+        _index_paths.update(index_paths)
@@ -0,0 +1,303 @@
+"""
+telemetry.py
+
+Navigation telemetry, used to measure reader throughput (images per hour) and where the time goes: waiting for images
+to load versus deciding on a rating.
+
+While labelling, an event is recorded whenever an image is left, shown or rated, with a monotonic timestamp. Events are
+held in compact typed arrays and written to a sidecar file next to the session (and backup) files, e.g.
+`progress.telemetry.json` for `progress.json`. Each run of the app is stored separately in the sidecar, so reopening a
+session adds to, rather than replaces, the telemetry from earlier runs. The sidecars can be summarised headless, e.g.
+
+    `speedy_telemetry progress.telemetry.json`
+
+Classes:
+    - NavigationTelemetry: Records navigation events for one run of the app.
+
+Functions:
+    - telemetry_path(session_path: str) -> str
+    - load_runs(path: str) -> List[Dict]
+    - summarise_run(run: Dict, idle_threshold: float) -> Dict
+    - summarise_runs(runs: List[Dict], idle_threshold: float) -> Dict[str, Dict]
+    - main(): Command line entry point for reporting on telemetry sidecar files.
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+from array import array
+from statistics import median
+from typing import Dict, List, Optional
+
+TELEMETRY_SUFFIX = '.telemetry.json'
+TELEMETRY_VERSION = 1
+
+# Event codes
+LEFT = 0
+SHOWN = 1
+RATED = 2
+EVENT_NAMES = {LEFT: 'left', SHOWN: 'shown', RATED: 'rated'}
+
+# Gaps between events longer than this (in seconds) are counted as idle, not as labelling time
+DEFAULT_IDLE_THRESHOLD = 300
+
+
+def telemetry_path(session_path: str) -> str:
+    """
+    Get the path of the telemetry sidecar file of a session file.
+
+    :param session_path: The path to the session (progress or backup) file
+    :type session_path: str
+    :return: The path to the sidecar file
+    :rtype: str
+    """
+    return os.path.splitext(session_path)[0] + TELEMETRY_SUFFIX
+
+
+class NavigationTelemetry:
+    """
+    Records the navigation events (image left, shown or rated) of one run of the app.
+
+    :param reader: The name of the reader
+    :type reader: str
+    :param task: The task being labelled
+    :type task: str
+    """
+
+    def __init__(self, reader: str = "", task: str = ""):
+        self.run_id = uuid.uuid4().hex
+        self.reader = reader
+        self.task = task
+        self.started = time.time()
+        self._start = time.monotonic()
+        self._events = array('B')
+        self._times = array('d')
+        self._indices = array('l')
+        self._files = []
+        self._file_indices = {}
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+    def record(self, event: int, filename: str):
+        """
+        Record an event.
+
+        :param event: The event code, one of LEFT, SHOWN or RATED
+        :type event: int
+        :param filename: The image the event relates to
+        :type filename: str
+        """
+        index = self._file_indices.get(filename)
+        if index is None:
+            index = self._file_indices[filename] = len(self._files)
+            self._files.append(filename)
+        self._events.append(event)
+        self._times.append(time.monotonic() - self._start)
+        self._indices.append(index)
+
+    def to_dict(self) -> Dict:
+        """
+        Get the run as a dictionary of columns, as stored in the sidecar file.
+
+        :return: The run
+        :rtype: Dict
+        """
+        return {
+            'run_id': self.run_id,
+            'reader': self.reader,
+            'task': self.task,
+            'started': self.started,
+            'files': list(self._files),
+            'event': self._events.tolist(),
+            'time': [round(t, 4) for t in self._times],
+            'file': self._indices.tolist(),
+        }
+
+    def save(self, session_path: str) -> Optional[str]:
+        """
+        Write the run to the sidecar file of a session file, keeping the runs already in it.
+
+        :param session_path: The path to the session (progress or backup) file
+        :type session_path: str
+        :return: The path to the sidecar file, or None if there were no events to write
+        :rtype: Optional[str]
+        """
+        if not self._events:
+            return None
+        path = telemetry_path(session_path)
+        runs = [run for run in load_runs(path) if run.get('run_id') != self.run_id] if os.path.isfile(path) else []
+        runs.append(self.to_dict())
+        with open(path, 'w') as f:
+            json.dump({'version': TELEMETRY_VERSION, 'runs': runs}, f, separators=(',', ':'))
+        return path
+
+
+def load_runs(path: str) -> List[Dict]:
+    """
+    Load the runs from a telemetry sidecar file.
+
+    :param path: The path to the sidecar file
+    :type path: str
+    :return: The runs
+    :rtype: List[Dict]
+    """
+    try:
+        with open(path, 'r') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return []
+    return data.get('runs', [])
+
+
+def summarise_run(run: Dict, idle_threshold: float = DEFAULT_IDLE_THRESHOLD) -> Dict:
+    """
+    Summarise the throughput of a run, splitting the active time into the time spent waiting for images to load (from
+    leaving one image to the next being shown) and the time spent on each image once shown.
+
+    :param run: The run, as stored in the sidecar file
+    :type run: Dict
+    :param idle_threshold: Gaps between events longer than this (in seconds) are counted as idle
+    :type idle_threshold: float
+    :return: The summary of the run
+    :rtype: Dict
+    """
+    events, times, files = run['event'], run['time'], run['file']
+
+    active_time = 0.0
+    for previous, current in zip(times, times[1:]):
+        gap = current - previous
+        if gap <= idle_threshold:
+            active_time += gap
+
+    load_stalls = []
+    decision_times = []
+    rated_files = set()
+    shown = 0
+    left_time = None
+    shown_time = None
+    first_rating = None
+    last_rating = None
+
+    def end_visit():
+        if shown_time is not None and first_rating is not None:
+            decision = last_rating - shown_time
+            if decision <= idle_threshold:
+                decision_times.append(decision)
+
+    for event, t, file in zip(events, times, files):
+        if event == LEFT:
+            end_visit()
+            left_time, shown_time, first_rating, last_rating = t, None, None, None
+        elif event == SHOWN:
+            shown += 1
+            if left_time is not None and t - left_time <= idle_threshold:
+                load_stalls.append(t - left_time)
+            shown_time, left_time = t, None
+        elif event == RATED:
+            rated_files.add(file)
+            if first_rating is None:
+                first_rating = t
+            last_rating = t
+    end_visit()
+
+    stall_time = sum(load_stalls)
+    return {
+        'reader': run.get('reader', ""),
+        'task': run.get('task', ""),
+        'started': run.get('started'),
+        'images_shown': shown,
+        'images_rated': len(rated_files),
+        'active_hours': active_time / 3600,
+        'images_per_hour': len(rated_files) / (active_time / 3600) if active_time > 0 else 0.0,
+        'stall_seconds': stall_time,
+        'stall_fraction': stall_time / active_time if active_time > 0 else 0.0,
+        'median_load_ms': median(load_stalls) * 1000 if load_stalls else 0.0,
+        'max_load_ms': max(load_stalls) * 1000 if load_stalls else 0.0,
+        'median_decision_s': median(decision_times) if decision_times else 0.0,
+    }
+
+
+def summarise_runs(runs: List[Dict], idle_threshold: float = DEFAULT_IDLE_THRESHOLD) -> Dict[str, Dict]:
+    """
+    Summarise the throughput of each reader over several runs.
+
+    :param runs: The runs, as stored in the sidecar files
+    :type runs: List[Dict]
+    :param idle_threshold: Gaps between events longer than this (in seconds) are counted as idle
+    :type idle_threshold: float
+    :return: The summary of each reader
+    :rtype: Dict[str, Dict]
+    """
+    summaries = {}
+    for run in runs:
+        summary = summarise_run(run, idle_threshold)
+        reader = summary['reader'] or "unknown"
+        total = summaries.setdefault(reader, {
+            'runs': 0, 'images_shown': 0, 'images_rated': 0, 'active_hours': 0.0, 'stall_seconds': 0.0,
+            'max_load_ms': 0.0,
+        })
+        total['runs'] += 1
+        for key in ('images_shown', 'images_rated', 'active_hours', 'stall_seconds'):
+            total[key] += summary[key]
+        total['max_load_ms'] = max(total['max_load_ms'], summary['max_load_ms'])
+    for total in summaries.values():
+        active_seconds = total['active_hours'] * 3600
+        total['images_per_hour'] = total['images_rated'] / total['active_hours'] if total['active_hours'] else 0.0
+        total['stall_fraction'] = total['stall_seconds'] / active_seconds if active_seconds else 0.0
+    return summaries
+
+
+def main(argv: Optional[List[str]] = None):
+    """
+    Command line entry point to summarise the throughput of each reader from telemetry sidecar files, e.g.
+        `speedy_telemetry progress.telemetry.json other_reader.telemetry.json`
+    """
+    parser = argparse.ArgumentParser(description="Summarise Speedy IQA reader throughput from telemetry files.")
+    parser.add_argument('paths', nargs='+', help="Telemetry sidecar files (*.telemetry.json) or session files.")
+    parser.add_argument('--idle', type=float, default=DEFAULT_IDLE_THRESHOLD,
+                        help="Gaps longer than this many seconds are counted as idle (default: %(default)s).")
+    parser.add_argument('--runs', action='store_true', help="Also summarise each run separately.")
+    parser.add_argument('--json', action='store_true', help="Print the summary as JSON.")
+    args = parser.parse_args(argv)
+
+    runs = []
+    for path in args.paths:
+        if not path.endswith(TELEMETRY_SUFFIX):
+            path = telemetry_path(path)
+        runs += load_runs(path)
+    if not runs:
+        print("No telemetry found.")
+        return 1
+
+    # The same run may be in several sidecars (e.g. a session and its backups), so only count it once
+    runs = list({run['run_id']: run for run in runs}.values())
+    readers = summarise_runs(runs, args.idle)
+
+    if args.json:
+        output = {'readers': readers}
+        if args.runs:
+            output['runs'] = [summarise_run(run, args.idle) for run in runs]
+        print(json.dumps(output, indent=2))
+        return 0
+
+    print(f"{'reader':<16}{'runs':>5}{'rated':>8}{'hours':>8}{'img/h':>8}{'stall s':>9}{'stall %':>9}"
+          f"{'max load ms':>13}")
+    for reader, total in readers.items():
+        print(f"{reader:<16}{total['runs']:>5}{total['images_rated']:>8}{total['active_hours']:>8.2f}"
+              f"{total['images_per_hour']:>8.1f}{total['stall_seconds']:>9.1f}{total['stall_fraction'] * 100:>8.1f}%"
+              f"{total['max_load_ms']:>13.0f}")
+    if args.runs:
+        print(f"\n{'reader':<16}{'rated':>8}{'img/h':>8}{'median load ms':>16}{'median decision s':>19}")
+        for run in runs:
+            summary = summarise_run(run, args.idle)
+            print(f"{summary['reader'] or 'unknown':<16}{summary['images_rated']:>8}{summary['images_per_hour']:>8.1f}"
+                  f"{summary['median_load_ms']:>16.0f}{summary['median_decision_s']:>19.1f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
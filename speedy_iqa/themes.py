@@ -0,0 +1,117 @@
+"""
+themes.py
+
+Memoised access to the qt_material themes, so that switching themes (and start-up, which applies the saved theme more
+than once) does not repeatedly parse the theme XML files, render the stylesheet template or regenerate the themed icon
+resources.
+
+The first time a theme is applied, qt_material builds its stylesheet as usual, with the themed icon resources written
+to a directory of their own. The stylesheet, palette and icon directory are then kept, so applying the theme again
+only restores them.
+
+Functions:
+    - get_theme_colors(theme: str) -> Dict[str, str]
+    - theme_color(theme: str, key: str, fallback_key: Optional[str]) -> str
+    - apply_theme(app: QApplication, theme: str, extra_stylesheet: str)
+    - clear_theme_cache()
+"""
+
+import os
+from functools import lru_cache
+from typing import Dict, Optional
+
+from PyQt6.QtCore import QDir
+from PyQt6.QtGui import QGuiApplication
+from PyQt6.QtWidgets import QApplication
+from qt_material import get_theme, build_stylesheet
+
+DEFAULT_THEME = 'dark_blue.xml'
+
+# The stylesheet, palette and icon directory of each theme applied so far
+_applied_themes = {}
+
+
+@lru_cache(maxsize=None)
+def _load_theme(theme: str) -> Dict[str, str]:
+    colors = get_theme(theme)
+    if colors is None:
+        colors = get_theme(DEFAULT_THEME)
+    return colors
+
+
+def get_theme_colors(theme: str) -> Dict[str, str]:
+    """
+    Get the colors of a qt_material theme. The theme file is only parsed the first time; themes which cannot be found
+    fall back to the default theme.
+
+    :param theme: The name of the theme file, e.g. 'dark_blue.xml'
+    :type theme: str
+    :return: A copy of the theme's colors
+    :rtype: Dict[str, str]
+    """
+    return dict(_load_theme(theme))
+
+
+def theme_color(theme: str, key: str, fallback_key: Optional[str] = None) -> str:
+    """
+    Get a single color of a qt_material theme, e.g. 'primaryLightColor', which not every theme defines.
+
+    :param theme: The name of the theme file, e.g. 'dark_blue.xml'
+    :type theme: str
+    :param key: The name of the color
+    :type key: str
+    :param fallback_key: The name of the color to use if the theme does not define key
+    :type fallback_key: Optional[str]
+    :return: The color, as a hex string
+    :rtype: str
+    """
+    colors = _load_theme(theme)
+    if key in colors or fallback_key is None:
+        return colors[key]
+    return colors[fallback_key]
+
+
+def _icon_parent(theme: str) -> str:
+    return 'theme_' + os.path.splitext(os.path.basename(theme))[0]
+
+
+def apply_theme(app: QApplication, theme: str, extra_stylesheet: str = ""):
+    """
+    Apply a qt_material theme to the application. The stylesheet and icons are built the first time a theme is
+    applied and restored from memory after that. Themes which cannot be found fall back to the default theme.
+
+    :param app: The application
+    :type app: QApplication
+    :param theme: The name of the theme file, e.g. 'dark_blue.xml'
+    :type theme: str
+    :param extra_stylesheet: Rules to append to the theme's stylesheet, so the application is only restyled once
+    :type extra_stylesheet: str
+    """
+    if theme not in _applied_themes and get_theme(theme) is None:
+        theme = DEFAULT_THEME
+
+    applied = _applied_themes.get(theme)
+    if applied is None:
+        parent = _icon_parent(theme)
+        stylesheet = build_stylesheet(theme, parent=parent)
+        # qt_material appends to the icon search path, so make sure this theme's icons are the only ones found
+        icon_dir = next((path for path in QDir.searchPaths('icon') if path.endswith(parent)), None)
+        applied = _applied_themes[theme] = (stylesheet, QGuiApplication.palette(), icon_dir)
+
+    stylesheet, palette, icon_dir = applied
+    # Changing the style re-polishes every widget, so only do so if needed
+    if app.property('material_style') != 'Fusion':
+        app.setStyle('Fusion')
+        app.setProperty('material_style', 'Fusion')
+    if icon_dir is not None:
+        QDir.setSearchPaths('icon', [icon_dir])
+    QGuiApplication.setPalette(palette)
+    app.setStyleSheet(stylesheet + extra_stylesheet)
+
+
+def clear_theme_cache():
+    """
+    Forget the themes applied so far and their parsed colors, e.g. if the theme files have changed.
+    """
+    _applied_themes.clear()
+    _load_theme.cache_clear()
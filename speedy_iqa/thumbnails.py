@@ -0,0 +1,438 @@
+"""
+thumbnails.py
+
+Dockable thumbnail grid giving an overview of the session, showing whether each image has been rated, not yet rated
+or failed to load.
+
+The grid is a virtualised QListView: only the visible thumbnails are ever requested from the model, so it stays smooth
+for tens of thousands of images. Thumbnails are generated lazily in a worker thread pool, most recently requested
+first so that the visible thumbnails are loaded before those which have been scrolled past, and are kept in a bounded
+in-memory cache (and in the on-disk image cache, if one is in use).
+
+Classes:
+    - ThumbnailSignals: Signals emitted by the thumbnail workers.
+    - ThumbnailLoader: Worker which generates the next requested thumbnail.
+    - ThumbnailModel: List model of the session's images and their thumbnails.
+    - ThumbnailDelegate: Draws a thumbnail and its rating state.
+    - ThumbnailDock: Dock widget containing the thumbnail grid.
+"""
+
+import os
+import logging
+import threading
+from collections import OrderedDict, deque
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from PyQt6.QtCore import *
+from PyQt6.QtGui import *
+from PyQt6.QtWidgets import *
+
+from speedy_iqa.cache import PreviewCache, make_preview
+from speedy_iqa.utils import ConnectionManager, array_to_qimage
+
+logger = logging.getLogger('fileLogger')
+
+# Role used to get the rating state (True, False or "FAILED") of an image from the model
+StatusRole = Qt.ItemDataRole.UserRole + 1
+
+
+class ThumbnailSignals(QObject):
+    """
+    Signals emitted by the thumbnail workers. QRunnable is not a QObject, so cannot emit signals itself.
+    """
+    loaded = pyqtSignal(int, str, QImage)
+    failed = pyqtSignal(int, str)
+
+
+class ThumbnailLoader(QRunnable):
+    """
+    Worker which generates the next requested thumbnail. The row is only chosen when the worker runs, so that the most
+    recently requested (i.e. visible) thumbnails are always generated first.
+
+    :param model: The model to generate the thumbnail for
+    :type model: ThumbnailModel
+    """
+
+    def __init__(self, model: "ThumbnailModel"):
+        super().__init__()
+        self.model = model
+        self.setAutoDelete(True)
+
+    def run(self):
+        request = self.model.next_request()
+        if request is None:
+            return
+        row, filename = request
+        try:
+            qimage = self.model.generate_thumbnail(filename)
+        except Exception as e:
+            logger.warning(f"Failed to generate thumbnail for {filename}: {e}")
+            self.model.signals.failed.emit(row, filename)
+            return
+        self.model.signals.loaded.emit(row, filename, qimage)
+
+
+class ThumbnailModel(QAbstractListModel):
+    """
+    List model of the session's images and their thumbnails.
+
+    :param file_list: The relative paths of the images in the session
+    :type file_list: List[str]
+    :param viewed_values: The rating state of each image
+    :type viewed_values: Dict
+    :param dir_path: The directory containing the images
+    :type dir_path: str
+    :param read_file: Function to read an image file as an 8-bit array, given its path, extension and the size it may
+        be reduced to (see `speedy_iqa.decoders.read_file`)
+    :type read_file: Callable
+    :param preview_cache: The on-disk image cache, if used
+    :type preview_cache: Optional[PreviewCache]
+    :param thumbnail_size: The size of the thumbnails in pixels
+    :type thumbnail_size: int
+    :param max_cached: The maximum number of thumbnails kept in memory
+    :type max_cached: int
+    """
+
+    def __init__(self, file_list: List[str], viewed_values: Dict, dir_path: str, read_file: Callable,
+                 preview_cache: Optional[PreviewCache] = None, thumbnail_size: int = 96, max_cached: int = 2000,
+                 parent: Optional[QObject] = None):
+        super().__init__(parent)
+        self.connection_manager = ConnectionManager()
+        self.file_list = file_list
+        self.viewed_values = viewed_values
+        self.dir_path = dir_path
+        self.read_file = read_file
+        self.preview_cache = preview_cache
+        self.thumbnail_size = thumbnail_size
+        self.max_cached = max_cached
+
+        self._pixmaps = OrderedDict()
+        self._failed = set()
+        self._pending = set()
+        self._requests = deque()
+        self._lock = threading.Lock()
+
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(max(1, min(4, QThread.idealThreadCount() - 1)))
+
+        self.signals = ThumbnailSignals()
+        self.connection_manager.connect(self.signals.loaded, self.on_thumbnail_loaded)
+        self.connection_manager.connect(self.signals.failed, self.on_thumbnail_failed)
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        if parent.isValid():
+            return 0
+        return len(self.file_list)
+
+    def data(self, index: QModelIndex, role: int = Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        row = index.row()
+        filename = self.file_list[row]
+        if role == Qt.ItemDataRole.ToolTipRole:
+            return filename
+        if role == StatusRole:
+            return self.viewed_values.get(filename, False)
+        if role == Qt.ItemDataRole.DecorationRole:
+            pixmap = self._pixmaps.get(row)
+            if pixmap is not None:
+                self._pixmaps.move_to_end(row)
+                return pixmap
+            if row not in self._failed:
+                self.request(row)
+        return None
+
+    def request(self, row: int):
+        """
+        Request the thumbnail of a row to be generated in the thread pool.
+
+        :param row: The row of the image
+        :type row: int
+        """
+        with self._lock:
+            if row in self._pending:
+                return
+            self._pending.add(row)
+            self._requests.append(row)
+            # Forget the oldest requests, they have most likely been scrolled past
+            while len(self._requests) > 4 * self.max_cached:
+                self._pending.discard(self._requests.popleft())
+        self.pool.start(ThumbnailLoader(self))
+
+    def next_request(self) -> Optional[Tuple[int, str]]:
+        """
+        Get the most recently requested row which has not yet been generated, and its image. Called from the worker
+        threads, so the image is looked up here, as the images may be reordered or removed while a thumbnail is made.
+
+        :return: The row and the relative path of its image, or None if there are no outstanding requests
+        :rtype: Optional[Tuple[int, str]]
+        """
+        with self._lock:
+            while self._requests:
+                row = self._requests.pop()
+                if row < len(self.file_list):
+                    return row, self.file_list[row]
+                self._pending.discard(row)
+            return None
+
+    def generate_thumbnail(self, filename: str) -> QImage:
+        """
+        Generate the thumbnail of an image, using the preview in the image cache if there is one. Called from the
+        worker threads.
+
+        :param filename: The relative path of the image
+        :type filename: str
+        :return: The thumbnail
+        :rtype: QImage
+        """
+        path = os.path.join(self.dir_path, filename)
+        preview = None
+        if self.preview_cache is not None:
+            preview = self.preview_cache.get_preview(path)
+        if preview is None:
+            image = self.read_file(path, os.path.splitext(path)[1], max_size=2 * self.thumbnail_size)
+            preview = make_preview(image, 2 * self.thumbnail_size)
+            if self.preview_cache is not None:
+                self.preview_cache.put_preview(path, preview, image.shape, image.dtype)
+        qimage = array_to_qimage(np.ascontiguousarray(preview))
+        return qimage.scaled(self.thumbnail_size, self.thumbnail_size, Qt.AspectRatioMode.KeepAspectRatio,
+                             Qt.TransformationMode.SmoothTransformation)
+
+    def on_thumbnail_loaded(self, row: int, filename: str, qimage: QImage):
+        """
+        Store a generated thumbnail and update the view.
+
+        :param row: The row of the image
+        :type row: int
+        :param filename: The image the thumbnail was generated from, which is no longer in the row if the images have
+            been reordered since
+        :type filename: str
+        :param qimage: The thumbnail
+        :type qimage: QImage
+        """
+        with self._lock:
+            self._pending.discard(row)
+        if row >= len(self.file_list) or self.file_list[row] != filename:
+            return
+        self._pixmaps[row] = QPixmap.fromImage(qimage)
+        while len(self._pixmaps) > self.max_cached:
+            self._pixmaps.popitem(last=False)
+        index = self.index(row)
+        self.dataChanged.emit(index, index, [Qt.ItemDataRole.DecorationRole])
+
+    def on_thumbnail_failed(self, row: int, filename: str):
+        """
+        Record that the thumbnail of a row could not be generated, so that it is not requested again.
+
+        :param row: The row of the image
+        :type row: int
+        :param filename: The image the thumbnail was generated from
+        :type filename: str
+        """
+        with self._lock:
+            self._pending.discard(row)
+        if row >= len(self.file_list) or self.file_list[row] != filename:
+            return
+        self._failed.add(row)
+        index = self.index(row)
+        self.dataChanged.emit(index, index, [Qt.ItemDataRole.DecorationRole])
+
+    def append_files(self, filenames: List[str]):
+        """
+        Add images to the end of the session, e.g. as they are found by `speedy_iqa.discovery.ImageDiscovery`.
+
+        :param filenames: The relative paths of the images
+        :type filenames: List[str]
+        """
+        if not filenames:
+            return
+        first_row = len(self.file_list)
+        self.beginInsertRows(QModelIndex(), first_row, first_row + len(filenames) - 1)
+        self.file_list.extend(filenames)
+        self.endInsertRows()
+
+    def set_file_order(self, filenames: List[str]):
+        """
+        Reorder the images of the session, keeping the thumbnails of the images which stay in the same row.
+
+        :param filenames: The relative paths of the images, in the new order
+        :type filenames: List[str]
+        """
+        self.beginResetModel()
+        unchanged = {row for row, filename in enumerate(self.file_list[:len(filenames)]) if filenames[row] == filename}
+        self.file_list[:] = filenames
+        for row in [row for row in self._pixmaps if row not in unchanged]:
+            del self._pixmaps[row]
+        self._failed.intersection_update(unchanged)
+        with self._lock:
+            self._requests.clear()
+            self._pending.clear()
+        self.endResetModel()
+
+    def refresh_status(self, row: int):
+        """
+        Update the view after the rating state of a row has changed.
+
+        :param row: The row of the image
+        :type row: int
+        """
+        if 0 <= row < len(self.file_list):
+            index = self.index(row)
+            self.dataChanged.emit(index, index, [StatusRole])
+
+    def shutdown(self):
+        """
+        Cancel any outstanding thumbnail requests and wait for the running workers to finish.
+        """
+        with self._lock:
+            self._requests.clear()
+            self._pending.clear()
+        self.pool.clear()
+        self.pool.waitForDone()
+
+
+class ThumbnailDelegate(QStyledItemDelegate):
+    """
+    Draws a thumbnail with a bar underneath showing whether the image has been rated, not rated or failed to load.
+
+    :param thumbnail_size: The size of the thumbnails in pixels
+    :type thumbnail_size: int
+    """
+
+    def __init__(self, thumbnail_size: int = 96, parent: Optional[QObject] = None):
+        super().__init__(parent)
+        self.thumbnail_size = thumbnail_size
+        self.margin = 4
+        self.bar_height = 4
+        self.colors = {
+            'rated': QColor("green"),
+            'not_rated': QColor("grey"),
+            'failed': QColor("red"),
+            'current': QColor("white"),
+        }
+
+    def set_colors(self, rated: str, not_rated: str, current: str):
+        """
+        Set the colours used to draw the rating state and the current image, e.g. when the theme changes.
+
+        :param rated: The colour of the bar for rated images
+        :type rated: str
+        :param not_rated: The colour of the bar for images which have not been rated
+        :type not_rated: str
+        :param current: The colour of the border around the current image
+        :type current: str
+        """
+        self.colors['rated'] = QColor(rated)
+        self.colors['not_rated'] = QColor(not_rated)
+        self.colors['current'] = QColor(current)
+
+    def sizeHint(self, option: QStyleOptionViewItem, index: QModelIndex) -> QSize:
+        side = self.thumbnail_size + 2 * self.margin
+        return QSize(side, side + self.bar_height)
+
+    def paint(self, painter: QPainter, option: QStyleOptionViewItem, index: QModelIndex):
+        rect = option.rect
+        painter.save()
+
+        if option.state & QStyle.StateFlag.State_Selected:
+            painter.setPen(QPen(self.colors['current'], 2))
+            painter.drawRect(rect.adjusted(1, 1, -1, -1))
+
+        pixmap = index.data(Qt.ItemDataRole.DecorationRole)
+        image_rect = QRect(rect.x() + self.margin, rect.y() + self.margin, self.thumbnail_size, self.thumbnail_size)
+        if pixmap is not None:
+            x = image_rect.x() + (image_rect.width() - pixmap.width()) // 2
+            y = image_rect.y() + (image_rect.height() - pixmap.height()) // 2
+            painter.drawPixmap(x, y, pixmap)
+        else:
+            painter.fillRect(image_rect, QColor(127, 127, 127, 40))
+
+        status = index.data(StatusRole)
+        if status == "FAILED":
+            color = self.colors['failed']
+        elif status:
+            color = self.colors['rated']
+        else:
+            color = self.colors['not_rated']
+        painter.fillRect(QRect(image_rect.x(), image_rect.bottom() + 2, image_rect.width(), self.bar_height), color)
+
+        painter.restore()
+
+
+class ThumbnailDock(QDockWidget):
+    """
+    Dock widget containing the thumbnail grid. It is laid out as a grid when docked at the side of the window and as a
+    strip when docked at the top or bottom.
+
+    :param model: The thumbnail model
+    :type model: ThumbnailModel
+    :param parent: The main window
+    :type parent: Optional[QWidget]
+    """
+    image_selected = pyqtSignal(int)
+
+    def __init__(self, model: ThumbnailModel, parent: Optional[QWidget] = None):
+        super().__init__("Thumbnails", parent)
+        self.setObjectName("ThumbnailDock")
+        self.connection_manager = ConnectionManager()
+        self.model = model
+        self.delegate = ThumbnailDelegate(model.thumbnail_size, self)
+
+        self.view = QListView(self)
+        self.view.setModel(self.model)
+        self.view.setItemDelegate(self.delegate)
+        self.view.setViewMode(QListView.ViewMode.IconMode)
+        self.view.setMovement(QListView.Movement.Static)
+        self.view.setResizeMode(QListView.ResizeMode.Adjust)
+        self.view.setWrapping(True)
+        # Uniform sizes and batched layout keep the view fast with tens of thousands of items
+        self.view.setUniformItemSizes(True)
+        self.view.setLayoutMode(QListView.LayoutMode.Batched)
+        self.view.setBatchSize(500)
+        self.view.setSelectionMode(QAbstractItemView.SelectionMode.SingleSelection)
+        self.view.setVerticalScrollMode(QAbstractItemView.ScrollMode.ScrollPerPixel)
+        self.view.setHorizontalScrollMode(QAbstractItemView.ScrollMode.ScrollPerPixel)
+        self.view.setSpacing(2)
+        self.setWidget(self.view)
+
+        self.connection_manager.connect(self.view.clicked, self.on_clicked)
+        self.connection_manager.connect(self.dockLocationChanged, self.on_dock_location_changed)
+
+    def on_clicked(self, index: QModelIndex):
+        """
+        Emit the row of the clicked thumbnail.
+
+        :param index: The index of the clicked thumbnail
+        :type index: QModelIndex
+        """
+        if index.isValid():
+            self.image_selected.emit(index.row())
+
+    def on_dock_location_changed(self, area: Qt.DockWidgetArea):
+        """
+        Lay out the thumbnails as a strip when docked at the top or bottom, otherwise as a grid.
+
+        :param area: The dock area
+        :type area: Qt.DockWidgetArea
+        """
+        if area in (Qt.DockWidgetArea.TopDockWidgetArea, Qt.DockWidgetArea.BottomDockWidgetArea):
+            self.view.setFlow(QListView.Flow.TopToBottom)
+        else:
+            self.view.setFlow(QListView.Flow.LeftToRight)
+
+    def set_current(self, row: int):
+        """
+        Select the thumbnail of the current image and scroll to it.
+
+        :param row: The row of the current image
+        :type row: int
+        """
+        index = self.model.index(row)
+        self.view.setCurrentIndex(index)
+        if self.isVisible():
+            self.view.scrollTo(index, QAbstractItemView.ScrollHint.PositionAtCenter)
+
+    def showEvent(self, event: QShowEvent):
+        super().showEvent(event)
+        self.view.scrollTo(self.view.currentIndex(), QAbstractItemView.ScrollHint.PositionAtCenter)
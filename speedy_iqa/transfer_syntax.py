@@ -0,0 +1,156 @@
+"""
+transfer_syntax.py
+
+Choice of the pydicom pixel data handler used to decode each DICOM transfer syntax.
+
+pydicom decodes compressed pixel data (e.g. JPEG Lossless, JPEG 2000 and RLE) with the first handler in
+`pydicom.config.pixel_data_handlers` which supports the transfer syntax, whichever is fastest. When more than one
+installed handler (e.g. pylibjpeg and GDCM) supports a transfer syntax, each is timed on the first file with that
+transfer syntax and the fastest working handler is used for the rest of the session. Each transfer syntax in a study of
+mixed transfer syntaxes gets its own choice. If the chosen handler fails on a file, the other handlers are tried.
+
+Classes:
+    - TransferSyntaxRouter: Chooses and caches the fastest pixel data handler for each transfer syntax.
+
+Functions:
+    - get_transfer_syntax_router() -> TransferSyntaxRouter
+"""
+
+import time
+import logging
+import threading
+from types import ModuleType
+from typing import BinaryIO, Dict, List, Optional, Union
+
+import numpy as np
+import pydicom
+import pydicom.config
+
+logger = logging.getLogger('fileLogger')
+
+
+def _handler_name(handler: ModuleType) -> str:
+    # The name pydicom's Dataset.convert_pixel_data accepts, e.g. 'gdcm_handler'
+    return handler.__name__.rsplit('.', 1)[-1]
+
+
+class TransferSyntaxRouter:
+    """
+    Chooses the fastest working pydicom pixel data handler for each transfer syntax, timing the supporting handlers on
+    the first file of each transfer syntax. Safe to use from several threads.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._chosen: Dict[str, ModuleType] = {}
+
+    @property
+    def chosen(self) -> Dict[str, str]:
+        """
+        The name of the handler chosen for each transfer syntax (UID) timed so far.
+        """
+        with self._lock:
+            return {uid: _handler_name(handler) for uid, handler in self._chosen.items()}
+
+    @staticmethod
+    def handlers_for(transfer_syntax: str) -> List[ModuleType]:
+        """
+        Get the installed pixel data handlers which support a transfer syntax, in pydicom's order of preference.
+
+        :param transfer_syntax: The transfer syntax UID
+        :type transfer_syntax: str
+        :return: The handlers
+        :rtype: List[ModuleType]
+        """
+        return [handler for handler in pydicom.config.pixel_data_handlers
+                if handler.is_available() and handler.supports_transfer_syntax(transfer_syntax)]
+
+    def pixel_array(self, ds: pydicom.Dataset, file_path: Union[str, BinaryIO]) -> np.ndarray:
+        """
+        Decode the pixel data of a dataset with the fastest handler for its transfer syntax.
+
+        :param ds: The dataset, read with its pixel data
+        :type ds: pydicom.Dataset
+        :param file_path: The path to the DICOM file (or the open file), re-read to time the handlers on the first file
+            of a transfer syntax
+        :type file_path: Union[str, BinaryIO]
+        :return: The pixel array
+        :rtype: np.ndarray
+        """
+        transfer_syntax = getattr(getattr(ds, 'file_meta', None), 'TransferSyntaxUID', None)
+        handlers = self.handlers_for(transfer_syntax) if transfer_syntax is not None else []
+        if len(handlers) < 2:
+            return ds.pixel_array
+
+        with self._lock:
+            chosen = self._chosen.get(transfer_syntax)
+            if chosen is None:
+                chosen = self._time_handlers(file_path, transfer_syntax, handlers)
+                if chosen is not None:
+                    self._chosen[transfer_syntax] = chosen
+        if chosen is not None:
+            handlers = [chosen] + [handler for handler in handlers if handler is not chosen]
+
+        first_error = None
+        for handler in handlers:
+            try:
+                ds.convert_pixel_data(handler_name=_handler_name(handler))
+                return ds.pixel_array
+            except Exception as e:
+                if first_error is None:
+                    first_error = e
+                logger.debug(f"The {_handler_name(handler)} pixel data handler failed on {file_path}: {e}")
+        raise first_error
+
+    @staticmethod
+    def _time_handlers(file_path: Union[str, BinaryIO], transfer_syntax: str,
+                       handlers: List[ModuleType]) -> Optional[ModuleType]:
+        timings = {}
+        shape = None
+        for handler in handlers:
+            # Handlers may change the dataset (e.g. its Photometric Interpretation), so each decodes a fresh copy
+            if not isinstance(file_path, str):
+                file_path.seek(0)
+            trial = pydicom.dcmread(file_path)
+            start = time.perf_counter()
+            try:
+                trial.convert_pixel_data(handler_name=_handler_name(handler))
+                image = trial.pixel_array
+            except Exception as e:
+                logger.debug(f"The {_handler_name(handler)} pixel data handler failed on {file_path}: {e}")
+                continue
+            elapsed = time.perf_counter() - start
+            if shape is None:
+                shape = image.shape
+            elif image.shape != shape:
+                logger.debug(f"The {_handler_name(handler)} pixel data handler decoded {file_path} as {image.shape}, "
+                             f"expected {shape}")
+                continue
+            timings[handler] = elapsed
+        if not timings:
+            return None
+        chosen = min(timings, key=timings.get)
+        name = getattr(transfer_syntax, 'name', transfer_syntax)
+        logger.info(f"Decoding {name} pixel data with {_handler_name(chosen)} ("
+                    + ", ".join(f"{_handler_name(h)}: {t * 1000:.1f} ms" for h, t in timings.items()) + ")")
+        return chosen
+
+    def clear(self):
+        """
+        Forget the handlers chosen so far, e.g. if the installed handlers have changed.
+        """
+        with self._lock:
+            self._chosen.clear()
+
+
+_router = TransferSyntaxRouter()
+
+
+def get_transfer_syntax_router() -> TransferSyntaxRouter:
+    """
+    Get the transfer syntax router used to decode compressed DICOM files.
+
+    :return: The shared transfer syntax router
+    :rtype: TransferSyntaxRouter
+    """
+    return _router
@@ -10,7 +10,7 @@ from PyQt6.QtGui import *
 from PyQt6.QtWidgets import *
 import yaml
 import os
-from qt_material import apply_stylesheet, get_theme
+from speedy_iqa.themes import apply_theme, theme_color
 import sys
 
 from speedy_iqa.utils import open_yml_file, setup_logging, ConnectionManager
@@ -42,20 +42,15 @@ class AdvancedSettingsDialog(QDialog):
         self.backup_dir = os.path.normpath(self.wiz.backup_dir)
         self.backup_interval = self.wiz.backup_interval
         self.max_backups = self.wiz.max_backups
+        self.session_format = self.wiz.session_format
+        self.cache_dir = os.path.normpath(self.wiz.cache_dir)
+        self.cache_max_size = self.wiz.cache_max_size
         self.setWindowTitle("Advanced Settings")
 
-        try:
-            self.entry_colour = get_theme(self.settings.value('theme', 'dark_blue.xml'))['secondaryTextColor']
-        except KeyError:
-            self.entry_colour = get_theme(self.settings.value('theme', 'dark_blue.xml'))['secondaryLightColor']
-        try:
-            self.disabled_colour = get_theme(self.settings.value('theme', 'dark_blue.xml'))['secondaryLightColor']
-        except KeyError:
-            self.disabled_colour = get_theme(self.settings.value('theme', 'dark_blue.xml'))['primaryLightColor']
-        try:
-            self.border_color = get_theme(self.settings.value("theme", 'dark_blue.xml'))['secondaryLightColor']
-        except KeyError:
-            self.border_color = get_theme(self.settings.value("theme", 'dark_blue.xml'))['secondaryColor']
+        theme = self.settings.value('theme', 'dark_blue.xml')
+        self.entry_colour = theme_color(theme, 'secondaryTextColor', 'secondaryLightColor')
+        self.disabled_colour = theme_color(theme, 'secondaryLightColor', 'primaryLightColor')
+        self.border_color = theme_color(theme, 'secondaryLightColor', 'secondaryColor')
 
         self.setStyleSheet(f"""
             QLineEdit {{
@@ -181,17 +176,62 @@ class AdvancedSettingsDialog(QDialog):
         backup_int_layout.addStretch()
         self.backup_layout.addLayout(backup_int_layout)
 
+        # Create a widget for the format of the saved progress and backup files
+        session_format_layout = QHBoxLayout()
+        self.session_format_combobox = QComboBox()
+        self.session_format_combobox.addItems(["json", "parquet"])
+        self.session_format_combobox.setCurrentText(self.session_format)
+
+        session_format_layout.addWidget(QLabel("Save file format:"))
+        session_format_layout.addWidget(self.session_format_combobox)
+        session_format_layout.addStretch()
+        self.backup_layout.addLayout(session_format_layout)
+
         backup_frame.setLayout(self.backup_layout)
         self.layout.addWidget(backup_frame)
         self.layout.addStretch()
 
+        cache_frame = QFrame()
+        cache_frame.setObjectName("CacheFrame")
+        cache_frame.setStyleSheet(f"#CacheFrame {{ border: 2px solid {self.border_color}; border-radius: 5px; }}")
+        self.cache_layout = QVBoxLayout()
+
+        # Create a widget for the image cache directory
+        self.cache_title = QLabel("Image Cache Settings:")
+        self.cache_title.setStyleSheet("font-weight: bold;")
+        self.cache_layout.addWidget(self.cache_title)
+
+        cache_dir_layout = QHBoxLayout()
+        cache_dir_label = QLabel("Cache directory:")
+        self.cache_dir_edit = QLineEdit()
+        self.cache_dir_edit.setText(os.path.normpath(os.path.expanduser(self.cache_dir)))
+        cache_dir_layout.addWidget(cache_dir_label)
+        cache_dir_layout.addWidget(self.cache_dir_edit)
+        self.cache_layout.addLayout(cache_dir_layout)
+
+        # Create a widget for the maximum size of the cache, 0 disables the cache
+        cache_size_layout = QHBoxLayout()
+        self.cache_size_spinbox = QSpinBox()
+        self.cache_size_spinbox.setRange(0, 1024 * 1024)
+        self.cache_size_spinbox.setSingleStep(256)
+        self.cache_size_spinbox.setValue(self.cache_max_size)
+
+        cache_size_layout.addWidget(QLabel("Maximum cache size (MB):"))
+        cache_size_layout.addWidget(self.cache_size_spinbox)
+        cache_size_layout.addStretch()
+        self.cache_layout.addLayout(cache_size_layout)
+
+        cache_frame.setLayout(self.cache_layout)
+        self.layout.addWidget(cache_frame)
+        self.layout.addStretch()
+
         # Add a "Back" button
         back_button = QPushButton("Back")
         self.connection_manager.connect(back_button.clicked, self.close)
         self.layout.addWidget(back_button)
 
         self.setLayout(self.layout)
-        self.setMinimumSize(400, 520)
+        self.setMinimumSize(400, 640)
 
         QTimer.singleShot(0, self.update_config_combobox_state)
 
@@ -224,6 +264,9 @@ class AdvancedSettingsDialog(QDialog):
         self.wiz.backup_dir = os.path.normpath(self.backup_dir_edit.text())
         self.wiz.backup_interval = self.backup_int_spinbox.value()
         self.wiz.max_backups = self.backup_spinbox.value()
+        self.wiz.session_format = self.session_format_combobox.currentText()
+        self.wiz.cache_dir = os.path.normpath(self.cache_dir_edit.text())
+        self.wiz.cache_max_size = self.cache_size_spinbox.value()
         super().close()
 
 
@@ -293,10 +336,9 @@ class UnifiedOptionsPage(QWizardPage):
                 self.radio_layouts[i] = QVBoxLayout()
                 frame = QFrame()
                 frame.setObjectName("RadioPageFrame")
-                try:
-                    border_color = get_theme(self.settings.value("theme", 'dark_blue.xml'))['secondaryLightColor']
-                except KeyError:
-                    border_color = get_theme(self.settings.value("theme", 'dark_blue.xml'))['secondaryColor']
+                border_color = theme_color(
+                    self.settings.value("theme", 'dark_blue.xml'), 'secondaryLightColor', 'secondaryColor'
+                )
                 frame.setStyleSheet(f"#RadioPageFrame {{ border: 2px solid {border_color}; border-radius: 5px; }}")
 
                 page_title_layout = QVBoxLayout()
@@ -432,13 +474,13 @@ class ConfigurationWizard(QWizard):
 
         self.setStyleSheet(f"""
             QLineEdit {{
-                color: {get_theme(self.settings.value('theme', 'dark_blue.xml'))['secondaryTextColor']};
+                color: {theme_color(self.settings.value('theme', 'dark_blue.xml'), 'secondaryTextColor')};
             }}
             QSpinBox {{
-                color: {get_theme(self.settings.value('theme', 'dark_blue.xml'))['secondaryTextColor']};
+                color: {theme_color(self.settings.value('theme', 'dark_blue.xml'), 'secondaryTextColor')};
             }}
             QComboBox {{
-                color: {get_theme(self.settings.value('theme', 'dark_blue.xml'))['secondaryTextColor']};
+                color: {theme_color(self.settings.value('theme', 'dark_blue.xml'), 'secondaryTextColor')};
             }}
         """)
 
@@ -478,6 +520,11 @@ class ConfigurationWizard(QWizard):
         self.log_dir = os.path.normpath(
             self.config_data.get('log_dir', os.path.normpath(os.path.expanduser('~/speedy_iqa/logs')))
         )
+        self.session_format = self.config_data.get('session_format', 'json')
+        self.cache_dir = os.path.normpath(
+            self.config_data.get('cache_dir', os.path.normpath(os.path.expanduser('~/speedy_iqa/cache')))
+        )
+        self.cache_max_size = self.config_data.get('cache_max_size', 2048)
         self.task = self.settings.value("task", self.config_data.get('task', 'General use'))
 
         self.main_page = self.create_unified_page()
@@ -532,6 +579,9 @@ class ConfigurationWizard(QWizard):
         self.config_data['backup_dir'] = os.path.normpath(os.path.abspath(self.backup_dir))
         self.config_data['max_backups'] = self.max_backups
         self.config_data['backup_interval'] = self.backup_interval
+        self.config_data['session_format'] = self.session_format
+        self.config_data['cache_dir'] = os.path.normpath(os.path.abspath(os.path.expanduser(self.cache_dir)))
+        self.config_data['cache_max_size'] = self.cache_max_size
 
         if not self.config_filename.endswith('.yml'):
             self.config_filename += '.yml'
@@ -558,7 +608,7 @@ class ConfigurationWizard(QWizard):
 if __name__ == '__main__':
     # Create the application and apply the qt material stylesheet
     app = QApplication([])
-    apply_stylesheet(app, theme='dark_blue.xml')
+    apply_theme(app, 'dark_blue.xml')
 
     # Set the directory of the main.py file as the default directory for the config files
     default_dir = resource_dir
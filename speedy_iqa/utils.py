@@ -20,18 +20,38 @@ Functions:
     setup_logging(log_out_path: str) -> Tuple[logging.Logger, logging.Logger]
     bytescale(data: np.ndarray, cmin: int = None, cmax: int = None, high: int = 255, low: int = 0) -> np.ndarray
     convert_to_checkstate(value: Any) -> Qt.CheckState
+    split_image_key(key: str) -> Tuple[str, Optional[str]]
+    join_image_key(path: str, member: Optional[str]) -> str
+    image_extension(path: str) -> str
+    find_reference_path(image_key: str, reference_dir: str, delimiter: str) -> str
+    iter_relative_image_paths(base_path: str, extensions: Collection[str], expand: Optional[Callable],
+        mtimes: Optional[Dict[str, float]]) -> Iterator[str]
+    find_relative_image_path(base_path: str, extensions: Collection[str], expand: Optional[Callable]) -> List[str]
+    get_image_index(base_path: str, extensions: Collection[str], refresh: bool = False, expand: Optional[Callable])
+        -> FrozenSet[str]
+    compare_filenames_to_index(filenames: Collection[str], index: Collection[str]) -> Tuple[Set[str], Set[str]]
+    remap_to_8bit(array: np.ndarray, out: Optional[np.ndarray], pool: Optional[BufferPool]) -> np.ndarray
+    supports_lut(dtype: np.dtype) -> bool
+    integer_lut_domain(dtype: np.dtype) -> np.ndarray
+    apply_lut(array: np.ndarray, lut: np.ndarray, out: Optional[np.ndarray]) -> np.ndarray
+    array_to_qimage(array: np.ndarray, normalize: bool = False) -> QImage
+    remap_range_to_8bit(work: np.ndarray, low: float, high: float, out: np.ndarray) -> np.ndarray
 """
 
 # import logging.config
 import yaml
 import os
-from typing import Dict, Union, Any, Optional, Tuple, List, Collection
+from typing import Dict, Union, Any, Optional, Tuple, List, Collection, FrozenSet, Set, Callable, Iterator
 from PyQt6.QtCore import *
+from PyQt6.QtGui import QImage
+from qimage2ndarray import array2qimage
 import numpy as np
 from PIL import Image
-import glob
 import pandas as pd
+from speedy_iqa.buffers import BufferPool, get_buffer_pool
+from speedy_iqa.storage import get_storage, is_file
 import logging
+from functools import lru_cache
 from logging import FileHandler, StreamHandler
 import sys
 
@@ -115,6 +135,24 @@ def create_default_config() -> Dict:
         'log_dir': os.path.normpath(os.path.expanduser('~/speedy_iqa/logs')),
         # 'tristate_checkboxes': True,
         'backup_interval': 5,
+        'session_format': 'json',
+        'cache_dir': os.path.normpath(os.path.expanduser('~/speedy_iqa/cache')),
+        'cache_max_size': 2048,
+        'decode_backend': 'thread',
+        'decode_workers': 2,
+        'staging_dir': os.path.normpath(os.path.expanduser('~/speedy_iqa/staging')),
+        'staging_max_size': 0,
+        'staging_ahead': 10,
+        'ordering': 'random',
+        'ordering_seed': 4,
+        'ordering_max_gap': 8,
+        'watch_folder': False,
+        'watch_poll_interval': 0,
+        'preflight': False,
+        'preflight_mode': 'decode',
+        'preflight_workers': 0,
+        'profiling': False,
+        'latency_threshold_ms': 0,
         'task': 'General use',
     }
 
@@ -264,38 +302,205 @@ def create_icns(
     icon_sizes[0].save(f'{icns_path}.icns', format='ICNS', append_images=icon_sizes[1:])
 
 
-def find_relative_image_path(
+IMAGE_EXTENSIONS = ('png', 'jpg', 'jpeg', 'gif', 'bmp', 'tiff', 'tif', 'dcm', 'dicom',)
+
+# Separates the path of a file holding many images (e.g. a .npy stack) from the image within it, e.g. 'stack.npy::12'
+IMAGE_KEY_SEPARATOR = '::'
+
+
+def split_image_key(key: str) -> Tuple[str, Optional[str]]:
+    """
+    Split an image key into the path of the file and the image within it, if the file holds many images.
+
+    :param key: The image key, e.g. 'stack.npy::12' or 'image.png'
+    :return: The path of the file and the image within it (None if the file holds a single image), e.g.
+        ('stack.npy', '12') or ('image.png', None)
+    """
+    path, separator, member = key.partition(IMAGE_KEY_SEPARATOR)
+    return (path, member) if separator else (path, None)
+
+
+def join_image_key(path: str, member: Optional[str]) -> str:
+    """
+    Join the path of a file and an image within it into an image key. See `split_image_key`.
+
+    :param path: The path of the file.
+    :param member: The image within the file, or None if the file holds a single image.
+    :return: The image key.
+    """
+    return path if member is None else f"{path}{IMAGE_KEY_SEPARATOR}{member}"
+
+
+def image_extension(path: str) -> str:
+    """
+    Get the extension of an image file, including the extension of compressed files, e.g. '.nii.gz'.
+
+    :param path: The path of the file, or an image key.
+    :return: The extension, with the leading dot.
+    """
+    root, extension = os.path.splitext(split_image_key(path)[0])
+    if extension.lower() == '.gz':
+        extension = os.path.splitext(root)[1] + extension
+    return extension
+
+
+def find_reference_path(image_key: str, reference_dir: str, delimiter: str) -> str:
+    """
+    Find the reference image of an image from its name: the part of the name before the delimiter or, if there is no
+    delimiter, the name without its extension (the extension is added back if the reference file has it). Images
+    within a file holding many images are paired with the same image within the reference file.
+
+    :param image_key: The relative path or image key of the image, e.g. 'image_1__preprocessed.png'.
+    :param reference_dir: The directory containing the reference images.
+    :param delimiter: The delimiter separating the reference name from the rest of the image name, e.g. '__'.
+    :return: The path or image key of the reference image, e.g. '<reference_dir>/image_1.png'.
+    """
+    file_name, member = split_image_key(image_key)
+    extension = image_extension(file_name)
+    if delimiter:
+        reference_name = file_name.rsplit(delimiter, 1)[0]
+    else:
+        reference_name = file_name[:len(file_name) - len(extension)]
+    reference_name = os.path.basename(reference_name)
+    if not reference_name.endswith(extension) and is_file(
+            os.path.join(reference_dir, reference_name + extension)
+    ):
+        reference_name = reference_name + extension
+    return join_image_key(os.path.join(reference_dir, reference_name), member)
+
+
+def iter_relative_image_paths(
         base_path: str,
-        extensions: Collection[str] = ('png', 'jpg', 'jpeg', 'gif', 'bmp', 'tiff', 'tif', 'dcm', 'dicom',)
-) -> List[str]:
+        extensions: Collection[str] = IMAGE_EXTENSIONS,
+        expand: Optional[Callable[[str], Optional[List[str]]]] = None,
+        mtimes: Optional[Dict[str, float]] = None
+) -> Iterator[str]:
     """
-    Recursively find all image files in a given directory and return their relative paths.
+    Recursively find all image files in a given directory or archive (see `speedy_iqa.storage`), giving their relative
+    paths as they are found, so the first images can be used before the whole tree has been walked. The directory tree
+    is walked once for all extensions, which are matched case-insensitively (e.g. '.DCM' files are found). As with
+    glob, hidden files and directories are skipped.
 
-    :param base_path: The path to the directory to search.
+    :param base_path: The path to the directory or archive to search.
     :param extensions: A list of file extensions to consider as image files. Default is ['png', 'jpg', 'jpeg', 'gif',
         'bmp', 'tiff', 'tif', 'dcm', 'dicom',].
+    :param expand: Optional function returning the images within a file, given its path, or None if the file holds a
+        single image (see `speedy_iqa.decoders.image_members`). Files holding many images are listed as one image
+        key per image (see `join_image_key`).
+    :param mtimes: Optional dictionary to fill with the modification times of the directories walked, see
+        `speedy_iqa.storage.Storage.iter_files`.
+    :return: The relative paths pointing to the image files, in the order they are found.
+    """
+    suffixes = tuple(f".{extension}" for extension in extensions)
+    for relative_path in get_storage(base_path).iter_files(mtimes):
+        if relative_path.lower().endswith(suffixes):
+            members = expand(os.path.join(base_path, relative_path)) if expand is not None else None
+            if members is None:
+                yield relative_path
+            else:
+                yield from (join_image_key(relative_path, member) for member in members)
+
+
+def find_relative_image_path(
+        base_path: str,
+        extensions: Collection[str] = IMAGE_EXTENSIONS,
+        expand: Optional[Callable[[str], Optional[List[str]]]] = None
+) -> List[str]:
+    """
+    Recursively find all image files in a given directory or archive and return their relative paths, see
+    `iter_relative_image_paths`.
+
+    :param base_path: The path to the directory or archive to search.
+    :param extensions: A list of file extensions to consider as image files.
+    :param expand: Optional function returning the images within a file, given its path.
     :return: A list of relative paths pointing to the image files.
     """
-    all_images = []
-    for extension in extensions:
-        for image_path in glob.glob(f"{base_path}/**/*.{extension}", recursive=True):
-            relative_path = os.path.relpath(image_path, start=base_path)
-            all_images.append(relative_path)
+    return list(iter_relative_image_paths(base_path, extensions, expand))
+
 
-    return all_images
+# Recursive image indexes keyed by (directory, extensions, expand), stored with the mtimes of the scanned directories
+_image_index_cache: Dict[Tuple[str, Tuple[str, ...], Optional[Callable]], Tuple[Dict[str, float], FrozenSet[str]]] = {}
+
+
+def _directories_unchanged(mtimes: Dict[str, float]) -> bool:
+    # Adding or removing a file or subdirectory changes the modification time of the directory holding it
+    for path, mtime in mtimes.items():
+        try:
+            if os.stat(path).st_mtime != mtime:
+                return False
+        except OSError:
+            return False
+    return True
+
+
+def get_image_index(
+        base_path: str,
+        extensions: Collection[str] = IMAGE_EXTENSIONS,
+        refresh: bool = False,
+        expand: Optional[Callable[[str], Optional[List[str]]]] = None
+) -> FrozenSet[str]:
+    """
+    Get the set of relative image paths in a directory (recursively), as found by `find_relative_image_path`. The
+    result is cached, so the setup window and session creation share a single scan of the directory. The directory
+    is scanned again if `refresh` is True or if the modification time of any directory in the tree (or of the
+    archive) has changed, so that files added to or removed from nested subdirectories are found.
+
+    :param base_path: The path to the directory to search.
+    :type base_path: str
+    :param extensions: A list of file extensions to consider as image files.
+    :type extensions: Collection[str]
+    :param refresh: Whether to force a new scan of the directory.
+    :type refresh: bool
+    :param expand: Optional function listing the images within files holding many images, see
+        `find_relative_image_path`.
+    :type expand: Optional[Callable[[str], Optional[List[str]]]]
+    :return: The relative paths of the image files.
+    :rtype: FrozenSet[str]
+    """
+    key = (os.path.normpath(os.path.abspath(base_path)), tuple(extensions), expand)
+    cached = _image_index_cache.get(key)
+    if not refresh and cached is not None and _directories_unchanged(cached[0]):
+        return cached[1]
+
+    # Each directory's mtime is taken before it is listed, so that changes made during the scan are found next time
+    mtimes = {}
+    index = frozenset(iter_relative_image_paths(key[0], extensions, expand, mtimes))
+    _image_index_cache[key] = (mtimes, index)
+    return index
+
+
+def compare_filenames_to_index(filenames: Collection[str], index: Collection[str]) -> Tuple[Set[str], Set[str]]:
+    """
+    Compare the filenames in a session with the image files found in the image directory.
+
+    :param filenames: The relative image paths in the session.
+    :type filenames: Collection[str]
+    :param index: The relative image paths in the image directory, e.g. from `get_image_index`.
+    :type index: Collection[str]
+    :return: The files in the session which are missing from the directory and the files in the directory which are
+        not in the session.
+    :rtype: Tuple[Set[str], Set[str]]
+    """
+    filenames = {os.path.normpath(filename) for filename in filenames}
+    missing = filenames.difference(index)
+    extra = set(index).difference(filenames)
+    return missing, extra
 
 
 def invert_grayscale(image):
     return np.max(image) + np.min(image) - image
 
 
-def remap_to_8bit(array: np.ndarray) -> np.ndarray:
+def remap_to_8bit(array: np.ndarray, out: Optional[np.ndarray] = None,
+                  pool: Optional[BufferPool] = None) -> np.ndarray:
     """
     Remaps an image array to 8-bit (0-255), handling integers (signed/unsigned) and floats.
     Uses the full theoretical range of the dtype for scaling, avoiding normalization
     based on array values.
 
     :param array: Input image as a NumPy array.
+    :param out: Optional preallocated uint8 array, of the same shape as the input, to write the output to.
+    :param pool: The buffer pool to borrow the intermediate array from. Defaults to the shared pool.
     :return: 8-bit remapped image as a NumPy array.
     """
     if np.issubdtype(array.dtype, np.integer):
@@ -309,11 +514,123 @@ def remap_to_8bit(array: np.ndarray) -> np.ndarray:
     else:
         raise ValueError("Array must be of integer or float type.")
 
+    if out is None:
+        out = np.empty(array.shape, dtype=np.uint8)
+    if array.dtype == np.uint8:
+        np.copyto(out, array)
+        return out
+    if supports_lut(array.dtype):
+        return apply_lut(array, _dtype_range_lut(array.dtype.str), out)
+
     # Scale using the full dtype range
-    scale_factor = 255 / (max_value - min_value)
-    remapped_image = ((array - min_value) * scale_factor).clip(0, 255).astype(np.uint8)
+    with np.errstate(over='ignore'):
+        scale_factor = 255 / (max_value - min_value)
+    # Float arrays are scaled at their own precision, integer arrays in float64
+    work_dtype = array.dtype if np.issubdtype(array.dtype, np.floating) else np.float64
+    with (pool or get_buffer_pool()).borrow(array.shape, work_dtype) as work:
+        np.subtract(array, min_value, out=work)
+        _scale_to_8bit(work, scale_factor, out)
+    return out
+
+
+# The number of pixels mapped at a time by apply_lut
+_LUT_CHUNK_SIZE = 1 << 16
+
+
+@lru_cache(maxsize=None)
+def _dtype_range_lut(dtype_str: str) -> np.ndarray:
+    # The look-up table of remap_to_8bit for an integer dtype, computed exactly as remap_to_8bit does for arrays
+    dtype = np.dtype(dtype_str)
+    info = np.iinfo(dtype)
+    domain = integer_lut_domain(dtype)
+    domain -= info.min
+    return _scale_to_8bit(domain, 255 / (info.max - info.min), np.empty(domain.shape, dtype=np.uint8))
+
+
+def supports_lut(dtype: np.dtype) -> bool:
+    """
+    Checks whether an array of a dtype can be mapped with a look-up table indexed by its values, i.e. whether it is an
+    integer dtype of at most 16 bits in native byte order.
+
+    :param dtype: The dtype of the array.
+    :return: Whether a look-up table can be used.
+    """
+    dtype = np.dtype(dtype)
+    return np.issubdtype(dtype, np.integer) and dtype.itemsize <= 2 and dtype.isnative
+
+
+def integer_lut_domain(dtype: np.dtype) -> np.ndarray:
+    """
+    Gets every value of an integer dtype of at most 16 bits as float64, ordered by the unsigned integer with the same
+    bits, so that a look-up table computed from it can be indexed by the unsigned view of an array (see `apply_lut`).
+
+    :param dtype: The integer dtype.
+    :return: The values, e.g. 0 to 65535 for uint16, or 0 to 32767 then -32768 to -1 for int16.
+    """
+    dtype = np.dtype(dtype)
+    unsigned = np.dtype(f"u{dtype.itemsize}")
+    return np.arange(2 ** (8 * dtype.itemsize), dtype=unsigned).view(dtype).astype(np.float64)
+
+
+def apply_lut(array: np.ndarray, lut: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Maps an integer array of at most 16 bits through a look-up table computed from `integer_lut_domain`, with a
+    single `np.take`.
+
+    :param array: The integer array.
+    :param lut: The look-up table, with an entry for every value of the dtype of the array.
+    :param out: Optional preallocated array, of the same shape as the input and dtype as the table, for the output.
+    :return: The mapped array.
+    """
+    indices = array.view(f"u{array.dtype.itemsize}")
+    if out is None:
+        out = np.empty(array.shape, dtype=lut.dtype)
+    if not (indices.flags.c_contiguous and out.flags.c_contiguous):
+        return np.take(lut, indices, out=out)
+    # np.take converts the indices to intp, so map in chunks to avoid a full-size int64 copy of the indices
+    flat_indices, flat_out = indices.reshape(-1), out.reshape(-1)
+    for start in range(0, flat_indices.size, _LUT_CHUNK_SIZE):
+        stop = start + _LUT_CHUNK_SIZE
+        np.take(lut, flat_indices[start:stop], out=flat_out[start:stop])
+    return out
+
+
+def array_to_qimage(array: np.ndarray, normalize: bool = False) -> QImage:
+    """
+    Converts an image array to a QImage. Contiguous 8-bit greyscale arrays are wrapped without being copied, so the
+    QImage is only valid while the array is alive (e.g. pass it straight to `QPixmap.fromImage`, which copies it).
+    Other arrays are converted with `qimage2ndarray.array2qimage`.
+
+    :param array: The image array.
+    :param normalize: Whether to normalise the image, see `qimage2ndarray.array2qimage`.
+    :return: The QImage.
+    """
+    if normalize or array.dtype != np.uint8 or array.ndim != 2 or not array.flags.c_contiguous:
+        return array2qimage(array, normalize=normalize)
+    height, width = array.shape
+    return QImage(array.data, width, height, array.strides[0], QImage.Format.Format_Grayscale8)
+
+
+def remap_range_to_8bit(work: np.ndarray, low: float, high: float, out: np.ndarray) -> np.ndarray:
+    """
+    Remaps a float64 array from the range [low, high] to 8-bit (0-255), clipping values outside of the range. The
+    input array is used as scratch space and overwritten.
+
+    :param work: The float64 image, which is overwritten.
+    :param low: The value mapped to 0.
+    :param high: The value mapped to 255.
+    :param out: The uint8 array to write the output to.
+    :return: The output array.
+    """
+    work -= low
+    return _scale_to_8bit(work, 255 / (high - low) if high > low else 0, out)
+
 
-    return remapped_image
+def _scale_to_8bit(work: np.ndarray, scale_factor: float, out: np.ndarray) -> np.ndarray:
+    work *= scale_factor
+    np.clip(work, 0, 255, out=work)
+    np.copyto(out, work, casting='unsafe')
+    return out
 
 
 def expand_dict_column(df, column_name):
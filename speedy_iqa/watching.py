@@ -0,0 +1,262 @@
+"""
+watching.py
+
+Watches the image directory of a session for images which arrive (or are removed) while the images are being read, so
+that they can be added to the session without restarting it and finding every image again.
+
+Changes are picked up with file system notifications (QFileSystemWatcher, which uses inotify on Linux) on the
+directories holding the images of the session and their parents, or by checking the modification times of those
+directories at an interval, e.g. on network shares, where changes made by other machines are not notified. Only the
+directories which have changed are listed again, so picking up new images takes time in proportion to the changed
+directories, not the whole image directory. A new image is only added once its file has stopped changing and its
+reference image exists.
+
+Classes:
+    - FolderWatcher: Watches the image directory for images being added or removed.
+"""
+
+import os
+import time
+import logging
+from typing import Callable, Collection, Dict, Iterable, List, Optional, Set
+
+from PyQt6.QtCore import QObject, QTimer, QFileSystemWatcher, pyqtSignal
+
+from speedy_iqa.storage import is_file
+from speedy_iqa.utils import ConnectionManager, find_reference_path, split_image_key, join_image_key
+
+logger = logging.getLogger('fileLogger')
+
+DEFAULT_POLL_INTERVAL = 10
+DEFAULT_SETTLE_TIME = 2
+# Time to wait after a change notification, so that a burst of changes is handled at once
+_DEBOUNCE_MS = 500
+
+
+class FolderWatcher(QObject):
+    """
+    Watches the image directory of a session for images being added or removed. `images_added` is emitted with the
+    image keys of new images, once their files have stopped changing and their reference images exist, and
+    `images_removed` with the image keys of images whose files have been removed.
+
+    :param dir_path: The directory containing the images
+    :type dir_path: str
+    :param reference_dir: The directory containing the reference images
+    :type reference_dir: str
+    :param delimiter: The delimiter separating the reference name from the rest of the image name
+    :type delimiter: str
+    :param extensions: The file extensions of the images
+    :type extensions: Collection[str]
+    :param known_images: The image keys (relative to `dir_path`) of the images already in the session
+    :type known_images: Iterable[str]
+    :param expand: Optional function listing the images within files holding many images, see
+        `speedy_iqa.utils.iter_relative_image_paths`
+    :type expand: Optional[Callable[[str], Optional[List[str]]]]
+    :param poll_interval: The interval in seconds at which to check the directories for changes, or 0 to use file
+        system notifications (polling only the directories which cannot be watched)
+    :type poll_interval: float
+    :param settle_time: The time in seconds a new file must be left unchanged before it is added
+    :type settle_time: float
+    """
+    images_added = pyqtSignal(list)
+    images_removed = pyqtSignal(list)
+
+    def __init__(self, dir_path: str, reference_dir: str, delimiter: str, extensions: Collection[str],
+                 known_images: Iterable[str], expand: Optional[Callable[[str], Optional[List[str]]]] = None,
+                 poll_interval: float = 0, settle_time: float = DEFAULT_SETTLE_TIME, parent: Optional[QObject] = None):
+        super().__init__(parent)
+        self.connection_manager = ConnectionManager()
+        self.dir_path = os.path.normpath(os.path.abspath(dir_path))
+        self.reference_dir = reference_dir
+        self.delimiter = delimiter
+        self.suffixes = tuple(f".{extension}" for extension in extensions)
+        self.expand = expand
+        self.settle_time = settle_time
+
+        # Image keys of each directory, keyed by the directory relative to `dir_path` ('' for `dir_path` itself)
+        self._images: Dict[str, Set[str]] = {'': set()}
+        for image_key in known_images:
+            relative_dir = os.path.dirname(split_image_key(image_key)[0])
+            self._images.setdefault(relative_dir, set()).add(image_key)
+            # Watch the parent directories too, so that new subdirectories are noticed
+            while relative_dir:
+                relative_dir = os.path.dirname(relative_dir)
+                self._images.setdefault(relative_dir, set())
+        self._mtimes: Dict[str, float] = {}
+        self._changed: Set[str] = set()
+        self._settling: Set[str] = set()
+        self._unpaired: Set[str] = set()
+
+        self._scan_timer = QTimer(self)
+        self._scan_timer.setSingleShot(True)
+        self.connection_manager.connect(self._scan_timer.timeout, self.scan_changed)
+
+        self._watcher = None
+        if poll_interval <= 0:
+            self._watcher = QFileSystemWatcher(self)
+            self.connection_manager.connect(self._watcher.directoryChanged, self.on_directory_changed)
+        self._polled: Set[str] = set()
+        self._poll_timer = QTimer(self)
+        self._poll_timer.setInterval(int(1000 * (poll_interval if poll_interval > 0 else DEFAULT_POLL_INTERVAL)))
+        self.connection_manager.connect(self._poll_timer.timeout, self.poll)
+        self._watch(list(self._images))
+
+    @property
+    def pending(self) -> int:
+        """
+        The number of new images waiting for their files to stop changing or for their reference images.
+        """
+        return len(self._settling) + len(self._unpaired)
+
+    def stop(self):
+        """
+        Stop watching the image directory.
+        """
+        self._scan_timer.stop()
+        self._poll_timer.stop()
+        if self._watcher is not None and self._watcher.directories():
+            self._watcher.removePaths(self._watcher.directories())
+        self.connection_manager.disconnect_all()
+
+    def on_directory_changed(self, path: str):
+        """
+        Queue a directory to be listed again, after a short delay so that a burst of changes is handled at once.
+
+        :param path: The absolute path of the directory
+        :type path: str
+        """
+        self._changed.add(self._relative(path))
+        if not self._scan_timer.isActive():
+            self._scan_timer.start(_DEBOUNCE_MS)
+
+    def poll(self):
+        """
+        Check the modification times of the polled directories, listing those which have changed again.
+        """
+        for relative_dir in list(self._polled):
+            try:
+                mtime = os.stat(os.path.join(self.dir_path, relative_dir)).st_mtime
+            except OSError:
+                mtime = None
+            if mtime != self._mtimes.get(relative_dir):
+                self._changed.add(relative_dir)
+        if self._changed or self._settling or self._unpaired:
+            self.scan_changed()
+
+    def scan_changed(self):
+        """
+        List the directories which have changed again, and emit the images which have been added or removed.
+        """
+        changed, self._changed = self._changed, set()
+        added, removed = [], []
+        for relative_dir in sorted(changed):
+            if relative_dir in self._images:
+                removed += self._scan_directory(relative_dir)
+        added += self._take_ready()
+        if removed:
+            self.images_removed.emit(sorted(removed))
+        if added:
+            self.images_added.emit(sorted(added))
+        if (self._settling or self._unpaired) and not self._scan_timer.isActive():
+            self._scan_timer.start(int(1000 * self.settle_time))
+
+    def _relative(self, path: str) -> str:
+        relative_dir = os.path.normpath(os.path.relpath(path, self.dir_path))
+        return '' if relative_dir == os.curdir else relative_dir
+
+    def _watch(self, relative_dirs: List[str]):
+        for relative_dir in relative_dirs:
+            try:
+                self._mtimes[relative_dir] = os.stat(os.path.join(self.dir_path, relative_dir)).st_mtime
+            except OSError:
+                self._mtimes[relative_dir] = None
+        if self._watcher is not None:
+            failed = self._watcher.addPaths([os.path.join(self.dir_path, d) for d in relative_dirs])
+            if failed:
+                logger.warning(f"Failed to watch {len(failed)} directories for new images, checking them every "
+                               f"{self._poll_timer.interval() // 1000} seconds instead.")
+                self._polled.update(self._relative(path) for path in failed)
+        else:
+            self._polled.update(relative_dirs)
+        if self._polled and not self._poll_timer.isActive():
+            self._poll_timer.start()
+
+    def _forget(self, relative_dir: str) -> List[str]:
+        # Stop watching a removed directory and its subdirectories, returning their images
+        removed = []
+        prefix = relative_dir + os.sep if relative_dir else ''
+        for directory in [d for d in self._images if d == relative_dir or d.startswith(prefix)]:
+            removed += self._images.pop(directory)
+            self._mtimes.pop(directory, None)
+            self._polled.discard(directory)
+            if self._watcher is not None:
+                self._watcher.removePath(os.path.join(self.dir_path, directory))
+        self._settling = {f for f in self._settling if not f.startswith(prefix)}
+        self._unpaired = {k for k in self._unpaired if not k.startswith(prefix)}
+        return removed
+
+    def _scan_directory(self, relative_dir: str) -> List[str]:
+        # List a directory again, queueing its new files and any new subdirectories, and returning its removed images
+        path = os.path.join(self.dir_path, relative_dir)
+        try:
+            self._mtimes[relative_dir] = os.stat(path).st_mtime
+            entries = list(os.scandir(path))
+        except OSError:
+            return self._forget(relative_dir) if relative_dir else []
+
+        files = set()
+        new_dirs = []
+        for entry in entries:
+            if entry.name.startswith('.'):
+                continue
+            relative_path = os.path.normpath(os.path.join(relative_dir, entry.name))
+            try:
+                if entry.is_dir():
+                    if relative_path not in self._images:
+                        new_dirs.append(relative_path)
+                elif entry.name.lower().endswith(self.suffixes):
+                    files.add(relative_path)
+            except OSError:
+                continue
+
+        removed = [key for key in self._images[relative_dir] if split_image_key(key)[0] not in files]
+        self._images[relative_dir].difference_update(removed)
+        self._settling = {f for f in self._settling if os.path.dirname(f) != relative_dir or f in files}
+        self._unpaired = {key for key in self._unpaired if split_image_key(key)[0] in files
+                          or os.path.dirname(split_image_key(key)[0]) != relative_dir}
+        known_files = {split_image_key(key)[0] for key in self._images[relative_dir] | self._unpaired}
+        self._settling.update(files - known_files)
+
+        for new_dir in new_dirs:
+            self._images[new_dir] = set()
+            self._watch([new_dir])
+            removed += self._scan_directory(new_dir)
+        return removed
+
+    def _take_ready(self) -> List[str]:
+        # Expand the new files which have stopped changing, and take the images whose reference images exist
+        now = time.time()
+        for relative_path in list(self._settling):
+            path = os.path.join(self.dir_path, relative_path)
+            try:
+                if now - os.stat(path).st_mtime < self.settle_time:
+                    continue
+                members = self.expand(path) if self.expand is not None else None
+            except Exception as e:
+                logger.debug(f"New image {path} is not ready: {e}")
+                continue
+            self._settling.discard(relative_path)
+            if members is None:
+                self._unpaired.add(relative_path)
+            else:
+                self._unpaired.update(join_image_key(relative_path, member) for member in members)
+
+        ready = []
+        for image_key in sorted(self._unpaired):
+            reference_path = find_reference_path(image_key, self.reference_dir, self.delimiter)
+            if is_file(split_image_key(reference_path)[0]):
+                ready.append(image_key)
+        for image_key in ready:
+            self._unpaired.discard(image_key)
+            self._images.setdefault(os.path.dirname(split_image_key(image_key)[0]), set()).add(image_key)
+        return ready
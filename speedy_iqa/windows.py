@@ -20,12 +20,16 @@ import os
 from PyQt6.QtCore import *
 from PyQt6.QtGui import *
 from PyQt6.QtWidgets import *
-from typing import Optional, List
+from typing import Optional, List, Set
 import sys
-import json
-from qt_material import get_theme
+from speedy_iqa.themes import theme_color
 
-from speedy_iqa.utils import ConnectionManager, open_yml_file, setup_logging, find_relative_image_path
+from speedy_iqa.utils import ConnectionManager, open_yml_file, setup_logging, get_image_index
+from speedy_iqa.utils import iter_relative_image_paths
+from speedy_iqa.utils import compare_filenames_to_index, split_image_key, find_reference_path
+from speedy_iqa.session import load_session_summary
+from speedy_iqa.decoders import image_extensions, image_members
+from speedy_iqa.storage import is_storage_root, is_file
 
 if hasattr(sys, '_MEIPASS'):
     # This is a py2app executable
@@ -265,10 +269,9 @@ class LoadMessageBox(QDialog):
         config_label.setStyleSheet("font-size: 14px;")
         config_box_layout.addWidget(config_label)
         config_box_layout.addWidget(self.config_combo)
-        try:
-            combo_text_colour = get_theme(self.settings.value('theme', 'dark_blue.xml'))['secondaryTextColor']
-        except KeyError:
-            combo_text_colour = get_theme(self.settings.value('theme', 'dark_blue.xml'))['secondaryLightColor']
+        combo_text_colour = theme_color(
+            self.settings.value('theme', 'dark_blue.xml'), 'secondaryTextColor', 'secondaryLightColor'
+        )
         self.config_combo.setStyleSheet(f"QComboBox:disabled::item {{ color: {combo_text_colour}; }}")
         self.config_combo.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Fixed)
         config_layout.addLayout(config_box_layout)
@@ -499,10 +502,9 @@ class SetupWindow(QDialog):
         json_selection_layout.addWidget(self.json_label)
         json_selection_layout.addWidget(self.json_button)
 
-        try:
-            help_colour = get_theme(self.settings.value('theme', 'dark_blue.xml'))['secondaryTextColor']
-        except KeyError:
-            help_colour = get_theme(self.settings.value('theme', 'dark_blue.xml'))['secondaryLightColor']
+        help_colour = theme_color(
+            self.settings.value('theme', 'dark_blue.xml'), 'secondaryTextColor', 'secondaryLightColor'
+        )
 
         json_explanation_text = ("<p style='white-space: pre-wrap; width: 100px;'>"
                                  "Progress is stored in a .json file. Please choose the file you wish to load.</p>")
@@ -540,10 +542,9 @@ class SetupWindow(QDialog):
         dcm_layout.addSpacerItem(fixed_spacer)
 
         im_selection_frame = QFrame()
-        try:
-            frame_color = get_theme(self.settings.value('theme', 'dark_blue.xml'))['secondaryLightColor']
-        except KeyError:
-            frame_color = get_theme(self.settings.value('theme', 'dark_blue.xml'))['secondaryColor']
+        frame_color = theme_color(
+            self.settings.value('theme', 'dark_blue.xml'), 'secondaryLightColor', 'secondaryColor'
+        )
 
         im_selection_frame.setObjectName("im_selection_frame")
         im_selection_frame.setStyleSheet(f"#im_selection_frame {{ border: 1px solid {frame_color}; }}")
@@ -700,21 +701,11 @@ class SetupWindow(QDialog):
         ref_dir = os.path.normpath(
             os.path.abspath(self.reference_folder_label.text())
         )
-        image_files = sorted(find_relative_image_path(self.folder_label.text()))
         delimiter = self.delimiter_line_edit.text()
 
-        for i, file in enumerate(image_files):
-            img_extension = os.path.splitext(file)[1]
-            if delimiter:
-                reference_name = file.rsplit(delimiter, 1)[0]
-            else:
-                reference_name = os.path.splitext(os.path.basename(file))[0]
-            reference_name = os.path.basename(reference_name)
-            if not reference_name.endswith(img_extension) and os.path.isfile(
-                    os.path.join(ref_dir, reference_name + img_extension)
-            ):
-                reference_name = reference_name + img_extension
-            if os.path.isfile(os.path.join(ref_dir, reference_name)):
+        # Stop at the first pair, rather than walking the whole image directory
+        for file in iter_relative_image_paths(self.folder_label.text(), image_extensions(), expand=image_members):
+            if is_file(split_image_key(find_reference_path(file, ref_dir, delimiter))[0]):
                 return True
         return False
 
@@ -735,11 +726,11 @@ class SetupWindow(QDialog):
         Overwrite the default accept method to prevent the dialog from closing if the json file is not compatible.
         """
 
-        if not os.path.isdir(self.folder_label.text()) and self.new_json_tickbox.isChecked():
+        if not is_storage_root(self.folder_label.text()) and self.new_json_tickbox.isChecked():
             self.generate_no_image_msg()
             self.button_box.button(QDialogButtonBox.StandardButton.Ok).setEnabled(False)
             return
-        elif not os.path.isdir(self.reference_folder_label.text()) and self.new_json_tickbox.isChecked():
+        elif not is_storage_root(self.reference_folder_label.text()) and self.new_json_tickbox.isChecked():
             self.generate_no_reference_image_msg()
             self.button_box.button(QDialogButtonBox.StandardButton.Ok).setEnabled(False)
             return
@@ -838,7 +829,10 @@ class SetupWindow(QDialog):
         Open file dialog to select JSON file.
         """
         # Open file dialog to select JSON file
-        json_path, _ = QFileDialog.getOpenFileName(self, "Select JSON File", "", "JSON Files (*.json)")
+        json_path, _ = QFileDialog.getOpenFileName(
+            self, "Select Progress File", "", "Progress Files (*.json *.parquet);;JSON Files (*.json);;"
+                                              "Parquet Files (*.parquet)"
+        )
 
         # Update label and save file path
         if json_path:
@@ -857,8 +851,9 @@ class SetupWindow(QDialog):
 
             # Update label and save file path
             if folder_path:
-                img_files = find_relative_image_path(folder_path)
-                if len(img_files) == 0:
+                first_image = next(iter_relative_image_paths(folder_path, image_extensions(), expand=image_members),
+                                   None)
+                if first_image is None:
                     error_msg_box = QMessageBox()
                     error_msg_box.setIcon(QMessageBox.Icon.Warning)
                     error_msg_box.setWindowTitle("Error")
@@ -890,9 +885,8 @@ class SetupWindow(QDialog):
             if folder_path:
                 if os.path.isfile(folder_path):
                     folder_path = os.path.dirname(folder_path)
-                img_files = [f for f in os.listdir(folder_path) if f.endswith((
-                    '.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tiff', '.tif', '.dcm', '.dicom',
-                ))]
+                suffixes = tuple(f".{extension}" for extension in image_extensions())
+                img_files = [f for f in os.listdir(folder_path) if f.lower().endswith(suffixes)]
                 if len(img_files) == 0:
                     error_msg_box = QMessageBox()
                     error_msg_box.setIcon(QMessageBox.Icon.Warning)
@@ -950,16 +944,25 @@ class SetupWindow(QDialog):
                              QMessageBox.StandardButton.Ok,
                              defaultButton=QMessageBox.StandardButton.Ok)
 
-    def generate_json_image_incompatibility_msg(self):
+    def generate_json_image_incompatibility_msg(self, missing: Optional[Set[str]] = None):
         """
         Generate a message box to inform the user that the selected json file is incompatible with the image folder
         as it contains image filenames which are not present in the folder.
+
+        :param missing: the image files in the json file which are not in the image folder
+        :type missing: Optional[Set[str]]
         """
+        missing_text = ""
+        if missing:
+            examples = sorted(missing)[:3]
+            missing_text = (f"{len(missing)} image file/s are missing, e.g. {', '.join(examples)}"
+                            f"{'...' if len(missing) > len(examples) else ''}\n\n")
         QMessageBox.critical(self,
                              "Error",
                              f"JSON - IMAGE FOLDER CONFLICT!\n\n"
                              f"The selected json file has image files which are not present in the selected image "
                              f"directory.\n\n"
+                             f"{missing_text}"
                              f"Please select a new json file or image directory. Alternatively, start again and select "
                              f"a new config file. ",
                              QMessageBox.StandardButton.Ok,
@@ -1021,24 +1024,25 @@ class SetupWindow(QDialog):
 
         return True
 
-    def check_json_image_compatibility(self, filenames: List[str]) -> bool:
+    def check_json_image_compatibility(self, filenames: Set[str]) -> bool:
         """
         Check if the selected json file is compatible with the image folder.
 
-        :param filenames: list of image filenames in the json file
-        :type filenames: list
+        :param filenames: set of image filenames in the json file
+        :type filenames: set
         :return: True if compatible, False otherwise
         :rtype: bool
         """
-        if os.path.isdir(self.folder_label.text()):
-            imgs = sorted([f for f in os.listdir(self.folder_label.text()) if f.endswith((
-                '.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tiff', '.tif', '.dcm', '.dicom',
-            ))])
-            # Get list of dcms in json
-            for file in filenames:
-                if file not in imgs:
-                    self.generate_json_image_incompatibility_msg()
-                    return False
+        if is_storage_root(self.folder_label.text()):
+            index = get_image_index(self.folder_label.text(), image_extensions(), expand=image_members)
+            missing, extra = compare_filenames_to_index(filenames, index)
+            if extra:
+                logger.info(f"{len(extra)} images in {self.folder_label.text()} are not in the selected json file.")
+            if missing:
+                logger.warning(f"{len(missing)} images in the selected json file are not in "
+                               f"{self.folder_label.text()}.")
+                self.generate_json_image_incompatibility_msg(missing)
+                return False
             return True
         elif self.new_json_tickbox.isChecked():
             self.generate_no_image_msg()
@@ -1083,30 +1087,23 @@ class SetupWindow(QDialog):
 
     def load_json_filenames_findings(self, json_path: str):
         """
-        Load the filenames and findings from a json file.
+        Load the filenames and findings from a json or parquet session file. The session is only parsed once for
+        each version of the file, so repeated checks are cheap.
 
-        :param json_path: path to the json file
+        :param json_path: path to the session file
         :type json_path: str
+        :return: the set of filenames, and the unique checkbox names, checkbox values and radiobutton group names
+        :rtype: Tuple[Set[str], List[str], List, List[str]]
         """
 
-        with open(json_path, 'r') as file:
-            data = json.load(file)
+        summary = load_session_summary(json_path)
 
-        filenames = [entry['filename'] for entry in data['files']]
-        self.folder_label.setText(self.settings.value(data['image_directory'], self.folder_label.text()))
+        self.folder_label.setText(self.settings.value(summary.image_directory, self.folder_label.text()))
         self.reference_folder_label.setText(
-            self.settings.value(data['reference_image_directory'], self.reference_folder_label.text())
+            self.settings.value(summary.reference_image_directory, self.reference_folder_label.text())
         )
-        cboxes = [cbox for entry in data['files'] if 'checkboxes' in entry for cbox in entry['checkboxes'].keys()]
-        cbox_values = [value for entry in data['files'] if 'checkboxes' in entry for value in
-                       entry['checkboxes'].values()]
-        radiobs = [rb for entry in data['files'] if 'radiobuttons' in entry for rb in entry['radiobuttons'].keys()]
-
-        unique_cboxes = sorted(list(set(cboxes)))
-        unique_cbox_values = sorted(list(set(cbox_values)))
-        unique_radiobs = sorted(list(set(radiobs)))
 
-        return filenames, unique_cboxes, unique_cbox_values, unique_radiobs
+        return summary.filenames, summary.unique_cboxes, summary.unique_cbox_values, summary.unique_radiobs
 
     def show_help_box(self, message):
         QMessageBox.information(self, "Help", message)